@@ -1,37 +1,81 @@
 import falcon
-import logging, sys
-import os
-import json
 from signer.staking import StopStaking, StartStaking
 from signer.sign import KeysResource
+from signer.batch import BatchResource
+from signer.asgi import AsgiApp
+from signer.worker import QueueStatsResource
+from signer.watermark import HighWatermark, WATERMARKS_FILE
+from signer.registry import KeyRegistry, KNOWN_KEYS_FILE
 from signer.configuration import Register, ResetDevice, ChangePin
-from signer.authorized import Authorized
-from signer.middleware import RequestLogger, RequireJSON
+from signer.authorized import Authorized, AuthorizedKeys, AUTHORIZED_KEYS_FILE
+from signer.middleware import RequestLogger, RequireJSON, RequestRecorder, RECORD_FILE
+from signer.metrics import MetricsResource
+from signer.health import DeviceMonitor, HealthResource
+from signer.logs import setup_logging
+from signer.profiling import ADMIN_TOKEN, MemorySnapshot, Profile, RequestProfile, RequestProfiler
+from signer.public_keys import PublicKeyCache, PUBLIC_KEYS_FILE
+from signer.broker import BROKER_SOCKET, BrokerClient, RemoteKeyRegistry, RemoteMonitor, RemoteWatermark
+from signer import startup, trezor_handler
 
-# set logging level from ENV variable
-log_level = logging.INFO
-try:
-    if os.environ['LOGLEVEL'] == "DEBUG":
-        log_level = logging.DEBUG
-except KeyError:
-    pass
+# LOGLEVEL, LOG_FORMAT (text or json) and LOG_SAMPLE_RATE from the environment, written by a background thread
+setup_logging()
+# threads do not survive a fork, a preloaded worker starts its own log thread
+startup.after_fork(setup_logging)
 
-logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(message)s', level=log_level)
+# SIGNER_BROKER: the devices, the watermarks and the registry writes belong to the broker process
+# (python -m signer.broker), the workers only parse the requests and send the device calls to it
+broker = BrokerClient(BROKER_SOCKET) if BROKER_SOCKET else None
+if broker is not None:
+    trezor_handler.use_broker(broker)
 
+# registered keys, shared with the other workers through the registry files
+keys_config = RemoteKeyRegistry(broker, KNOWN_KEYS_FILE) if broker is not None else KeyRegistry(KNOWN_KEYS_FILE)
 
-with open('signer/known_keys.json', 'r', os.O_NONBLOCK) as myfile:
-    json_blob = myfile.read().replace('\n', '')
-    logging.info('Parsed keys.json successfully as JSON')
-    keys_config = json.loads(json_blob)
+# serve the public keys from memory, fetch the missing ones in the background
+public_keys = PublicKeyCache(PUBLIC_KEYS_FILE)
+startup.in_worker(public_keys.warm_up, keys_config)
 
 # create application instance
-api = application = falcon.API(middleware=[RequestLogger(), RequireJSON()])
+# the request profiler only runs with an admin token, see signer.profiling
+request_profiler = RequestProfiler() if ADMIN_TOKEN else None
+middleware = [RequestLogger(), RequireJSON(exempt_paths=('/metrics', '/health', '/admin/profile', '/admin/profile/requests'))]
+if request_profiler is not None:
+    middleware.append(request_profiler)
+# capture of the sign requests for python -m benchmarks.replay
+request_recorder = RequestRecorder(RECORD_FILE) if RECORD_FILE else None
+if request_recorder is not None:
+    middleware.append(request_recorder)
+api = application = falcon.API(middleware=middleware)
 
 # add routes to endpoints
-api.add_route('/keys/{pkh}', KeysResource(keys_config))
-api.add_route('/register', Register(keys_config))
+watermarks = RemoteWatermark(broker) if broker is not None else HighWatermark(WATERMARKS_FILE)
+# sign requests must be signed by one of these keys, when there are any
+authorized_keys = AuthorizedKeys.load(AUTHORIZED_KEYS_FILE)
+keys_resource = KeysResource(keys_config, public_keys, watermarks=watermarks, authorized_keys=authorized_keys)
+api.add_route('/keys/{pkh}', keys_resource)
+batch_resource = BatchResource(keys_resource)
+api.add_route('/keys/{pkh}/batch', batch_resource)
+api.add_route('/register', Register(keys_config, public_keys, keys_resource.devices))
 api.add_route('/start_staking', StartStaking())
 api.add_route('/stop_staking', StopStaking())
-api.add_route('/reset_device', ResetDevice())
+api.add_route('/reset_device', ResetDevice(public_keys, keys_resource.signatures))
 api.add_route('/change_pin', ChangePin())
-api.add_route('/authorized_keys', Authorized())
\ No newline at end of file
+api.add_route('/authorized_keys', Authorized(authorized_keys))
+api.add_route('/queue_stats', QueueStatsResource(broker if broker is not None else keys_resource.devices))
+api.add_route('/metrics', MetricsResource())
+if ADMIN_TOKEN:
+    api.add_route('/admin/profile', Profile())
+    api.add_route('/admin/profile/requests', RequestProfile(request_profiler))
+    api.add_route('/admin/memory', MemorySnapshot())
+
+# heartbeat of the devices, /health serves their last known state
+monitor = RemoteMonitor(broker) if broker is not None else DeviceMonitor(keys_resource.devices)
+startup.in_worker(monitor.start)
+api.add_route('/health', HealthResource(monitor))
+
+# a forked worker opens its own device session and watermark file lock (or broker connections)
+startup.after_fork(trezor_handler.forget_sessions)
+startup.after_fork(keys_resource.watermarks.reopen)
+
+# asyncio serving mode, e.g. gunicorn -k uvicorn.workers.UvicornWorker app:asgi_app
+asgi_app = AsgiApp(api, keys_resource, batch_resource, request_profiler, request_recorder)
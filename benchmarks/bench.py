@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+import tracemalloc
+
+import falcon
+from falcon import testing
+
+from signer import decoders, trezor_handler
+from signer.middleware import RequestLogger, RequireJSON
+from signer.sign import KeysResource, OCTET_STREAM
+from signer.signatures import SignatureCache
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_FILE = os.path.join(BENCHMARKS_DIR, 'corpus.json')
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+PKH = "tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"
+SIGNATURE = "edsigtXomBKi5CTRf5cjATJWSyaRvhfYNHqSUGrn4SdbYRcGwQrUGjzEfQDTuqHhuA8b2d8NarZjz8TRf65WkpQmo423BtomS8Q"
+
+# a result is a regression when it is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.2
+
+
+class NoWatermark(object):
+    # the same levels are signed over and over again
+    def check(self, pkh, chain_id, kind, level):
+        pass
+
+
+def stub_device():
+    # the signature is constant, the benchmarks measure everything around the device call
+    trezor_handler.sign_baking = lambda msg, path: SIGNATURE
+    trezor_handler.sign_non_baking_op = lambda msg, path: SIGNATURE
+
+
+def load_corpus(filename=CORPUS_FILE):
+    with open(filename, 'r') as myfile:
+        return dict((name, bytes.fromhex(payload)) for name, payload in json.load(myfile).items())
+
+
+def make_client(keys_resource):
+    api = falcon.API(middleware=[RequestLogger(), RequireJSON()])
+    api.add_route('/keys/{pkh}', keys_resource)
+    return testing.TestClient(api)
+
+
+def post(client, body, content_type='application/json'):
+    result = client.simulate_post('/keys/' + PKH, body=body, headers={'Content-Type': content_type})
+    if result.status != falcon.HTTP_200:
+        raise RuntimeError(result.text)
+    return result
+
+
+def collect_benchmarks(corpus):
+    # nothing is cached, every request goes through the whole pipeline
+    keys_resource = KeysResource({PKH: "m/44'/1729'/3'"}, watermarks=NoWatermark(), signatures=SignatureCache(max_size=0))
+    client = make_client(keys_resource)
+    benchmarks = []
+
+    delegation = corpus['delegation']
+    benchmarks.append(('decode_manager_numbers', lambda: decoders.decode_manager_numbers(delegation, 56)))
+
+    for name, msg_bytes in sorted(corpus.items()):
+        operation = keys_resource.decode_message(msg_bytes)
+        body = json.dumps(msg_bytes.hex())
+
+        benchmarks.append(('decode_message[{}]'.format(name),
+                           lambda msg_bytes=msg_bytes: keys_resource.decode_message(msg_bytes)))
+        benchmarks.append(('to_proto[{}]'.format(name),
+                           lambda msg_bytes=msg_bytes, operation=operation: keys_resource.to_proto(msg_bytes, operation)))
+        benchmarks.append(('parse_message[{}]'.format(name),
+                           lambda msg_bytes=msg_bytes: keys_resource.parse_message(msg_bytes)))
+        benchmarks.append(('on_post[{}]'.format(name),
+                           lambda body=body: post(client, body)))
+        benchmarks.append(('on_post_raw[{}]'.format(name),
+                           lambda msg_bytes=msg_bytes: post(client, msg_bytes, OCTET_STREAM)))
+
+    return benchmarks
+
+
+def measure(func, repeat=3):
+    # best of repeat runs, each long enough to be measured reliably
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return number / best
+
+
+def measure_allocations(func):
+    # peak of the memory allocated by a single call
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(benchmarks, name_filter=None):
+    results = {}
+    for name, func in benchmarks:
+        if name_filter and name_filter not in name:
+            continue
+        try:
+            func()
+        except Exception as e:
+            # e.g. a trezorlib without the staking messages can not build the baker operations
+            print("{:<50} skipped: {}".format(name, e))
+            continue
+        results[name] = {"ops_per_sec": measure(func), "peak_bytes": measure_allocations(func)}
+    return results
+
+
+def report(results, baseline, tolerance):
+    regressions = []
+    print("{:<50} {:>14} {:>12} {:>10}".format("benchmark", "ops/sec", "peak bytes", "vs base"))
+    for name, result in sorted(results.items()):
+        delta = ''
+        if name in baseline:
+            ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+            delta = "{:+.1f}%".format((ratio - 1) * 100)
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                delta += ' !'
+        print("{:<50} {:>14.0f} {:>12} {:>10}".format(name, result["ops_per_sec"], result["peak_bytes"], delta))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the parsing and dispatch hot path")
+    parser.add_argument('--corpus', default=CORPUS_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--filter', help="only run benchmarks containing this string")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+    stub_device()
+    results = run(collect_benchmarks(load_corpus(args.corpus)), args.filter)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as myfile:
+            baseline = json.load(myfile)
+
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as myfile:
+            json.dump(baseline, myfile, indent=4, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+    elif regressions:
+        print("Regressions: {}".format(", ".join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from benchmarks.bench import load_corpus
+from signer import decoders
+
+CHAIN_ID = bytes.fromhex("3bb717ee")
+BRANCH = bytes.fromhex("53f552f0e22a364259848b1e13f124cbae330569f10777e9fa1b1cd8ea57dac0")
+
+# byte offset of the level in a block header: magic byte and chain id come first
+BLOCK_LEVEL_OFFSET = 5
+
+# byte offset of the fee in a delegation: magic byte, branch, tag and source come first, the counter follows it
+FEE_OFFSET = 1 + 32 + 1 + decoders.CONTRACT_ID.size
+
+PERCENTILES = (0.5, 0.99, 0.999)
+
+
+class Connection(threading.local):
+    # one keep-alive connection per driver thread
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            self.connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+def endorsement(slot, level):
+    return bytes([2]) + CHAIN_ID + BRANCH + bytes([0, slot % 256]) + level.to_bytes(4, 'big')
+
+
+def block(template, level):
+    return template[:BLOCK_LEVEL_OFFSET] + level.to_bytes(4, 'big') + template[BLOCK_LEVEL_OFFSET + 4:]
+
+
+def zarith(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def delegation(template, counter):
+    # the delegation of the corpus with another counter, a resent payload is answered by the signature cache
+    start = decoders.skip_zarith(template, FEE_OFFSET)
+    end = decoders.skip_zarith(template, start)
+    return template[:start] + zarith(counter) + template[end:]
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(round(fraction * (len(latencies) - 1))))]
+
+
+class LoadTest(object):
+    # Replays baker-like traffic: every block interval each delegate endorses, now and then one of them bakes
+    # a block, and transactions (delegations) arrive at a steady rate in between.
+
+    def __init__(self, url, delegates, block_time, block_probability, tx_rate, concurrency):
+        self.connection = Connection(url)
+        self.delegates = delegates
+        self.block_time = block_time
+        self.block_probability = block_probability
+        self.tx_rate = tx_rate
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.corpus = load_corpus()
+
+        self.results = []
+        self.results_lock = threading.Lock()
+        self.pkhs = []
+
+    def register(self):
+        for index in range(self.delegates):
+            status, body = self.connection.request('POST', '/register', json.dumps("m/44'/1729'/{}'".format(index)))
+            if status != 200:
+                raise RuntimeError("Could not register delegate {}: {}".format(index, body))
+            self.pkhs.append(json.loads(body)["pkh"])
+
+    def sign(self, kind, pkh, msg_bytes):
+        start = time.perf_counter()
+        try:
+            status, _ = self.connection.request('POST', '/keys/' + pkh, json.dumps(msg_bytes.hex()))
+            ok = status == 200
+        except Exception:
+            ok = False
+        latency = time.perf_counter() - start
+
+        with self.results_lock:
+            self.results.append((kind, latency, ok))
+
+    def run(self, duration):
+        # start above every level signed by an earlier run, the watermarks would reject them otherwise
+        level = int(time.time())
+        end = time.time() + duration
+        started = time.time()
+
+        stopped = threading.Event()
+        transactions = threading.Thread(target=self._transactions, args=(end, stopped))
+        transactions.daemon = True
+        transactions.start()
+
+        while time.time() < end:
+            tick = time.time()
+            level += 1
+            for slot, pkh in enumerate(self.pkhs):
+                self.executor.submit(self.sign, 'endorsement', pkh, endorsement(slot, level))
+            if random.random() < self.block_probability:
+                self.executor.submit(self.sign, 'block', random.choice(self.pkhs),
+                                     block(self.corpus['block'], level))
+            time.sleep(max(0.0, self.block_time - (time.time() - tick)))
+
+        # no transaction may be submitted after the shutdown
+        stopped.set()
+        transactions.join()
+        self.executor.shutdown(wait=True)
+        return time.time() - started
+
+    def _transactions(self, end, stopped):
+        if not self.tx_rate:
+            return
+        # start above the counters of an earlier run, like the levels
+        counter = int(time.time())
+        while time.time() < end and not stopped.is_set():
+            counter += 1
+            self.executor.submit(self.sign, 'transaction', random.choice(self.pkhs),
+                                 delegation(self.corpus['delegation'], counter))
+            stopped.wait(random.expovariate(self.tx_rate))
+
+    def report(self, elapsed):
+        print("{:<12} {:>8} {:>8} {:>10} {:>10} {:>10}".format("kind", "count", "errors", "p50 ms", "p99 ms", "p999 ms"))
+        for kind in ('block', 'endorsement', 'transaction', 'all'):
+            results = [result for result in self.results if kind in ('all', result[0])]
+            if not results:
+                continue
+            latencies = sorted(latency * 1000 for _, latency, _ in results)
+            errors = len([result for result in results if not result[2]])
+            print("{:<12} {:>8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                kind, len(results), errors, *[percentile(latencies, fraction) for fraction in PERCENTILES]))
+        print("throughput: {:.1f} signatures/s over {:.1f} s".format(len(self.results) / elapsed, elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay baker traffic against a running signer")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--delegates', type=int, default=8, help="number of baking keys, each endorses every block")
+    parser.add_argument('--block-time', type=float, default=1.0, help="seconds between two levels")
+    parser.add_argument('--block-probability', type=float, default=0.3, help="chance to bake the block of a level")
+    parser.add_argument('--tx-rate', type=float, default=2.0, help="transactions per second")
+    parser.add_argument('--concurrency', type=int, default=32, help="concurrent connections")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds")
+    args = parser.parse_args(argv)
+
+    load_test = LoadTest(args.url, args.delegates, args.block_time, args.block_probability, args.tx_rate,
+                         args.concurrency)
+    load_test.register()
+    elapsed = load_test.run(args.duration)
+    load_test.report(elapsed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
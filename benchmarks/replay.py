@@ -0,0 +1,134 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench import make_client
+from benchmarks.loadtest import PERCENTILES, percentile
+from signer import trezor_handler
+from signer.session import DeviceSession
+from signer.sign import KeysResource, OCTET_STREAM
+from signer.watermark import HighWatermark
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'replay_baseline.json')
+
+
+def load_records(filename):
+    # the sign requests captured by signer.middleware.RequestRecorder, in the order they arrived
+    with open(filename, 'r') as myfile:
+        records = [json.loads(line) for line in myfile if line.strip()]
+    return sorted(records, key=lambda record: record["ts"])
+
+
+class Replay(object):
+    # Pushes a captured corpus through KeysResource and the falcon middleware, signed by the simulated device.
+    # speed 1 keeps the original pace, 10 replays ten times faster, 0 sends everything as fast as possible.
+
+    def __init__(self, records, speed=1.0, concurrency=32):
+        self.records = records
+        self.speed = speed
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        pkhs = sorted(set(record["pkh"] for record in records))
+        # every captured key signs with a simulated key of its own, fresh watermarks for every replay
+        keys_config = dict((pkh, "m/44'/1729'/{}'".format(index)) for index, pkh in enumerate(pkhs))
+        self.keys_resource = KeysResource(keys_config, watermarks=HighWatermark())
+        self.client = make_client(self.keys_resource)
+
+        self.results = []
+        self.results_lock = threading.Lock()
+
+    def sign(self, record):
+        msg_bytes = bytes.fromhex(record["payload"])
+        kind = self.keys_resource.operation_kind(msg_bytes)
+        start = time.perf_counter()
+        result = self.client.simulate_post('/keys/' + record["pkh"], body=msg_bytes,
+                                           headers={'Content-Type': OCTET_STREAM})
+        latency = time.perf_counter() - start
+
+        with self.results_lock:
+            # a request is fine when it ends like it did when it was captured
+            self.results.append((kind, latency, int(result.status.split(' ', 1)[0]) == record.get("status", 200)))
+
+    def run(self):
+        started = time.perf_counter()
+        first = self.records[0]["ts"] if self.records else 0
+        for record in self.records:
+            if self.speed:
+                delay = (record["ts"] - first) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.executor.submit(self.sign, record)
+
+        self.executor.shutdown(wait=True)
+        return time.perf_counter() - started
+
+    def summary(self, elapsed):
+        summary = {}
+        for kind in sorted(set(result[0] for result in self.results)) + ['all']:
+            results = [result for result in self.results if kind in ('all', result[0])]
+            latencies = sorted(latency * 1000 for _, latency, _ in results)
+            summary[kind] = {
+                "count": len(results),
+                "mismatches": len([result for result in results if not result[2]]),
+                "latency_ms": dict(("p{:g}".format(fraction * 100), percentile(latencies, fraction))
+                                   for fraction in PERCENTILES),
+            }
+        summary["all"]["throughput"] = len(self.results) / elapsed if elapsed else 0.0
+        return summary
+
+
+def _delta(value, base):
+    return "{:+.1f}%".format((value / base - 1) * 100) if base else ''
+
+
+def report(summary, baseline):
+    names = list(summary["all"]["latency_ms"])
+    print(("{:<14} {:>8} {:>10}" + " {:>18}" * len(names)).format("kind", "count", "mismatch", *names))
+    for kind, result in sorted(summary.items()):
+        base = baseline.get(kind, {}).get("latency_ms", {})
+        print(("{:<14} {:>8} {:>10}" + " {:>18}" * len(names)).format(
+            kind, result["count"], result["mismatches"],
+            *["{:.2f} {}".format(result["latency_ms"][name], _delta(result["latency_ms"][name], base.get(name)))
+              for name in names]))
+
+    throughput = summary["all"]["throughput"]
+    print("throughput: {:.1f} signatures/s {}".format(
+        throughput, _delta(throughput, baseline.get("all", {}).get("throughput"))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured sign requests against the simulated device")
+    parser.add_argument('corpus', help="JSONL file written by the request recorder (SIGNER_RECORD)")
+    parser.add_argument('--speed', type=float, default=1.0, help="1 original pace, 0 as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="results of an earlier build to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+    trezor_handler.session = DeviceSession(backend='simulator')
+
+    replay = Replay(load_records(args.corpus), args.speed, args.concurrency)
+    summary = replay.summary(replay.run())
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as myfile:
+            baseline = json.load(myfile)
+    report(summary, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as myfile:
+            json.dump(summary, myfile, indent=4, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
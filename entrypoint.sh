@@ -25,4 +25,16 @@ pkill -f gunicorn
 
 echo " Running gunicorn:"
 
-gunicorn --bind="0.0.0.0:5000" app:api
+# gunicorn.conf.py preloads the app in the master and reopens the device session in every worker,
+# SIGNER_PRELOAD=0 imports the app in each worker instead
+# SIGNER_BROKER=/run/signer.sock starts the broker, which owns the devices, and the workers send it the device calls
+# SERVER_MODE=asgi serves the asyncio app: one worker process owns the device, requests are handled concurrently
+if [ -n "$SIGNER_BROKER" ]; then
+    python -m signer.broker "$SIGNER_BROKER" &
+    sleep 1
+fi
+if [ "$SERVER_MODE" = "asgi" ]; then
+    gunicorn --config=gunicorn.conf.py --workers=1 --worker-class=uvicorn.workers.UvicornWorker app:asgi_app
+else
+    gunicorn --config=gunicorn.conf.py app:api
+fi
@@ -0,0 +1,24 @@
+import os
+import time
+
+from signer import startup
+
+# gunicorn -c gunicorn.conf.py app:api
+#
+# The app is imported once by the master and the workers are forked from it: the modules and the key
+# registry are shared copy-on-write. SIGNER_PRELOAD=0 imports the app in every worker instead.
+preload_app = os.environ.get('SIGNER_PRELOAD', '1') == '1'
+startup.PRELOAD = preload_app
+
+bind = os.environ.get('SIGNER_BIND', '0.0.0.0:5000')
+
+_config_loaded = time.perf_counter()
+
+
+def when_ready(server):
+    if preload_app:
+        startup.preload(time.perf_counter() - _config_loaded)
+
+
+def post_fork(server, worker):
+    startup.run_after_fork()
@@ -0,0 +1,288 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from urllib.parse import parse_qs
+
+from signer.authorized import AuthenticationError
+from signer.batch import BatchResource
+from signer.logs import request_log
+from signer.metrics import Timer, metrics
+from signer.sign import KeysResource, NO_KEYS_BODY, OCTET_STREAM, public_key_body, signature_body
+from signer.worker import PRIORITY_ADMIN, PRIORITY_TRANSACTION, parse_budget
+
+KEYS_PREFIX = '/keys/'
+BATCH_SUFFIX = '/batch'
+DEADLINE_HEADER = KeysResource.DEADLINE_HEADER.lower().encode()
+
+# routes which never touch the device, served right away instead of through the device worker
+LOCAL_PATHS = ('/health', '/metrics', '/queue_stats')
+# the admin routes never touch the device, a memory snapshot takes a while, they are served on a thread
+ADMIN_PREFIX = '/admin/'
+# routes which queue their own device jobs, waiting for them on the device worker would never end
+THREAD_PATHS = ('/register',)
+
+SIGN_CONTENT_TYPES = (b'application/json', OCTET_STREAM.encode())
+
+
+class AsgiApp(object):
+    # Asyncio serving mode: the signing endpoints (and the batches) are handled on the event loop, only the
+    # device calls go through the single device worker. All other (administrative) routes are served by the
+    # falcon api, also on the device worker, since each of them talks to the device anyway (except the
+    # LOCAL_PATHS, the admin routes and the THREAD_PATHS).
+
+    MAX_BODY_SIZE = KeysResource.MAX_BODY_SIZE
+
+    def __init__(self, api, keys_resource, batch_resource=None, profiler=None, recorder=None):
+        self.api = api
+        self.keys_resource = keys_resource
+        self.batch_resource = batch_resource if batch_resource is not None else BatchResource(keys_resource)
+        # the falcon middleware never sees the requests served here, they are passed to these directly
+        self.profiler = profiler
+        self.recorder = recorder
+        self.worker = keys_resource.worker
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        path = scope['path']
+        method = scope['method']
+        # a batch carries up to BatchResource.MAX_BATCH_SIZE payloads
+        limit = self.batch_resource.MAX_BODY_SIZE if self._is_batch(path) else self.MAX_BODY_SIZE
+        body = await self._read_body(scope, receive, limit)
+
+        if body is None:
+            await self._send_json(send, 413, {"Error": "Request body too large"})
+        elif path.startswith(KEYS_PREFIX) and '/' not in path[len(KEYS_PREFIX):] and method in ('GET', 'POST'):
+            pkh = path[len(KEYS_PREFIX):]
+            content_type = self._header(scope, b'content-type')
+            if method == 'POST' and not any(accepted in content_type for accepted in SIGN_CONTENT_TYPES):
+                await self._send_json(send, 415, {"title": "This API only supports requests encoded as JSON."})
+                return
+            if method == 'GET':
+                status, response_body = await self.get_public_key(pkh)
+            else:
+                try:
+                    budget_ms = parse_budget(self._header(scope, DEADLINE_HEADER).decode('latin-1'))
+                except ValueError as e:
+                    await self._send_json(send, 400, {"Error": str(e)})
+                    return
+                status, response_body = await self.sign(pkh, body, content_type.decode('latin-1'), budget_ms,
+                                                        self._authentication(scope))
+            await self._send_body(send, status, response_body)
+            self._count_request()
+        elif self._is_batch(path) and method == 'POST':
+            # waits for the device workers, a batch run on a device worker would wait for itself
+            if b'application/json' not in self._header(scope, b'content-type'):
+                await self._send_json(send, 415, {"title": "This API only supports requests encoded as JSON."})
+                return
+            status, response_body = await self.sign_batch(path[len(KEYS_PREFIX):-len(BATCH_SUFFIX)], body)
+            await self._send_body(send, status, response_body)
+            self._count_request()
+        elif path in LOCAL_PATHS:
+            await self._call_wsgi(scope, body, send, on_worker=False)
+        elif path.startswith(ADMIN_PREFIX) or path in THREAD_PATHS:
+            await self._call_wsgi(scope, body, send, on_worker=False, in_thread=True)
+        else:
+            await self._call_wsgi(scope, body, send)
+
+    async def get_public_key(self, pkh):
+        keys_resource = self.keys_resource
+        # an unknown key refreshes the registry from its files, not on the event loop
+        if not await self._in_thread(keys_resource.keys_config.__contains__, pkh):
+            return 500, NO_KEYS_BODY
+
+        try:
+            pk = await self._in_thread(keys_resource.public_keys.get, pkh)
+            if pk is None:
+                pk = await asyncio.wrap_future(keys_resource.devices.submit(
+                    keys_resource.keys_config[pkh], keys_resource.public_keys.fetch, pkh, priority=PRIORITY_TRANSACTION))
+            return 200, public_key_body(pk)
+        except Exception as e:
+            logging.error("Error in retrieving pk: %s", e)
+            return 500, json.dumps({"Error": "Exception in retrieving pk"}).encode()
+
+    async def sign(self, pkh, body, content_type='application/json', budget_ms=None, authentication=None):
+        request_log.info("Signing received data for %s", pkh)
+        if not await self._in_thread(self.keys_resource.keys_config.__contains__, pkh):
+            metrics.count('unknown', '', 'unknown_key')
+            return 500, NO_KEYS_BODY
+
+        timer = Timer()
+        kind = 'unknown'
+        start = time.time()
+        msg_bytes = None
+        try:
+            # decoding and parsing overlap with the signature the device is currently computing
+            msg_bytes = KeysResource.decode_body(body, content_type, timer)
+            kind = self.keys_resource.operation_kind(msg_bytes)
+            future = await self._in_thread(self._submit, pkh, msg_bytes, budget_ms, authentication, timer)
+
+            signature = await asyncio.wrap_future(future)
+            timer.record(kind, pkh)
+            metrics.count(kind, pkh, 'ok')
+            status, response_body = 200, signature_body(signature)
+        except AuthenticationError as e:
+            logging.warning("Refused unauthenticated request for %s: %s", pkh, e)
+            metrics.count(kind, pkh, 'unauthorized')
+            status, response_body = 401, json.dumps({"Error": str(e)}).encode()
+        except Exception as e:
+            logging.error("Error in signing: %s", e)
+            metrics.count(kind, pkh, 'error')
+            status, response_body = 500, json.dumps({"Error": str(e)}).encode()
+
+        if self.recorder is not None and msg_bytes is not None:
+            self.recorder.record(pkh, msg_bytes, status, start)
+        return status, response_body
+
+    async def sign_batch(self, pkh, body):
+        try:
+            items = self.batch_resource.parse(body)
+        except ValueError as e:
+            return 400, json.dumps({"Error": str(e)}).encode()
+
+        results = [None] * len(items)
+        try:
+            for indexes, future in await self._in_thread(self.batch_resource.submit, pkh, items):
+                try:
+                    part = await asyncio.wrap_future(future)
+                except Exception as e:
+                    part = self.batch_resource.failed(indexes, e)
+                for index, result in zip(indexes, part):
+                    results[index] = result
+        except Exception as e:
+            logging.error("Error in batch signing: %s", e)
+            return 500, json.dumps({"Error": str(e)}).encode()
+        return 200, json.dumps(results).encode()
+
+    def _submit(self, pkh, msg_bytes, budget_ms, authentication, timer):
+        # on a thread: the authentication verifies an ed25519 signature, the watermark check of the prepared
+        # message locks, appends and fsyncs its log (or asks the broker), neither may stop the event loop
+        self.keys_resource.authorized_keys.authenticate(pkh, msg_bytes, authentication)
+        return self.keys_resource.submit(pkh, msg_bytes, budget_ms, timer)
+
+    @staticmethod
+    def _in_thread(func, *args):
+        return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _count_request(self):
+        if self.profiler is not None:
+            self.profiler.count_request()
+
+    @staticmethod
+    def _is_batch(path):
+        pkh = path[len(KEYS_PREFIX):-len(BATCH_SUFFIX)]
+        return path.startswith(KEYS_PREFIX) and path.endswith(BATCH_SUFFIX) and pkh and '/' not in pkh
+
+    @staticmethod
+    def _header(scope, name):
+        for header, value in scope.get('headers', []):
+            if header == name:
+                return value
+        return b''
+
+    @staticmethod
+    def _authentication(scope):
+        query_string = scope.get('query_string', b'')
+        if not query_string:
+            return None
+        values = parse_qs(query_string.decode('latin-1')).get(KeysResource.AUTHENTICATION_PARAM)
+        return values[0] if values else None
+
+    def _device(self, func, *args, priority=PRIORITY_ADMIN):
+        return asyncio.wrap_future(self.worker.submit(func, *args, priority=priority))
+
+    async def _read_body(self, scope, receive, limit):
+        # refused before reading when the announced length is too large, otherwise as soon as the limit is passed
+        content_length = self._header(scope, b'content-length')
+        if content_length.isdigit() and int(content_length) > limit:
+            return None
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > limit:
+                return None
+            more_body = message.get('more_body', False)
+        return bytes(body)
+
+    async def _send_json(self, send, status, data):
+        await self._send_body(send, status, json.dumps(data).encode())
+
+    @staticmethod
+    async def _send_body(send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _call_wsgi(self, scope, body, send, on_worker=True, in_thread=False):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def call():
+            return b''.join(self.api(self._wsgi_environ(scope, body), start_response))
+
+        if on_worker:
+            response_body = await self._device(call)
+        elif in_thread:
+            response_body = await self._in_thread(call)
+        else:
+            response_body = call()
+        await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        await send({'type': 'http.response.body', 'body': response_body})
+
+    @staticmethod
+    def _wsgi_environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                environ['HTTP_' + name] = value
+
+        return environ
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -1,8 +1,135 @@
+import hashlib
 import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from signer.encoding import b58decode_check, b58encode_check, decode_pkh, EDPK_PREFIX, EDSIG_PREFIX, TZ1_PREFIX
+
+# Public keys (edpk...) of the bakers allowed to sign, a json list. Without the file requests are not authenticated.
+AUTHORIZED_KEYS_FILE = os.environ.get('AUTHORIZED_KEYS_FILE', 'signer/authorized_keys.json')
+
+# the tag of a sign request in the message a baker signs to authenticate it, as in tezos' remote signer
+AUTHENTICATION_TAG = b'\x04'
+
+
+class AuthenticationError(ValueError):
+    pass
+
+
+def _verifier(public_key):
+    # libsodium when pynacl is installed, trezorlib's pure python ed25519 otherwise (milliseconds per check)
+    try:
+        from nacl.exceptions import BadSignatureError
+        from nacl.signing import VerifyKey
+    except ImportError:
+        from trezorlib import _ed25519
+
+        def verify(signature, digest):
+            try:
+                _ed25519.checkvalid(signature, digest, public_key)
+                return True
+            except Exception:
+                return False
+        return verify
+
+    verify_key = VerifyKey(public_key)
+
+    def verify(signature, digest):
+        try:
+            verify_key.verify(digest, signature)
+            return True
+        except BadSignatureError:
+            return False
+    return verify
+
+
+def public_key_hash(public_key):
+    return b58encode_check(TZ1_PREFIX, hashlib.blake2b(public_key, digest_size=20).digest())
+
+
+def authentication_digest(pkh, msg_bytes):
+    # what the baker signs: the tag, the key asked to sign and the payload
+    return hashlib.blake2b(AUTHENTICATION_TAG + decode_pkh(pkh) + msg_bytes, digest_size=32).digest()
+
+
+class AuthorizedKeys(object):
+    # The authorized keys are decoded once, a request is checked against the key which authenticated the
+    # last request first. Successful checks are remembered, a retried request costs a hash and a lookup.
+
+    MAX_VERIFIED = 10000
+
+    def __init__(self, public_keys=()):
+        self.lock = threading.Lock()
+        # pkh -> verify function, the key of the last authenticated request first
+        self.keys = OrderedDict()
+        for public_key in public_keys:
+            raw = b58decode_check(EDPK_PREFIX, public_key)
+            self.keys[public_key_hash(raw)] = _verifier(raw)
+
+        # (signature, digest) of recently authenticated requests
+        self.verified = OrderedDict()
+
+    @classmethod
+    def load(cls, filename=AUTHORIZED_KEYS_FILE):
+        try:
+            with open(filename, 'r') as myfile:
+                public_keys = json.load(myfile)
+        except FileNotFoundError:
+            return cls()
+
+        logging.info("Sign requests are authenticated by %d authorized keys", len(public_keys))
+        return cls(public_keys)
+
+    @property
+    def enabled(self):
+        return bool(self.keys)
+
+    def pkhs(self):
+        return list(self.keys)
+
+    def authenticate(self, pkh, msg_bytes, signature):
+        # raise AuthenticationError unless signature (edsig...) is the signature of an authorized key
+        if not self.enabled:
+            return
+        if not signature:
+            raise AuthenticationError("Missing authentication")
+
+        try:
+            raw_signature = b58decode_check(EDSIG_PREFIX, signature)
+        except ValueError:
+            raise AuthenticationError("Invalid authentication")
+
+        digest = authentication_digest(pkh, msg_bytes)
+        key = (raw_signature, digest)
+        with self.lock:
+            if key in self.verified:
+                self.verified.move_to_end(key)
+                return
+            keys = list(self.keys.items())
+
+        for authorized_pkh, verify in keys:
+            if verify(raw_signature, digest):
+                with self.lock:
+                    self.keys.move_to_end(authorized_pkh, last=False)
+                    self.verified[key] = authorized_pkh
+                    if len(self.verified) > self.MAX_VERIFIED:
+                        self.verified.popitem(last=False)
+                return
+
+        raise AuthenticationError("Request not signed by an authorized key")
 
 
 class Authorized(object):
 
+    def __init__(self, authorized_keys=None):
+        self.authorized_keys = authorized_keys if authorized_keys is not None else AuthorizedKeys()
+
     def on_get(self, req, resp):
         resp.content_type = 'application/json'
-        resp.body = json.dumps({})
+        # the remote signer protocol: the hashes of the authorized keys, nothing when requests are not authenticated
+        if self.authorized_keys.enabled:
+            resp.body = json.dumps({"authorized_keys": self.authorized_keys.pkhs()})
+        else:
+            resp.body = json.dumps({})
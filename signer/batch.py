@@ -0,0 +1,144 @@
+import json
+import logging
+from concurrent.futures import Future
+
+import falcon
+from signer import trezor_handler
+from signer.devices import key_device
+from signer.logs import request_log
+from signer.sign import KeysResource
+from signer.worker import deadline_for, priority_for
+
+
+class BatchResource(object):
+    # upper bound of payloads per request, a job holds the device for all of its payloads
+    MAX_BATCH_SIZE = 100
+    # upper bound of a request body, see KeysResource.MAX_BODY_SIZE
+    MAX_BODY_SIZE = MAX_BATCH_SIZE * KeysResource.MAX_BODY_SIZE
+
+    def __init__(self, keys_resource):
+        self.content_type = 'application/json'
+        self.keys_resource = keys_resource
+
+    def on_post(self, req, resp, pkh):
+        resp.content_type = self.content_type
+        # a body announced too large is refused before anything is read, a chunked one is read up to the limit
+        if req.content_length is not None and req.content_length > self.MAX_BODY_SIZE:
+            raise falcon.HTTPPayloadTooLarge('Request body too large')
+        body = req.bounded_stream.read(self.MAX_BODY_SIZE + 1)
+        if len(body) > self.MAX_BODY_SIZE:
+            raise falcon.HTTPPayloadTooLarge('Request body too large')
+
+        try:
+            items = self.parse(body)
+        except ValueError as e:
+            resp.status = falcon.HTTP_400
+            resp.body = json.dumps({"Error": str(e)})
+            return
+
+        results = [None] * len(items)
+        try:
+            for indexes, future in self.submit(pkh, items):
+                try:
+                    part = future.result()
+                except Exception as e:
+                    # e.g. a job whose deadline passed while waiting for the device
+                    part = self.failed(indexes, e)
+                for index, result in zip(indexes, part):
+                    results[index] = result
+        except Exception as e:
+            logging.error("Error in batch signing: %s", e)
+            resp.status = falcon.HTTP_500
+            resp.body = json.dumps({"Error": str(e)})
+            return
+
+        resp.body = json.dumps(results)
+
+    def parse(self, body):
+        # the body is a list of hex payloads signed by pkh, or of {"pkh": ..., "data": ...} objects for other keys
+        try:
+            items = json.loads(body)
+        except ValueError as e:
+            raise ValueError("Invalid JSON: {}".format(e))
+
+        if not isinstance(items, list) or len(items) > self.MAX_BATCH_SIZE:
+            raise ValueError("Expected a list of at most {} payloads".format(self.MAX_BATCH_SIZE))
+        return items
+
+    def submit(self, pkh, items):
+        # queue the payloads, return the future of every job with the indexes of its payloads in items.
+        # The futures are waited for by the caller, never on a device worker (see signer.asgi).
+        request_log.info("Signing batch of %d payloads", len(items))
+
+        # parse and validate everything first, so the device is only held for the signing itself
+        prepared = [self._prepare(pkh, item) for item in items]
+
+        # the payloads of every device and priority class are one job of its worker, queued with the priority and
+        # deadline of a single request of that class: a batch of endorsements and transactions does not hold the
+        # endorsements back, the devices sign their parts in parallel
+        jobs = []
+        for group, indexes in self._groups(prepared).items():
+            part = [prepared[index] for index in indexes]
+            if group is None:
+                # nothing to sign, the errors are the results
+                future = Future()
+                future.set_result(self._sign_all(part))
+            else:
+                device_id, priority = group
+                worker = self.keys_resource.devices.worker(device_id)
+                future = worker.submit(self._sign_all, part, priority=priority, deadline=deadline_for(priority))
+            jobs.append((indexes, future))
+        return jobs
+
+    @staticmethod
+    def failed(indexes, error):
+        logging.error("Error in batch signing: %s", error)
+        return [{"error": str(error)}] * len(indexes)
+
+    @staticmethod
+    def _groups(prepared):
+        # indexes of the payloads per device and priority class, those which failed to prepare under None
+        groups = {}
+        for index, (msg_bytes, operation) in enumerate(prepared):
+            group = None if isinstance(operation, Exception) else (key_device(operation[2]), priority_for(msg_bytes))
+            groups.setdefault(group, []).append(index)
+        return groups
+
+    @staticmethod
+    def _sign_all(prepared):
+        results = []
+        sessions = [trezor_handler.session_for(operation[2]) for _, operation in prepared
+                    if not isinstance(operation, Exception)]
+        if not sessions:
+            return [{"error": str(operation)} for _, operation in prepared]
+
+        # all payloads of a job are for the same device, hold it for the whole job
+        with sessions[0].lock:
+            for _, operation in prepared:
+                if isinstance(operation, Exception):
+                    results.append({"error": str(operation)})
+                    continue
+
+                sign, proto_message, config = operation
+                try:
+                    results.append({"signature": "{}".format(sign(proto_message, config))})
+                except Exception as e:
+                    logging.error("Error in batch signing: %s", e)
+                    results.append({"error": str(e)})
+        return results
+
+    def _prepare(self, pkh, item):
+        # return the decoded payload (None if it could not be decoded) and the prepared device call or the error
+        msg_bytes = None
+        try:
+            authentication = None
+            if isinstance(item, dict):
+                pkh = item["pkh"]
+                # with authorized keys every payload carries its own authentication, see signer.authorized
+                authentication = item.get("authentication")
+                item = item["data"]
+            msg_bytes = bytes.fromhex(item)
+            self.keys_resource.authorized_keys.authenticate(pkh, msg_bytes, authentication)
+            return msg_bytes, self.keys_resource.prepare(pkh, msg_bytes)
+        except Exception as e:
+            return msg_bytes, e
@@ -0,0 +1,401 @@
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+from signer import trezor_handler
+from signer.devices import key_device
+from signer.registry import KeyRegistry
+from signer.watermark import WatermarkError
+from signer.worker import DeadlineExceeded, PRIORITY_ADMIN, PRIORITY_BLOCK, PRIORITY_ENDORSEMENT, \
+    PRIORITY_TRANSACTION, deadline_for
+
+# Broker mode: one process (python -m signer.broker) owns the devices, the watermarks and the registry writes.
+# The gunicorn workers parse and check the requests themselves and only send the prepared device calls over
+# a Unix socket, so any number of workers can parse while each device is still used by one process only.
+BROKER_SOCKET = os.environ.get('SIGNER_BROKER')
+
+# A frame is a 1 byte operation (request) or status (response), a 4 byte length and the payload.
+# Requests with a key config start with the config as json, prefixed with its 2 byte length.
+HEADER = struct.Struct('>BI')
+CONFIG_LENGTH = struct.Struct('>H')
+# chain id, kind and level of a watermark check, followed by the pkh
+WATERMARK = struct.Struct('>4sBI')
+
+OP_SIGN_TX = 1
+OP_SIGN_BAKER_OP = 2
+OP_GET_ADDRESS = 3
+OP_GET_PUBLIC_KEY = 4
+OP_WATERMARK = 5
+OP_ADD_KEYS = 6
+OP_START_STAKING = 7
+OP_RESET_DEVICE = 8
+OP_CHANGE_PIN = 9
+OP_HEALTH = 10
+OP_QUEUE_STATS = 11
+OP_GET_KEYS = 12
+
+STATUS_OK = 0
+STATUS_NONE = 1
+STATUS_ERROR = 2
+STATUS_WATERMARK = 3
+STATUS_DEADLINE = 4
+
+WATERMARK_KINDS = {'block': 1, 'endorsement': 2}
+WATERMARK_KIND_NAMES = dict((code, kind) for kind, code in WATERMARK_KINDS.items())
+
+# frames are small, a larger length means the peer does not speak this protocol
+MAX_FRAME = 1 << 20
+
+
+class BrokerError(Exception):
+    pass
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    code, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if length > MAX_FRAME:
+        raise BrokerError("Frame of {} bytes is too large".format(length))
+    return code, _recv_exactly(sock, length) if length else b''
+
+
+def write_frame(sock, code, payload=b''):
+    sock.sendall(HEADER.pack(code, len(payload)) + payload)
+
+
+def pack_config(config, payload=b''):
+    config = json.dumps(config).encode()
+    return CONFIG_LENGTH.pack(len(config)) + config + payload
+
+
+def unpack_config(payload):
+    length, = CONFIG_LENGTH.unpack_from(payload)
+    end = CONFIG_LENGTH.size + length
+    return json.loads(payload[CONFIG_LENGTH.size:end].decode()), payload[end:]
+
+
+def dump_proto(message):
+    from trezorlib import protobuf
+    buf = io.BytesIO()
+    protobuf.dump_message(buf, message)
+    return buf.getvalue()
+
+
+def load_proto(data, message_type):
+    from trezorlib import protobuf
+    return protobuf.load_message(io.BytesIO(data), message_type)
+
+
+class BrokerClient(object):
+    # One connection per thread, a connection carries one request at a time. The device workers of a gunicorn
+    # worker are its only callers, so there are as many connections as devices and background threads.
+
+    def __init__(self, path=BROKER_SOCKET):
+        self.path = path
+        self.local = threading.local()
+
+    def forget(self):
+        # in a forked worker, the connections of the parent are not ours
+        self.local = threading.local()
+
+    def request(self, op, payload=b''):
+        # a connection closed by a restarted broker is opened again and the request sent once more; a repeated
+        # signature is the same signature, a repeated watermark check fails closed
+        try:
+            return self._request(op, payload)
+        except (EOFError, OSError) as e:
+            logging.warning("Broker connection lost, reconnecting: %s", e)
+            self._close()
+            return self._request(op, payload)
+
+    def _request(self, op, payload):
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            sock = self.local.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+
+        write_frame(sock, op, payload)
+        status, payload = read_frame(sock)
+
+        if status == STATUS_OK:
+            return payload.decode()
+        if status == STATUS_NONE:
+            return None
+        if status == STATUS_WATERMARK:
+            raise WatermarkError(payload.decode())
+        if status == STATUS_DEADLINE:
+            raise DeadlineExceeded(payload.decode())
+        raise BrokerError(payload.decode())
+
+    def _close(self):
+        sock = getattr(self.local, 'sock', None)
+        self.local.sock = None
+        if sock is not None:
+            sock.close()
+
+    # the trezor_handler calls
+
+    def sign_non_baking_op(self, msg, config):
+        return self.request(OP_SIGN_TX, pack_config(config, dump_proto(msg)))
+
+    def sign_baking(self, msg, config):
+        return self.request(OP_SIGN_BAKER_OP, pack_config(config, dump_proto(msg)))
+
+    def get_address(self, config):
+        return self.request(OP_GET_ADDRESS, pack_config(config))
+
+    def get_public_key(self, config):
+        return self.request(OP_GET_PUBLIC_KEY, pack_config(config))
+
+    def get_keys(self, configs):
+        return [tuple(key) for key in json.loads(self.request(OP_GET_KEYS, json.dumps(configs).encode()))]
+
+    def start_staking(self):
+        self.request(OP_START_STAKING)
+
+    def reset_device(self):
+        self.request(OP_RESET_DEVICE)
+
+    def change_pin(self):
+        return self.request(OP_CHANGE_PIN)
+
+    # state kept by the broker
+
+    def check_watermark(self, pkh, chain_id, kind, level):
+        self.request(OP_WATERMARK, WATERMARK.pack(bytes.fromhex(chain_id), WATERMARK_KINDS[kind], level) + pkh.encode())
+
+    def add_keys(self, keys_config):
+        self.request(OP_ADD_KEYS, json.dumps(keys_config).encode())
+
+    def health(self):
+        return json.loads(self.request(OP_HEALTH))
+
+    def queue_stats(self):
+        return json.loads(self.request(OP_QUEUE_STATS))
+
+
+class RemoteWatermark(object):
+    # HighWatermark of the broker, see signer.watermark
+
+    def __init__(self, client):
+        self.client = client
+
+    def check(self, pkh, chain_id, kind, level):
+        self.client.check_watermark(pkh, chain_id, kind, level)
+
+    def reopen(self):
+        self.client.forget()
+
+
+class RemoteKeyRegistry(KeyRegistry):
+    # the workers read the registry files, the broker writes them
+
+    def __init__(self, client, filename):
+        self.client = client
+        KeyRegistry.__init__(self, filename)
+
+    def add_many(self, keys_config):
+        self.client.add_keys(keys_config)
+        self.refresh()
+
+
+class RemoteMonitor(object):
+    # DeviceMonitor of the broker, /health of a worker reads the state of the devices from there
+
+    def __init__(self, client):
+        self.client = client
+
+    def start(self):
+        pass
+
+    def state(self):
+        return self.health()["devices"]
+
+    def ready(self):
+        return self.health()["ready"]
+
+    def health(self):
+        try:
+            return self.client.health()
+        except Exception as e:
+            logging.error("Broker not reachable: %s", e)
+            return {"ready": False, "devices": {}}
+
+
+def _baker_op_priority(msg):
+    return PRIORITY_BLOCK if getattr(msg, 'block_header', None) is not None else PRIORITY_ENDORSEMENT
+
+
+class Broker(object):
+    # Serves the device calls of the workers. Every call goes through the device pool of the broker: calls of
+    # all workers for the same device are serialized and prioritized by one device worker.
+
+    def __init__(self, devices, watermarks, keys_config, monitor=None):
+        self.devices = devices
+        self.watermarks = watermarks
+        self.keys_config = keys_config
+        self.monitor = monitor
+
+        self.handlers = {
+            OP_SIGN_TX: self.sign_tx,
+            OP_SIGN_BAKER_OP: self.sign_baker_op,
+            OP_GET_ADDRESS: self.get_address,
+            OP_GET_PUBLIC_KEY: self.get_public_key,
+            OP_WATERMARK: self.check_watermark,
+            OP_ADD_KEYS: self.add_keys,
+            OP_START_STAKING: self._admin(trezor_handler.start_staking),
+            OP_RESET_DEVICE: self._admin(trezor_handler.reset_device),
+            OP_CHANGE_PIN: self._admin(trezor_handler.change_pin),
+            OP_HEALTH: self.health,
+            OP_QUEUE_STATS: self.queue_stats,
+            OP_GET_KEYS: self.get_keys,
+        }
+
+    def handle(self, op, payload):
+        # return the status and payload of the response
+        handler = self.handlers.get(op)
+        if handler is None:
+            return STATUS_ERROR, "Unknown operation {}".format(op).encode()
+        try:
+            result = handler(payload)
+        except WatermarkError as e:
+            return STATUS_WATERMARK, str(e).encode()
+        except DeadlineExceeded as e:
+            return STATUS_DEADLINE, str(e).encode()
+        except Exception as e:
+            logging.error("Error in broker operation %s: %s", op, e)
+            return STATUS_ERROR, str(e).encode()
+
+        if result is None:
+            return STATUS_NONE, b''
+        return STATUS_OK, result.encode()
+
+    def sign_tx(self, payload):
+        from trezorlib import messages
+        config, data = unpack_config(payload)
+        msg = load_proto(data, messages.TezosSignTx)
+        return self._sign(config, trezor_handler.sign_non_baking_op, msg, PRIORITY_TRANSACTION)
+
+    def sign_baker_op(self, payload):
+        from trezorlib import messages
+        config, data = unpack_config(payload)
+        msg = load_proto(data, messages.TezosSignBakerOp)
+        return self._sign(config, trezor_handler.sign_baking, msg, _baker_op_priority(msg))
+
+    def _sign(self, config, sign, msg, priority):
+        return self.devices.submit(config, sign, msg, priority=priority, deadline=deadline_for(priority)).result()
+
+    def get_address(self, payload):
+        config, _ = unpack_config(payload)
+        return self.devices.submit(config, trezor_handler.get_address).result()
+
+    def get_public_key(self, payload):
+        config, _ = unpack_config(payload)
+        return self.devices.submit(config, trezor_handler.get_public_key, priority=PRIORITY_TRANSACTION).result()
+
+    def get_keys(self, payload):
+        configs = json.loads(payload.decode())
+        worker = self.devices.worker(key_device(configs[0]))
+        return json.dumps(worker.submit(trezor_handler.get_keys, configs, priority=PRIORITY_ADMIN).result())
+
+    def check_watermark(self, payload):
+        chain_id, kind, level = WATERMARK.unpack_from(payload)
+        pkh = payload[WATERMARK.size:].decode()
+        self.watermarks.check(pkh, chain_id.hex(), WATERMARK_KIND_NAMES[kind], level)
+
+    def add_keys(self, payload):
+        self.keys_config.add_many(json.loads(payload.decode()))
+
+    def _admin(self, func):
+        def handler(payload):
+            return self.devices.default_worker.submit(func, priority=PRIORITY_ADMIN).result()
+        return handler
+
+    def health(self, payload):
+        if self.monitor is None:
+            return json.dumps({"ready": True, "devices": {}})
+        return json.dumps({"ready": self.monitor.ready(), "devices": self.monitor.state()})
+
+    def queue_stats(self, payload):
+        return json.dumps(self.devices.queue_stats())
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        # one connection per worker thread, served until the worker closes it
+        broker = self.server.broker
+        while True:
+            try:
+                op, payload = read_frame(self.request)
+            except (EOFError, OSError):
+                return
+            except BrokerError as e:
+                logging.error("Closing broker connection: %s", e)
+                return
+
+            status, payload = broker.handle(op, payload)
+            write_frame(self.request, status, payload)
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, broker):
+        self.broker = broker
+        if os.path.exists(path):
+            os.unlink(path)
+        # only the user running the signer may talk to the devices
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+
+
+def main(argv=None):
+    from signer.devices import DevicePool
+    from signer.health import DeviceMonitor
+    from signer.logs import setup_logging
+    from signer.registry import KNOWN_KEYS_FILE
+    from signer.watermark import HighWatermark, WATERMARKS_FILE
+    from signer.worker import DeviceWorker
+
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else BROKER_SOCKET
+    if not path:
+        sys.exit("usage: python -m signer.broker SOCKET (or set SIGNER_BROKER)")
+
+    setup_logging()
+    devices = DevicePool(DeviceWorker())
+    monitor = DeviceMonitor(devices)
+    monitor.start()
+
+    broker = Broker(devices, HighWatermark(WATERMARKS_FILE), KeyRegistry(KNOWN_KEYS_FILE), monitor)
+    server = BrokerServer(path, broker)
+    logging.info("Broker listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,98 @@
 import json
 import logging
-import os
+import re
+from collections import OrderedDict
 
 import falcon
 from signer import trezor_handler
+from signer.devices import DevicePool, key_device
+from signer.policy import Policy, policy_spec
+from signer.profiling import ADMIN_TOKEN, check_admin
+from signer.worker import DeviceWorker, PRIORITY_ADMIN
+
+# bulk registration: a path with one index range, e.g. "m/44'/1729'/{0..99}'", or a key config with the
+# range in "template" instead of "path": {"template": "m/44'/1729'/{0..99}'", "device": ..., "policy": ...}
+PATH_RANGE = re.compile(r'\{(\d+)\.\.(\d+)\}')
+MAX_BULK_KEYS = 1000
+# keys derived per device job, the signatures queued meanwhile run between the jobs
+KEYS_PER_JOB = 16
+
+
+def is_template(data):
+    if isinstance(data, dict):
+        return "template" in data
+    return isinstance(data, str) and PATH_RANGE.search(data) is not None
+
+
+def expand_template(template):
+    match = PATH_RANGE.search(template)
+    if match is None or PATH_RANGE.search(template, match.end()) is not None:
+        raise ValueError("A path template needs exactly one {first..last} range")
+
+    first, last = int(match.group(1)), int(match.group(2))
+    if last < first or last - first >= MAX_BULK_KEYS:
+        raise ValueError("A path template covers 1 to {} indexes".format(MAX_BULK_KEYS))
+
+    return [template[:match.start()] + str(index) + template[match.end():] for index in range(first, last + 1)]
+
+
+def template_configs(data):
+    # the key config of every index of the template
+    if isinstance(data, str):
+        return expand_template(data)
+
+    config = dict((name, value) for name, value in data.items() if name != "template")
+    return [dict(config, path=path) for path in expand_template(data["template"])]
 
 
 class Register(object):
 
-    def __init__(self, keys_config):
+    def __init__(self, keys_config, public_keys, devices=None, token=ADMIN_TOKEN):
         self.keys_config = keys_config
+        self.public_keys = public_keys
+        # the workers of the devices, a bulk registration is queued behind the signatures (see register_many)
+        self.devices = devices if devices is not None else DevicePool(DeviceWorker())
+        # the config of a known key, e.g. its policy, is only replaced with the admin token (see on_put)
+        self.token = token
 
     def on_post(self, req, resp):
-        # call trezor - get the pkh for the given HDpath
+        # registering a known key again is fine with the same config, another config is refused
+        self.register(req, resp, replace=False)
+
+    def on_put(self, req, resp):
+        # PUT /register: like POST, and replaces the config of known keys. Registering is open to every
+        # client of the signer, loosening or dropping a policy needs the X-Admin-Token header
+        check_admin(req, self.token)
+        self.register(req, resp, replace=True)
+
+    def register(self, req, resp, replace):
+        # call trezor - get the pkh for the given HDpath, or for a key config naming the device (see signer.devices)
         try:
             data = req.media
+            # refuse an invalid policy before the key is stored
+            if policy_spec(data) is not None:
+                Policy(policy_spec(data))
+            if is_template(data):
+                self.register_many(data, resp, replace)
+                return
+
             pkh = trezor_handler.get_address(data)
             logging.info("Registering pkh")
 
-            if pkh not in self.keys_config.keys():
-                # add pkh and HDpath pair into config
-                self.keys_config[pkh] = data
-                with open('signer/known_keys.json', 'w', os.O_NONBLOCK) as myfile:
-                    myfile.write(json.dumps(self.keys_config))
+            if pkh not in self.keys_config:
+                # add pkh and HDpath pair into the registry, the other workers pick it up from there
+                self.keys_config.add(pkh, data)
+            elif self.keys_config[pkh] == data:
+                logging.info("Key %s already known", pkh)
+            elif replace:
+                logging.info("Updating the config of key %s", pkh)
+                self.keys_config.add(pkh, data)
             else:
-                logging.info("Key {} already known".format(pkh))
+                self._conflict(resp, [pkh])
+                return
+
+            # the session is already open, fetch the public key right away for the GET /keys/{pkh} requests
+            self.public_keys.fetch(pkh, data)
             resp.content_type = 'application/json'
             resp.body = json.dumps({"pkh": pkh})
         except Exception as e:
@@ -34,9 +102,44 @@ class Register(object):
             resp.status = falcon.HTTP_500
             resp.body = json.dumps({"error": data})
 
+    def register_many(self, data, resp, replace=False):
+        # the keys of the template are derived in small admin jobs of the device worker, a large range does not
+        # hold the device away from the baking signatures; they are stored with one registry write
+        configs = template_configs(data)
+        worker = self.devices.worker(key_device(configs[0]))
+        futures = [worker.submit(trezor_handler.get_keys, configs[start:start + KEYS_PER_JOB], priority=PRIORITY_ADMIN)
+                   for start in range(0, len(configs), KEYS_PER_JOB)]
+        keys = [key for future in futures for key in future.result()]
+
+        keys_config = OrderedDict((pkh, config) for (pkh, _), config in zip(keys, configs))
+        conflicts = [pkh for pkh, config in keys_config.items()
+                     if pkh in self.keys_config and self.keys_config[pkh] != config]
+        if conflicts and not replace:
+            self._conflict(resp, conflicts)
+            return
+
+        logging.info("Registering %d keys", len(keys))
+        self.keys_config.add_many(keys_config)
+        self.public_keys.put_many(dict(keys))
+
+        resp.content_type = 'application/json'
+        resp.body = json.dumps({"keys": OrderedDict(keys)})
+
+    @staticmethod
+    def _conflict(resp, pkhs):
+        logging.warning("Refused to replace the config of %s", ', '.join(pkhs))
+        resp.content_type = 'application/json'
+        resp.status = falcon.HTTP_409
+        resp.body = json.dumps({"error": "Already registered with another config, replace it with PUT /register",
+                                "pkhs": pkhs})
+
 
 class ResetDevice(object):
 
+    def __init__(self, public_keys, signatures=None):
+        self.public_keys = public_keys
+        self.signatures = signatures
+
     def on_get(self, req, resp):
         logging.info("Reset Device")
         resp.content_type = 'application/json'
@@ -44,6 +147,9 @@ class ResetDevice(object):
         # call trezor
         try:
             trezor_handler.reset_device()
+            self.public_keys.clear()
+            if self.signatures is not None:
+                self.signatures.clear()
             resp.body = json.dumps({"Success": "Device initialized"})
         except Exception as e:
             resp.body = json.dumps({"Failed": "Device not initialized"})
@@ -0,0 +1,438 @@
+import struct
+from functools import lru_cache
+
+# All layouts are compiled once at import time. The decoders read the fields in place with unpack_from,
+# the message is never sliced or copied. The read_* functions return the fields as bytes, ready for the
+# trezorlib messages (see signer.protos); the decode_* functions return the same dicts with hex strings.
+
+# magic_byte, chain_id, branch, tag, slot, level
+ENDORSEMENT = struct.Struct('>B4s32sBBL')
+
+# magic_byte, chain_id, level, proto, predecessor, timestamp, validation_pass, operations_hash, bytes_in_field_fitness
+BLOCK_HEAD = struct.Struct('>B4sLB32sQB32sL')
+
+# bytes_in_next_field, fitness, context, priority, proof_of_work_nonce, presence_of_field_seed_nonce_hash
+BLOCK_TAIL_FORMAT = '>L{}s32sH8sB'
+
+SEED_NONCE_HASH = struct.Struct('32s')
+
+# magic_byte, branch -> the head of every transaction like operation, the contents follow until the end
+OPERATION_HEAD = struct.Struct('>B32s')
+
+# operation_tag
+CONTENT_TAG = struct.Struct('>B')
+
+# contract_id: tag (0 implicit, 1 originated), hash
+CONTRACT_ID = struct.Struct('>B21s')
+
+# public key hash: curve tag, hash
+PKH = struct.Struct('21s')
+
+# curve tag, public key
+PUBLIC_KEY = struct.Struct('33s')
+
+BOOL = struct.Struct('>B')
+
+# bytes_in_next_field of the michelson parameters, code and storage
+LENGTH = struct.Struct('>L')
+
+# source, period
+VOTING_HEAD = struct.Struct('>21sL')
+
+# proposal, ballot
+BALLOT_TAIL = struct.Struct('>32sB')
+PROPOSAL_LENGTH = 32
+
+# operation tags of the contents of a transaction like operation
+PROPOSALS_TAG = 5
+BALLOT_TAG = 6
+REVEAL_TAG = 7
+TRANSACTION_TAG = 8
+ORIGINATION_TAG = 9
+DELEGATION_TAG = 10
+
+CONTENT_KINDS = {
+    PROPOSALS_TAG: 'proposal',
+    BALLOT_TAG: 'ballot',
+    REVEAL_TAG: 'reveal',
+    TRANSACTION_TAG: 'transaction',
+    ORIGINATION_TAG: 'origination',
+    DELEGATION_TAG: 'delegation',
+}
+
+FITNESS_PREFIX_SIZE = 4
+
+# number of zarith encoded fields of a manager operation: fee, counter, gas_limit, storage_limit
+MANAGER_ZARITH_FIELDS = 4
+
+
+@lru_cache(maxsize=16)
+def block_tail(bytes_in_fitness):
+    # the fitness is the only variable length field of a block header, there are only a few distinct sizes
+    return struct.Struct(BLOCK_TAIL_FORMAT.format(bytes_in_fitness))
+
+
+def decode_bool(num):
+    return num == 255
+
+
+def decode_zarith(buf, offset):
+    # decode one zarith number starting at offset, return the number and the offset of the next field
+    res = 0
+    shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        res |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return res, offset
+        shift += 7
+
+
+def decode_manager_numbers(buf, offset):
+    # decode fee, counter, gas_limit, storage_limit
+    fee, offset = decode_zarith(buf, offset)
+    counter, offset = decode_zarith(buf, offset)
+    gas_limit, offset = decode_zarith(buf, offset)
+    storage_limit, offset = decode_zarith(buf, offset)
+
+    return {
+        "fee": fee,
+        "counter": counter,
+        "gas_limit": gas_limit,
+        "storage_limit": storage_limit,
+    }, offset
+
+
+def check_length(buf, expected):
+    if len(buf) != expected:
+        raise ValueError("message has {} bytes, expected {}".format(len(buf), expected))
+
+
+def to_hex(value):
+    # the readable form of decoded fields, for logs, tests and previews
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, dict):
+        return dict((key, to_hex(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [to_hex(item) for item in value]
+    return value
+
+
+def read_endorsement(buf):
+    check_length(buf, ENDORSEMENT.size)
+    _, chain_id, branch, _, slot, level = ENDORSEMENT.unpack_from(buf)
+
+    return {
+        "chain_id": chain_id,
+        "endorsement": {
+            "branch": branch,
+            "slot": slot,
+            "level": level,
+        }
+    }
+
+
+def decode_endorsement(buf):
+    return to_hex(read_endorsement(buf))
+
+
+def read_block(buf):
+    (_,
+     chain_id,
+     level,
+     proto,
+     predecessor,
+     timestamp,
+     validation_pass,
+     operations_hash,
+     bytes_in_field_fitness) = BLOCK_HEAD.unpack_from(buf)
+
+    tail = block_tail(bytes_in_field_fitness - FITNESS_PREFIX_SIZE)
+    (bytes_in_next_field,
+     fitness,
+     context,
+     priority,
+     proof_of_work_nonce,
+     presence_of_field_seed_nonce_hash) = tail.unpack_from(buf, BLOCK_HEAD.size)
+
+    has_seed_nonce_hash = decode_bool(presence_of_field_seed_nonce_hash)
+    length = BLOCK_HEAD.size + tail.size
+    check_length(buf, length + SEED_NONCE_HASH.size if has_seed_nonce_hash else length)
+
+    block_header = {
+        "level": level,
+        "proto": proto,
+        "predecessor": predecessor,
+        "timestamp": timestamp,
+        "validation_pass": validation_pass,
+        "operations_hash": operations_hash,
+        "bytes_in_field_fitness": bytes_in_field_fitness,
+        "bytes_in_next_field": bytes_in_next_field,
+        "fitness": fitness,
+        "context": context,
+        "priority": priority,
+        "proof_of_work_nonce": proof_of_work_nonce,
+        "presence_of_field_seed_nonce_hash": has_seed_nonce_hash,
+    }
+
+    # the seed nonce hash is always represented by the last 32 bytes
+    if has_seed_nonce_hash:
+        block_header["seed_nonce_hash"] = SEED_NONCE_HASH.unpack_from(buf, length)[0]
+
+    return {
+        "chain_id": chain_id,
+        "block_header": block_header,
+    }
+
+
+def decode_block(buf):
+    return to_hex(read_block(buf))
+
+
+class UnsupportedOperation(ValueError):
+    # a well formed operation the device can not sign
+    pass
+
+
+def skip_zarith(buf, offset):
+    # return the offset after the zarith number starting at offset, without decoding it
+    while buf[offset] >= 0x80:
+        offset += 1
+    return offset + 1
+
+
+def decode_presence(buf, offset):
+    presence, = BOOL.unpack_from(buf, offset)
+    return decode_bool(presence), offset + BOOL.size
+
+
+def _decode_contract_id(buf, offset):
+    tag, contract_hash = CONTRACT_ID.unpack_from(buf, offset)
+    return {"tag": tag, "hash": contract_hash}, offset + CONTRACT_ID.size
+
+
+def _decode_sized(buf, offset):
+    # a length prefixed field, kept with its prefix as the device expects it
+    length, = LENGTH.unpack_from(buf, offset)
+    end = offset + LENGTH.size + length
+    if end > len(buf):
+        raise ValueError("field of {} bytes exceeds the message".format(length))
+    return bytes(buf[offset:end]), end
+
+
+def _decode_manager(buf, offset):
+    source, offset = _decode_contract_id(buf, offset)
+    content, offset = decode_manager_numbers(buf, offset)
+    content["source"] = source
+    return content, offset
+
+
+def _decode_reveal(buf, offset):
+    reveal, offset = _decode_manager(buf, offset)
+    reveal["public_key"] = PUBLIC_KEY.unpack_from(buf, offset)[0]
+    return reveal, offset + PUBLIC_KEY.size
+
+
+def _decode_transaction(buf, offset):
+    transaction, offset = _decode_manager(buf, offset)
+    transaction["amount"], offset = decode_zarith(buf, offset)
+    transaction["destination"], offset = _decode_contract_id(buf, offset)
+
+    has_parameters, offset = decode_presence(buf, offset)
+    if has_parameters:
+        transaction["parameters"], offset = _decode_sized(buf, offset)
+    return transaction, offset
+
+
+def _decode_origination(buf, offset):
+    origination, offset = _decode_manager(buf, offset)
+    origination["manager_pubkey"] = PKH.unpack_from(buf, offset)[0]
+    origination["balance"], offset = decode_zarith(buf, offset + PKH.size)
+
+    spendable, offset = decode_presence(buf, offset)
+    delegatable, offset = decode_presence(buf, offset)
+    origination["spendable"] = spendable
+    origination["delegatable"] = delegatable
+
+    has_delegate, offset = decode_presence(buf, offset)
+    if has_delegate:
+        origination["delegate"] = PKH.unpack_from(buf, offset)[0]
+        offset += PKH.size
+
+    has_script, offset = decode_presence(buf, offset)
+    if has_script:
+        # code and storage, both length prefixed
+        start = offset
+        _, offset = _decode_sized(buf, offset)
+        _, offset = _decode_sized(buf, offset)
+        origination["script"] = bytes(buf[start:offset])
+    return origination, offset
+
+
+def _decode_delegation(buf, offset):
+    delegation, offset = _decode_manager(buf, offset)
+
+    # no delegate means the delegation is withdrawn
+    has_delegate, offset = decode_presence(buf, offset)
+    if has_delegate:
+        delegation["delegate"] = PKH.unpack_from(buf, offset)[0]
+        offset += PKH.size
+    return delegation, offset
+
+
+def _decode_proposal(buf, offset):
+    source, period = VOTING_HEAD.unpack_from(buf, offset)
+    offset += VOTING_HEAD.size
+    length, = LENGTH.unpack_from(buf, offset)
+    offset += LENGTH.size
+    end = offset + length
+    if end > len(buf) or length % PROPOSAL_LENGTH:
+        raise ValueError("invalid proposals field of {} bytes".format(length))
+
+    view = memoryview(buf)
+    proposals = [bytes(view[i: i + PROPOSAL_LENGTH]) for i in range(offset, end, PROPOSAL_LENGTH)]
+
+    return {
+        "source": source,
+        "period": period,
+        "proposals": proposals,
+    }, end
+
+
+def _decode_ballot(buf, offset):
+    source, period = VOTING_HEAD.unpack_from(buf, offset)
+    proposal, ballot = BALLOT_TAIL.unpack_from(buf, offset + VOTING_HEAD.size)
+
+    return {
+        "source": source,
+        "period": period,
+        "proposal": proposal,
+        "ballot": ballot,
+    }, offset + VOTING_HEAD.size + BALLOT_TAIL.size
+
+
+CONTENT_DECODERS = {
+    PROPOSALS_TAG: _decode_proposal,
+    BALLOT_TAG: _decode_ballot,
+    REVEAL_TAG: _decode_reveal,
+    TRANSACTION_TAG: _decode_transaction,
+    ORIGINATION_TAG: _decode_origination,
+    DELEGATION_TAG: _decode_delegation,
+}
+
+
+def decode_operation(buf):
+    # decode every contents entry of a transaction like operation in a single pass,
+    # return the branch and the list of (kind, content)
+    _, branch = OPERATION_HEAD.unpack_from(buf)
+    offset = OPERATION_HEAD.size
+    contents = []
+
+    while offset < len(buf):
+        tag, = CONTENT_TAG.unpack_from(buf, offset)
+        decoder = CONTENT_DECODERS.get(tag)
+        if decoder is None:
+            raise UnsupportedOperation("operation tag {} is not supported".format(tag))
+        content, offset = decoder(buf, offset + CONTENT_TAG.size)
+        contents.append((CONTENT_KINDS[tag], content))
+
+    if not contents:
+        raise ValueError("operation without contents")
+
+    return branch, contents
+
+
+def _skip_sized(buf, offset):
+    length, = LENGTH.unpack_from(buf, offset)
+    return offset + LENGTH.size + length
+
+
+def _skip_optional(buf, offset, skip):
+    has_field, offset = decode_presence(buf, offset)
+    return skip(buf, offset) if has_field else offset
+
+
+def _skip_pkh(buf, offset):
+    return offset + PKH.size
+
+
+def _skip_manager(buf, offset):
+    offset += CONTRACT_ID.size
+    for _ in range(MANAGER_ZARITH_FIELDS):
+        offset = skip_zarith(buf, offset)
+    return offset
+
+
+def _skip_content(buf, tag, offset):
+    # the offset of the next content, the numbers are skipped without decoding them
+    if tag == REVEAL_TAG:
+        return _skip_manager(buf, offset) + PUBLIC_KEY.size
+    if tag == TRANSACTION_TAG:
+        offset = skip_zarith(buf, _skip_manager(buf, offset)) + CONTRACT_ID.size
+        return _skip_optional(buf, offset, _skip_sized)
+    if tag == ORIGINATION_TAG:
+        offset = skip_zarith(buf, _skip_manager(buf, offset) + PKH.size) + 2 * BOOL.size
+        offset = _skip_optional(buf, offset, _skip_pkh)
+        return _skip_optional(buf, offset, lambda buf, offset: _skip_sized(buf, _skip_sized(buf, offset)))
+    if tag == DELEGATION_TAG:
+        return _skip_optional(buf, _skip_manager(buf, offset), _skip_pkh)
+    if tag == PROPOSALS_TAG:
+        return _skip_sized(buf, offset + VOTING_HEAD.size)
+    if tag == BALLOT_TAG:
+        return offset + VOTING_HEAD.size + BALLOT_TAIL.size
+    raise UnsupportedOperation("operation tag {} is not supported".format(tag))
+
+
+def content_kinds(buf):
+    # the kinds of the contents of a transaction like operation, without decoding them
+    kinds = []
+    offset = OPERATION_HEAD.size
+    while offset < len(buf):
+        tag = buf[offset]
+        offset = _skip_content(buf, tag, offset + CONTENT_TAG.size)
+        kinds.append(CONTENT_KINDS[tag])
+    return kinds
+
+
+def read_transaction_like(buf):
+    # the TezosSignTx fields of an operation: the device signs at most one reveal followed by one
+    # transaction, origination or delegation, or a single proposal or ballot
+    branch, contents = decode_operation(buf)
+    kinds = [kind for kind, _ in contents]
+
+    if (len(kinds) == 1 and kinds[0] != 'reveal') or \
+            (len(kinds) == 2 and kinds[0] == 'reveal' and kinds[1] in ('transaction', 'origination', 'delegation')):
+        operation = {"branch": branch}
+        operation.update(contents)
+        return operation
+
+    raise UnsupportedOperation("the device can not sign an operation with the contents {}".format(", ".join(kinds)))
+
+
+def decode_transaction_like(buf):
+    return to_hex(read_transaction_like(buf))
+
+
+def _decode_single(buf, *kinds):
+    operation = decode_transaction_like(buf)
+    if sorted(key for key in operation if key != "branch") != sorted(kinds):
+        raise ValueError("message is not a {}".format(" with ".join(kinds)))
+    return operation
+
+
+def decode_delegation(buf):
+    return _decode_single(buf, "delegation")
+
+
+def decode_delegation_with_reveal(buf):
+    return _decode_single(buf, "reveal", "delegation")
+
+
+def decode_proposal(buf):
+    return _decode_single(buf, "proposal")
+
+
+def decode_ballot(buf):
+    return _decode_single(buf, "ballot")
@@ -0,0 +1,108 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+from signer.worker import DeviceWorker, DeadlineExceeded, PRIORITY_ADMIN
+
+# A key is registered either with its HD path alone, signed by the default (first found) device:
+#     "m/44'/1729'/0'"
+# or with the device holding it, and optionally a standby device with the same seed:
+#     {"path": "m/44'/1729'/0'", "device": "webusb:001:4", "standby": "3A1B9C0E5F7D2E4A6B8C0D1E"}
+# A device is identified by its transport path (contains a colon) or by its serial (the device id).
+
+
+def key_path(config):
+    return config if isinstance(config, str) else config["path"]
+
+
+def key_device(config):
+    return None if isinstance(config, str) else config.get("device")
+
+
+def key_standby(config):
+    return None if isinstance(config, str) else config.get("standby")
+
+
+def on_device(config, device_id):
+    # the same key on another device, used to fail over to the standby
+    return {"path": key_path(config), "device": device_id}
+
+
+def device_address(device_id):
+    # DeviceSession arguments of a device id
+    if device_id is None:
+        return {}
+    if ':' in device_id:
+        return {"path": device_id}
+    return {"serial": device_id}
+
+
+class DevicePool(object):
+    # One device worker per device: calls for different devices run in parallel, calls for the same
+    # device are serialized (and prioritized) by its worker. Keys without a device use the default worker.
+
+    def __init__(self, default_worker):
+        self.default_worker = default_worker
+        self.lock = threading.Lock()
+        self.workers = {}
+
+    def worker(self, device_id):
+        if device_id is None:
+            return self.default_worker
+
+        with self.lock:
+            worker = self.workers.get(device_id)
+            if worker is None:
+                worker = self.workers[device_id] = DeviceWorker(name='device-worker-{}'.format(device_id))
+            return worker
+
+    def submit(self, config, func, *args, priority=PRIORITY_ADMIN, deadline=None):
+        # queue func(*args, config) on the device of the key, when that fails and the key has a standby
+        # device, the call is repeated there. Both devices hold the same seed and ed25519 signatures are
+        # deterministic, the standby produces exactly the same signature.
+        future = self.worker(key_device(config)).submit(func, *(args + (config,)), priority=priority,
+                                                        deadline=deadline)
+        standby = key_standby(config)
+        if standby is None or _through_broker():
+            # the broker fails over itself, a second fail over here would call the standby twice
+            return future
+
+        result = Future()
+
+        def fail_over(primary):
+            error = primary.exception()
+            if error is None:
+                result.set_result(primary.result())
+                return
+            if isinstance(error, DeadlineExceeded):
+                result.set_exception(error)
+                return
+
+            logging.warning("Device %s failed, failing over to %s: %s", key_device(config), standby, error)
+            secondary = self.worker(standby).submit(func, *(args + (on_device(config, standby),)),
+                                                    priority=priority, deadline=deadline)
+            secondary.add_done_callback(lambda secondary: _copy_result(secondary, result))
+
+        future.add_done_callback(fail_over)
+        return result
+
+    def queue_stats(self):
+        # the queues of the default device, and those of the other devices if there are any
+        stats = self.default_worker.queue_stats()
+        with self.lock:
+            if self.workers:
+                stats["devices"] = dict((device_id, worker.queue_stats()) for device_id, worker in self.workers.items())
+        return stats
+
+
+def _through_broker():
+    from signer import trezor_handler
+    return trezor_handler.broker is not None
+
+
+def _copy_result(source, target):
+    error = source.exception()
+    if error is None:
+        target.set_result(source.result())
+    else:
+        target.set_exception(error)
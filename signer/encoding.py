@@ -0,0 +1,66 @@
+import hashlib
+
+B58_ALPHABET = b'123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+# base58check prefixes of the tezos encodings
+TZ1_PREFIX = bytes([6, 161, 159])
+TZ2_PREFIX = bytes([6, 161, 161])
+TZ3_PREFIX = bytes([6, 161, 164])
+CHAIN_ID_PREFIX = bytes([87, 82, 0])
+EDPK_PREFIX = bytes([13, 15, 37, 217])
+EDSIG_PREFIX = bytes([9, 245, 205, 134, 18])
+
+
+def b58encode(data):
+    num = int.from_bytes(data, 'big')
+    encoded = bytearray()
+    while num:
+        num, rem = divmod(num, 58)
+        encoded.append(B58_ALPHABET[rem])
+
+    # every leading zero byte is encoded as the first character of the alphabet
+    pad = len(data) - len(data.lstrip(b'\0'))
+    return (B58_ALPHABET[0:1] * pad + bytes(reversed(encoded))).decode()
+
+
+def b58decode(string):
+    num = 0
+    for char in string.encode():
+        index = B58_ALPHABET.find(bytes([char]))
+        if index < 0:
+            raise ValueError("Invalid base58 character {}".format(chr(char)))
+        num = num * 58 + index
+
+    pad = len(string) - len(string.lstrip(B58_ALPHABET[0:1].decode()))
+    return b'\0' * pad + num.to_bytes((num.bit_length() + 7) // 8, 'big')
+
+
+def b58encode_check(prefix, payload):
+    data = prefix + payload
+    return b58encode(data + hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4])
+
+
+def b58decode_check(prefix, string):
+    data = b58decode(string)
+    data, checksum = data[:-4], data[-4:]
+    if hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4] != checksum:
+        raise ValueError("Invalid checksum of {}".format(string))
+    if not data.startswith(prefix):
+        raise ValueError("Unexpected prefix of {}".format(string))
+    return data[len(prefix):]
+
+
+# curve tag of the public key hash in the binary encoding of an implicit account
+PKH_PREFIXES = (
+    ('tz1', TZ1_PREFIX, 0),
+    ('tz2', TZ2_PREFIX, 1),
+    ('tz3', TZ3_PREFIX, 2),
+)
+
+
+def decode_pkh(address):
+    # tz1/tz2/tz3 address -> curve tag and hash, as in operations
+    for name, prefix, tag in PKH_PREFIXES:
+        if address.startswith(name):
+            return bytes([tag]) + b58decode_check(prefix, address)
+    raise ValueError("Not an implicit account: {}".format(address))
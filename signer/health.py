@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import falcon
+
+from signer import trezor_handler
+from signer.worker import PRIORITY_ADMIN
+
+# seconds between two heartbeats of a device
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '10'))
+
+# the features reported on /health
+FEATURES = ('vendor', 'model', 'label', 'device_id', 'major_version', 'minor_version', 'patch_version',
+            'initialized', 'pin_protection', 'pin_cached')
+
+
+def _features(client):
+    # fresh features when the firmware knows GetFeatures, otherwise those read when the session was opened
+    from trezorlib import messages
+    try:
+        features = client.call(messages.GetFeatures())
+    except Exception:
+        features = client.features
+    return features
+
+
+def heartbeat(client):
+    # runs on the device worker: a ping keeps the session open and the device awake
+    from trezorlib import messages
+    client.call(messages.Ping(message='heartbeat'))
+    features = _features(client)
+
+    return {
+        "connected": True,
+        "unlocked": bool(getattr(features, 'pin_cached', False)) or not getattr(features, 'pin_protection', True),
+        # only the simulator can be asked, otherwise it is what the last start_staking call did
+        "staking": getattr(client, 'staking', None),
+        "features": dict((name, getattr(features, name, None)) for name in FEATURES),
+    }
+
+
+class DeviceMonitor(object):
+    # Pings every device in the background and keeps its last known state, /health only reads that state.
+    # The heartbeat is queued on the device worker with the lowest priority, it never delays a signature.
+
+    def __init__(self, devices, interval=HEARTBEAT_INTERVAL):
+        self.devices = devices
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.states = {}
+        # the heartbeat of every device not answered yet, only used by the heartbeat thread
+        self.pending = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            thread = threading.Thread(target=self._run, name='device-heartbeat')
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+        return self._thread
+
+    def state(self):
+        # the cached state of every device, "default" is the first device found
+        with self.lock:
+            return dict((name, dict(state)) for name, state in self.states.items())
+
+    def ready(self):
+        states = self.state()
+        return bool(states) and all(state["connected"] and state["unlocked"] is not False
+                                    for state in states.values())
+
+    def beat(self):
+        # ping all devices at once, wait for their answers at most one interval
+        for name, device_id, worker in self._targets():
+            queued = self.pending.get(name)
+            if queued is not None and not queued[2].done():
+                # the device is still busy with something else, its last heartbeat waits in the queue
+                continue
+            session = trezor_handler.device_session(device_id)
+            self.pending[name] = (time.monotonic(), session,
+                                  worker.submit(session.call, heartbeat, priority=PRIORITY_ADMIN))
+
+        for name, (started, session, future) in list(self.pending.items()):
+            try:
+                state = future.result(timeout=self.interval)
+                state["heartbeat_ms"] = round((time.monotonic() - started) * 1000, 1)
+                state["error"] = None
+                if state["staking"] is None:
+                    state["staking"] = session.staking
+            except Exception as e:
+                # a timeout means the device is busy signing, keep what we knew
+                if not future.done():
+                    continue
+                logging.warning("Heartbeat of device %s failed: %s", name, e)
+                state = {"connected": False, "unlocked": None, "staking": session.staking, "features": None,
+                         "heartbeat_ms": None, "error": str(e)}
+            state["checked_at"] = time.time()
+            del self.pending[name]
+
+            with self.lock:
+                self.states[name] = state
+
+    def _targets(self):
+        targets = [("default", None, self.devices.default_worker)]
+        with self.devices.lock:
+            targets += [(device_id, device_id, worker) for device_id, worker in self.devices.workers.items()]
+        return targets
+
+    def _run(self):
+        while True:
+            try:
+                self.beat()
+            except Exception as e:
+                logging.error("Error in device heartbeat: %s", e)
+            time.sleep(self.interval)
+
+
+class HealthResource(object):
+    # readiness: 200 when every device answered its last heartbeat and is unlocked, 503 otherwise
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def on_get(self, req, resp):
+        resp.content_type = 'application/json'
+        ready = self.monitor.ready()
+        resp.status = falcon.HTTP_200 if ready else falcon.HTTP_503
+        resp.body = json.dumps({"ready": ready, "devices": self.monitor.state()})
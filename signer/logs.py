@@ -0,0 +1,101 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+# the per-request logs, kept at the rate of LOG_SAMPLE_RATE
+REQUEST_LOGGER = 'signer.requests'
+request_log = logging.getLogger(REQUEST_LOGGER)
+
+# records waiting for the log thread, further records are dropped instead of blocking the request
+LOG_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = '%(asctime)s %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line, for log drivers that parse structured logs
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    # keep only a fraction of the request logs, warnings and errors are always kept
+
+    def __init__(self, rate, name=REQUEST_LOGGER):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.sampled = name
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING or record.name != self.sampled:
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # never wait for the log thread: a full queue means the output can not keep up, drop the record
+
+    def __init__(self, log_queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # QueueHandler formats the message here, on the request thread; queue the record as it is instead,
+        # the listener formats it. The log calls pass strings and numbers, they do not change once logged
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(logging.handlers.QueueListener):
+    # writes the queued records on its own thread, stop() flushes the queue and may be called twice
+
+    def stop(self):
+        if self._thread is not None:
+            super(LogListener, self).stop()
+
+
+def setup_logging(level=None, log_format=None, sample_rate=None, stream=sys.stdout):
+    # The records are filtered and queued on the calling thread, formatting and writing to the
+    # stream happen on the listener thread. Returns the listener, it is stopped at exit.
+    if level is None:
+        level = logging.DEBUG if os.environ.get('LOGLEVEL') == "DEBUG" else logging.INFO
+    if log_format is None:
+        log_format = os.environ.get('LOG_FORMAT', 'text')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = LogListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,241 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+# every worker process dumps its metrics into this directory, /metrics sums up the files of the live workers
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'signer-metrics'))
+# the metrics of the workers which are gone, the counters of a restarted worker must not go down
+DEAD_FILE = 'metrics-dead.json'
+LOCK_FILE = 'metrics.lock'
+
+# how often a worker dumps its metrics (seconds)
+FLUSH_INTERVAL = 5.0
+
+# upper bounds of the latency histogram buckets (seconds), from microsecond parsing to slow device confirmations
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+STAGE_SECONDS = 'signer_stage_seconds'
+REQUESTS_TOTAL = 'signer_requests_total'
+
+HELP = {
+    STAGE_SECONDS: 'Time spent in each stage of the signing pipeline',
+    REQUESTS_TOTAL: 'Sign requests by operation kind, key and outcome',
+}
+
+
+class Metrics(object):
+    # Histograms and counters of one worker process. Recording is a dict lookup, a bisect and a few increments.
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self._pid = None
+
+    def observe(self, stage, seconds, kind='', pkh=''):
+        key = (STAGE_SECONDS, (('stage', stage), ('kind', kind), ('pkh', pkh)))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # bucket counts, sum, count
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            index = bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        self._ensure_flushing()
+
+    def count(self, kind, pkh, status):
+        key = (REQUESTS_TOTAL, (('kind', kind), ('pkh', pkh), ('status', status)))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+        self._ensure_flushing()
+
+    def flush(self):
+        # write this worker's metrics atomically, so a scrape never reads half a file
+        with self.lock:
+            state = _state(self.histograms, self.counters)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _write(os.path.join(self.directory, 'metrics-{}.json'.format(os.getpid())), state)
+        except (IOError, OSError) as e:
+            logging.error("Could not write metrics: {}".format(e))
+
+    def collect(self):
+        # sum up the metrics of all workers: the live ones from their files, the dead ones from DEAD_FILE.
+        # The files of dead workers are folded into DEAD_FILE and removed, under a lock shared by the workers
+        self.flush()
+        histograms = {}
+        counters = {}
+
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            dead_filename = os.path.join(self.directory, DEAD_FILE)
+            dead = _read(dead_filename) or _state({}, {})
+            _merge(histograms, counters, dead)
+
+            for entry in os.listdir(self.directory):
+                if entry == DEAD_FILE or not (entry.startswith('metrics-') and entry.endswith('.json')):
+                    continue
+                filename = os.path.join(self.directory, entry)
+                state = _read(filename)
+                if self._alive(int(entry[len('metrics-'):-len('.json')])):
+                    if state is not None:
+                        _merge(histograms, counters, state)
+                    continue
+
+                if state is not None:
+                    _merge(histograms, counters, state)
+                    dead_histograms, dead_counters = {}, {}
+                    _merge(dead_histograms, dead_counters, dead)
+                    _merge(dead_histograms, dead_counters, state)
+                    dead = _state(dead_histograms, dead_counters)
+                    _write(dead_filename, dead)
+                os.remove(filename)
+
+        return histograms, counters
+
+    def render(self):
+        # prometheus text exposition format
+        histograms, counters = self.collect()
+        lines = []
+
+        if histograms:
+            lines += ['# HELP {} {}'.format(STAGE_SECONDS, HELP[STAGE_SECONDS]),
+                      '# TYPE {} histogram'.format(STAGE_SECONDS)]
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append('{}_bucket{{{}}} {}'.format(name, _labels(labels + (('le', repr(bound)),)), cumulative))
+            lines.append('{}_bucket{{{}}} {}'.format(name, _labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{{{}}} {}'.format(name, _labels(labels), repr(total)))
+            lines.append('{}_count{{{}}} {}'.format(name, _labels(labels), count))
+
+        if counters:
+            lines += ['# HELP {} {}'.format(REQUESTS_TOTAL, HELP[REQUESTS_TOTAL]),
+                      '# TYPE {} counter'.format(REQUESTS_TOTAL)]
+        for (name, labels), value in sorted(counters.items()):
+            lines.append('{}{{{}}} {}'.format(name, _labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def _ensure_flushing(self):
+        # one flush thread per process, started lazily so that it also exists in forked workers
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    thread = threading.Thread(target=self._flush_periodically, name='metrics-flush')
+                    thread.daemon = True
+                    thread.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+def _state(histograms, counters):
+    # the json form of the metrics, as written by flush
+    return {
+        "histograms": [[name, labels, histogram] for (name, labels), histogram in histograms.items()],
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+    }
+
+
+def _merge(histograms, counters, state):
+    # add the metrics of a state to the histograms and counters
+    for name, labels, (buckets, total, count) in state["histograms"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        histogram = histograms.setdefault(key, [[0] * len(BUCKETS), 0.0, 0])
+        histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+        histogram[1] += total
+        histogram[2] += count
+
+    for name, labels, value in state["counters"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+
+
+def _read(filename):
+    try:
+        with open(filename, 'r') as myfile:
+            return json.load(myfile)
+    except (IOError, ValueError):
+        return None
+
+
+def _write(filename, state):
+    with open(filename + '.tmp', 'w') as myfile:
+        json.dump(state, myfile)
+    os.replace(filename + '.tmp', filename)
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name, value) for name, value in labels)
+
+
+class Timer(object):
+    # measures the stages of one request, the stages are recorded once the operation kind is known
+    __slots__ = ('start', 'last', 'stages')
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+
+    def stage(self, name):
+        now = time.perf_counter()
+        self.stages.append((name, now - self.last))
+        self.last = now
+
+    def wrap(self, func):
+        # time spent queued for the device and on the device, func runs on the device worker. A failed attempt
+        # is its own stage, a repeated call (on the standby device, see DevicePool) has standby_ stages
+        attempts = []
+
+        def timed(*args, **kwargs):
+            prefix = 'standby_' if attempts else ''
+            attempts.append(prefix)
+            self.stage(prefix + 'queue_wait')
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.stage(prefix + 'device_failed')
+                raise
+            self.stage(prefix + 'device_sign')
+            return result
+        return timed
+
+    def record(self, kind, pkh):
+        for name, seconds in self.stages:
+            metrics.observe(name, seconds, kind, pkh)
+        metrics.observe('total', self.last - self.start, kind, pkh)
+
+
+class MetricsResource(object):
+
+    def on_get(self, req, resp):
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.body = metrics.render()
+
+
+# the metrics of this process
+metrics = Metrics()
@@ -1,29 +1,95 @@
+import json
 import logging
+import os
+import threading
+import time
+
 import falcon
 
+from signer.logs import request_log
+
+# SIGNER_RECORD: append the sign requests to this JSONL file, replayed by python -m benchmarks.replay
+RECORD_FILE = os.environ.get('SIGNER_RECORD')
+
 
 class RequestLogger(object):
     def process_request(self, req, resp):
-        logging.debug("[REQUEST] method: {}".format(req.method))
-        logging.debug("          url: {}".format(req.uri))
-        logging.debug("          content-type: {}".format(req.content_type))
-        # if req.method in 'POST':
-        #     logging.debug("          data:{}".format(req.media))
+        # the arguments are only formatted when debug logging is on
+        request_log.debug("[REQUEST] method: %s url: %s content-type: %s", req.method, req.uri, req.content_type)
 
     def process_response(self, req, resp, resource, req_succeeded):
-        logging.debug("[RESPONSE] status: {}".format(resp.status))
-        logging.debug("           content-type: {}".format(resp.content_type))
-        logging.debug("           data:{}".format(resp.body))
+        request_log.debug("[RESPONSE] status: %s content-type: %s data: %s", resp.status, resp.content_type,
+                          resp.body if resp.body is not None else resp.data)
 
 
 class RequireJSON(object):
 
+    def __init__(self, exempt_paths=()):
+        # routes serving something else than json, e.g. the prometheus metrics
+        self.exempt_paths = frozenset(exempt_paths)
+
     def process_request(self, req, resp):
+        if req.path in self.exempt_paths:
+            return
+
         if not req.client_accepts_json:
             raise falcon.HTTPNotAcceptable(
                 'This API only supports responses encoded as JSON.')
 
-        if req.method in ('POST', 'PUT'):
-            if 'application/json' not in req.content_type:
-                raise falcon.HTTPUnsupportedMediaType(
-                    'This API only supports requests encoded as JSON.')
+    def process_resource(self, req, resp, resource, params):
+        if req.path in self.exempt_paths or req.method not in ('POST', 'PUT'):
+            return
+
+        # a resource may accept other request types, e.g. the raw operation bytes of the signing endpoint
+        content_type = req.content_type or ''
+        if 'application/json' not in content_type and \
+                not any(content_type.startswith(raw) for raw in getattr(resource, 'raw_content_types', ())):
+            raise falcon.HTTPUnsupportedMediaType(
+                'This API only supports requests encoded as JSON.')
+
+
+class RequestRecorder(object):
+    # Records every signed POST /keys/{pkh} as one JSON line: time, endpoint, pkh, the operation bytes as hex,
+    # status and duration. Nothing else of the request is kept, neither headers nor the authentication, the
+    # operation is what the signer publishes anyway. Lines are appended with a single write, so the workers
+    # can share the file. KeysResource leaves the decoded operation in req.context['msg_bytes'].
+
+    ENDPOINT = '/keys/{pkh}'
+    KEYS_PREFIX = '/keys/'
+
+    def __init__(self, filename=RECORD_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self._fd = None
+
+    def process_request(self, req, resp):
+        req.context['record_start'] = time.time()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        msg_bytes = req.context.get('msg_bytes')
+        if msg_bytes is None or not req.path.startswith(self.KEYS_PREFIX):
+            return
+
+        self.record(req.path[len(self.KEYS_PREFIX):], msg_bytes, int(resp.status.split(' ', 1)[0]),
+                    req.context['record_start'])
+
+    def record(self, pkh, msg_bytes, status, start):
+        # also called by the asyncio app, its sign requests do not pass the falcon middleware
+        record = {
+            "ts": start,
+            "endpoint": self.ENDPOINT,
+            "pkh": pkh,
+            "payload": msg_bytes.hex(),
+            "status": status,
+            "duration_ms": round((time.time() - start) * 1000, 3),
+        }
+        try:
+            os.write(self._open(), (json.dumps(record) + '\n').encode())
+        except OSError as e:
+            logging.error("Could not record request: %s", e)
+
+    def _open(self):
+        with self.lock:
+            if self._fd is None:
+                self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            return self._fd
@@ -0,0 +1,140 @@
+import threading
+
+from signer.encoding import b58decode_check, decode_pkh, CHAIN_ID_PREFIX
+
+# A key config may carry a signing policy, checked on the decoded operation before anything reaches the device:
+#     {"path": "m/44'/1729'/0'",
+#      "policy": {"chain_ids": ["NetXdQprcVkpaWU"], "kinds": ["block", "endorsement", "reveal", "delegation"],
+#                 "max_fee": 10000, "max_gas": 20000, "delegates": ["tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"]}}
+# Only blocks and endorsements carry a chain id. Fee and gas are the totals over all contents of an operation.
+POLICY_FIELDS = ('chain_ids', 'kinds', 'max_fee', 'max_gas', 'delegates')
+
+KINDS = ('block', 'endorsement', 'reveal', 'transaction', 'origination', 'delegation', 'proposal', 'ballot')
+
+
+class PolicyError(ValueError):
+    pass
+
+
+def _decode_chain_id(chain_id):
+    # base58 (Net...) or hex, compared with the bytes of the decoded operation
+    if chain_id.startswith('Net'):
+        return b58decode_check(CHAIN_ID_PREFIX, chain_id)
+    return bytes.fromhex(chain_id)
+
+
+def _decode_delegate(delegate):
+    if delegate.startswith('tz'):
+        return decode_pkh(delegate)
+    return bytes.fromhex(delegate)
+
+
+class Policy(object):
+    # the policy compiled into a list of checks, each raises PolicyError
+
+    def __init__(self, spec):
+        unknown = set(spec) - set(POLICY_FIELDS)
+        if unknown:
+            raise ValueError("Unknown policy fields: {}".format(", ".join(sorted(unknown))))
+
+        self.checks = []
+
+        if 'chain_ids' in spec:
+            chain_ids = frozenset(_decode_chain_id(chain_id) for chain_id in spec['chain_ids'])
+            self.checks.append(self._chain_id_check(chain_ids))
+
+        if 'kinds' in spec:
+            kinds = frozenset(spec['kinds'])
+            if not kinds <= set(KINDS):
+                raise ValueError("Unknown operation kinds: {}".format(", ".join(sorted(kinds - set(KINDS)))))
+            self.checks.append(self._kinds_check(kinds))
+
+        if 'max_fee' in spec:
+            self.checks.append(self._total_check('fee', int(spec['max_fee'])))
+
+        if 'max_gas' in spec:
+            self.checks.append(self._total_check('gas_limit', int(spec['max_gas'])))
+
+        if 'delegates' in spec:
+            delegates = frozenset(_decode_delegate(delegate) for delegate in spec['delegates'])
+            self.checks.append(self._delegates_check(delegates))
+
+    def check(self, kind, operation):
+        # kind is block, endorsement or transaction (any transaction like operation)
+        if not self.checks:
+            return
+        contents = self._contents(kind, operation)
+        for check in self.checks:
+            check(operation, contents)
+
+    @staticmethod
+    def _contents(kind, operation):
+        # (kind, content) of every contents entry, a block or endorsement is its own single content
+        if kind != 'transaction':
+            return [(kind, operation)]
+        return [(name, content) for name, content in operation.items() if name != 'branch']
+
+    @staticmethod
+    def _chain_id_check(chain_ids):
+        def check(operation, contents):
+            chain_id = operation.get("chain_id")
+            if chain_id is not None and chain_id not in chain_ids:
+                raise PolicyError("Chain {} is not allowed".format(chain_id.hex()))
+        return check
+
+    @staticmethod
+    def _kinds_check(kinds):
+        def check(operation, contents):
+            for kind, _ in contents:
+                if kind not in kinds:
+                    raise PolicyError("Operation kind {} is not allowed".format(kind))
+        return check
+
+    @staticmethod
+    def _total_check(field, maximum):
+        def check(operation, contents):
+            total = sum(content.get(field, 0) for _, content in contents)
+            if total > maximum:
+                raise PolicyError("Total {} {} exceeds the maximum {}".format(field, total, maximum))
+        return check
+
+    @staticmethod
+    def _delegates_check(delegates):
+        def check(operation, contents):
+            for kind, content in contents:
+                # a delegation without delegate withdraws it, that is always allowed
+                delegate = content.get("delegate") if kind in ('delegation', 'origination') else None
+                if delegate is not None and delegate not in delegates:
+                    raise PolicyError("Delegate {} is not allowed".format(delegate.hex()))
+        return check
+
+
+def policy_spec(config):
+    return None if isinstance(config, str) else config.get("policy")
+
+
+class Policies(object):
+    # the compiled policy of every key, compiled on first use and again when the key config changes
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.policies = {}
+
+    def get(self, pkh, config):
+        spec = policy_spec(config)
+        if spec is None:
+            return None
+
+        entry = self.policies.get(pkh)
+        if entry is not None and entry[0] is config:
+            return entry[1]
+
+        policy = Policy(spec)
+        with self.lock:
+            self.policies[pkh] = (config, policy)
+        return policy
+
+    def check(self, pkh, config, kind, operation):
+        policy = self.get(pkh, config)
+        if policy is not None:
+            policy.check(kind, operation)
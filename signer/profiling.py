@@ -0,0 +1,246 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import falcon
+
+# The /admin routes and the request profiler are only installed when ADMIN_TOKEN is set, every call has to
+# send it in the X-Admin-Token header. Without the token nothing of this module runs.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+ADMIN_HEADER = 'X-Admin-Token'
+
+# longest timed profile
+MAX_PROFILE_SECONDS = 60
+SAMPLE_INTERVAL = 0.005
+
+KEYS_PREFIX = '/keys/'
+
+
+def check_admin(req, token):
+    if not token:
+        raise falcon.HTTPNotFound()
+    if not hmac.compare_digest((req.get_header(ADMIN_HEADER) or '').encode(), token.encode()):
+        raise falcon.HTTPForbidden('Forbidden', 'Missing or wrong admin token')
+
+
+def folded(counts):
+    # "thread;outer;...;inner count" lines, the input of flamegraph.pl, speedscope and most flamegraph viewers
+    return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(counts.items()))
+
+
+def _frame_name(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class StackSampler(object):
+    # Samples the stacks of all threads every interval, from a thread of its own. Waits (USB, the device
+    # queue, sockets) show up as well as computation, each stack starts with the name of its thread.
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def sample(self):
+        own = threading.get_ident()
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.counts[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+
+class RequestProfiler(object):
+    # Falcon middleware: once armed, samples all threads until the next count /keys/{pkh} requests are answered.
+    # The asyncio app serves those requests without the middleware, it calls count_request itself.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.sampler = None
+        self.result = None
+
+    def arm(self, count):
+        with self.lock:
+            if self.remaining:
+                raise ValueError("Already profiling, {} requests to go".format(self.remaining))
+            self.result = None
+            self.remaining = count
+            self.sampler = StackSampler().start()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        if req.path.startswith(KEYS_PREFIX):
+            self.count_request()
+
+    def count_request(self):
+        if not self.remaining:
+            return
+
+        with self.lock:
+            if not self.remaining:
+                return
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.result = folded(self.sampler.stop())
+                self.sampler = None
+
+
+class Profile(object):
+    # POST /admin/profile?seconds=N starts sampling all threads for N seconds, GET answers with the folded stacks
+    # once they are done. The request does not wait, a sync worker keeps serving the sign requests meanwhile.
+
+    def __init__(self, token=ADMIN_TOKEN):
+        self.token = token
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.ends = None
+        self.result = None
+
+    def on_post(self, req, resp):
+        check_admin(req, self.token)
+        seconds = min(max(req.get_param_as_int('seconds') or 10, 1), MAX_PROFILE_SECONDS)
+        resp.content_type = 'application/json'
+
+        with self.lock:
+            if self.sampler is not None:
+                resp.status = falcon.HTTP_409
+                resp.body = json.dumps({"Error": "Already profiling, {:.0f} seconds to go".format(self._remaining())})
+                return
+            self.result = None
+            self.sampler = StackSampler().start()
+            self.ends = time.monotonic() + seconds
+
+        timer = threading.Timer(seconds, self._stop)
+        timer.daemon = True
+        timer.start()
+        resp.status = falcon.HTTP_202
+        resp.body = json.dumps({"seconds": seconds})
+
+    def on_get(self, req, resp):
+        check_admin(req, self.token)
+        with self.lock:
+            if self.result is None:
+                resp.content_type = 'application/json'
+                resp.status = falcon.HTTP_202 if self.sampler is not None else falcon.HTTP_404
+                resp.body = json.dumps({"seconds": self._remaining()})
+                return
+            resp.content_type = 'text/plain'
+            resp.body = self.result
+
+    def _remaining(self):
+        return max(self.ends - time.monotonic(), 0.0) if self.sampler is not None else 0.0
+
+    def _stop(self):
+        with self.lock:
+            self.result = folded(self.sampler.stop())
+            self.sampler = None
+
+
+class RequestProfile(object):
+    # POST /admin/profile/requests?count=N arms the request profiler, GET answers with the folded stacks once done
+
+    def __init__(self, profiler, token=ADMIN_TOKEN):
+        self.profiler = profiler
+        self.token = token
+
+    def on_post(self, req, resp):
+        check_admin(req, self.token)
+        count = req.get_param_as_int('count') or 100
+        resp.content_type = 'application/json'
+        try:
+            self.profiler.arm(count)
+        except ValueError as e:
+            resp.status = falcon.HTTP_409
+            resp.body = json.dumps({"Error": str(e)})
+            return
+        resp.status = falcon.HTTP_202
+        resp.body = json.dumps({"remaining": count})
+
+    def on_get(self, req, resp):
+        check_admin(req, self.token)
+        if self.profiler.result is None:
+            resp.content_type = 'application/json'
+            resp.status = falcon.HTTP_202 if self.profiler.remaining else falcon.HTTP_404
+            resp.body = json.dumps({"remaining": self.profiler.remaining})
+            return
+        resp.content_type = 'text/plain'
+        resp.body = self.profiler.result
+
+
+class MemorySnapshot(object):
+    # GET /admin/memory: the first call starts tracemalloc, every further call answers with the allocations
+    # grown the most since the previous call. ?stop=true stops tracing again, it slows every allocation down.
+
+    FRAMES = 10
+    TOP = 20
+
+    def __init__(self, token=ADMIN_TOKEN):
+        self.token = token
+        self.lock = threading.Lock()
+        self.previous = None
+
+    def on_get(self, req, resp):
+        check_admin(req, self.token)
+        resp.content_type = 'application/json'
+
+        with self.lock:
+            if req.get_param_as_bool('stop'):
+                tracemalloc.stop()
+                self.previous = None
+                resp.body = json.dumps({"tracing": False})
+                return
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.FRAMES)
+                self.previous = self._snapshot()
+                resp.body = json.dumps({"tracing": True, "top": []})
+                return
+
+            snapshot = self._snapshot()
+            key_type = 'traceback' if req.get_param_as_bool('traceback') else 'lineno'
+            stats = snapshot.compare_to(self.previous, key_type)
+            self.previous = snapshot
+
+        top = req.get_param_as_int('top') or self.TOP
+        current, peak = tracemalloc.get_traced_memory()
+        resp.body = json.dumps({
+            "tracing": True,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"traceback": stat.traceback.format(), "size": stat.size, "size_diff": stat.size_diff,
+                     "count": stat.count, "count_diff": stat.count_diff} for stat in stats[:top]],
+        })
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
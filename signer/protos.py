@@ -0,0 +1,55 @@
+from functools import lru_cache
+
+# The trezorlib messages are filled straight from the fields of signer.decoders.read_*. The fields of every
+# message type are looked at once, when the first message of the type is built: each field gets a converter
+# for its protobuf type, nested messages a builder of their own. dict_to_proto does that walk on every call
+# and decodes the hex strings of the dict form back into bytes.
+
+
+def build(message_type, fields):
+    return builder(message_type)(fields)
+
+
+@lru_cache(maxsize=None)
+def builder(message_type):
+    mappers = tuple((name, _converter(field_type, repeated))
+                    for name, field_type, repeated in message_type.get_fields().values())
+
+    def build(fields):
+        kwargs = {}
+        for name, convert in mappers:
+            value = fields.get(name)
+            if value is not None:
+                kwargs[name] = convert(value)
+        return message_type(**kwargs)
+
+    return build
+
+
+def _converter(field_type, repeated):
+    from trezorlib import protobuf
+
+    if isinstance(field_type, type) and issubclass(field_type, protobuf.MessageType):
+        convert = builder(field_type)
+    elif field_type is protobuf.BytesType:
+        convert = _to_bytes
+    elif field_type is protobuf.BoolType:
+        convert = bool
+    else:
+        # numbers and enums are taken as they are
+        convert = None
+
+    if repeated:
+        return (lambda values: [convert(value) for value in values]) if convert else list
+    return convert if convert else _same
+
+
+def _same(value):
+    return value
+
+
+def _to_bytes(value):
+    # a contract id where the message only has bytes, e.g. the source in messages without TezosContractID
+    if isinstance(value, dict):
+        return value["hash"]
+    return value
@@ -0,0 +1,125 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+
+from signer import trezor_handler
+
+PUBLIC_KEYS_FILE = 'signer/public_keys.json'
+
+
+class PublicKeyCache(object):
+    # The public keys (pkh -> edpk) in memory, shared with the other gunicorn workers through the file: a miss
+    # reloads the file when another worker changed it, changes are written under a lock next to the file.
+
+    def __init__(self, filename=None):
+        # without a filename the public keys are only kept in memory
+        self.filename = filename
+        self.lock = threading.Lock()
+        self._file_id = None
+        self.public_keys = {}
+        self.refresh()
+
+    def get(self, pkh):
+        pk = self.public_keys.get(pkh)
+        if pk is None and self.filename is not None:
+            # registered or fetched by another worker in the meantime
+            self.refresh()
+            pk = self.public_keys.get(pkh)
+        return pk
+
+    def put(self, pkh, pk):
+        if pk is None or self.public_keys.get(pkh) == pk:
+            return
+
+        self.put_many({pkh: pk})
+
+    def put_many(self, public_keys):
+        # pkh -> public key, saved with a single write
+        with self._locked():
+            self.public_keys.update(public_keys)
+            self._save()
+
+    def clear(self):
+        # the device got a new seed, none of the cached keys is valid anymore
+        with self._locked():
+            self.public_keys = {}
+            self._save()
+
+    def refresh(self):
+        # reload the file when it was replaced since we read or wrote it (stat only otherwise)
+        if self.filename is None:
+            return
+        with self.lock:
+            file_id = _file_id(self.filename)
+            if file_id != self._file_id:
+                self.public_keys = self._load()
+                self._file_id = file_id
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # changes start from the latest file, so they never drop the keys written by another worker
+        with self.lock:
+            if self.filename is None:
+                yield
+                return
+            with open(self.filename + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                file_id = _file_id(self.filename)
+                if file_id != self._file_id:
+                    self.public_keys = self._load()
+                yield
+                self._file_id = _file_id(self.filename)
+
+    def fetch(self, pkh, config):
+        # return the cached public key, ask the device holding the key (see signer.devices) only on a miss
+        pk = self.get(pkh)
+        if pk is None:
+            pk = trezor_handler.get_public_key(config)
+            self.put(pkh, pk)
+        return pk
+
+    def warm_up(self, keys_config):
+        # fetch the public keys of all known keys in the background so the first GET does not wait for the device
+        thread = threading.Thread(target=self._warm_up, args=(dict(keys_config),), name='pk-warm-up')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _warm_up(self, keys_config):
+        for pkh, config in keys_config.items():
+            if self.get(pkh) is None:
+                try:
+                    self.fetch(pkh, config)
+                except Exception as e:
+                    logging.error("Error while warming up public key for {}: {}".format(pkh, e))
+        logging.info("Public key cache warmed up")
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as myfile:
+                return json.load(myfile)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self):
+        # write into a temporary file first, so a crash never leaves a truncated cache behind
+        if self.filename is None:
+            return
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as myfile:
+                myfile.write(json.dumps(self.public_keys))
+            os.replace(tmp_filename, self.filename)
+        except IOError as e:
+            logging.error("Could not persist public keys: {}".format(e))
+
+
+def _file_id(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
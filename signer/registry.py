@@ -0,0 +1,143 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections.abc import Mapping
+
+KNOWN_KEYS_FILE = 'signer/known_keys.json'
+
+
+class KeyRegistry(Mapping):
+    # The registered keys (pkh -> HD path) shared by all gunicorn workers.
+    # known_keys.json is the snapshot, new keys are appended as single JSON lines to a log next to it.
+    # A worker only looks at the files when it misses a key, and then reads just the appended records.
+
+    # fold the log into the snapshot once it holds this many records
+    COMPACT_AFTER = 1000
+
+    def __init__(self, filename=KNOWN_KEYS_FILE):
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.lock = threading.RLock()
+
+        self.keys_config = {}
+        self._snapshot_id = None
+        self._log_id = None
+        self._log_offset = 0
+        self._log_records = 0
+
+        self.refresh()
+
+    def __getitem__(self, pkh):
+        try:
+            return self.keys_config[pkh]
+        except KeyError:
+            self.refresh()
+            return self.keys_config[pkh]
+
+    def __contains__(self, pkh):
+        if pkh in self.keys_config:
+            return True
+        # an unknown key might have been registered by another worker in the meantime
+        self.refresh()
+        return pkh in self.keys_config
+
+    def __iter__(self):
+        self.refresh()
+        return iter(list(self.keys_config))
+
+    def __len__(self):
+        self.refresh()
+        return len(self.keys_config)
+
+    def add(self, pkh, config):
+        self.add_many({pkh: config})
+
+    def add_many(self, keys_config):
+        # append all new keys with one write, the order of records does not matter
+        with self.lock:
+            fd = os.open(self.log_filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self.refresh()
+                new_keys = dict((pkh, config) for pkh, config in keys_config.items()
+                                if self.keys_config.get(pkh) != config)
+                if new_keys:
+                    # refreshed under the lock, anything past the offset is a torn record of a crashed process,
+                    # cut it off or the first new record would be glued to it and skipped when read
+                    if os.fstat(fd).st_size > self._log_offset:
+                        logging.warning("Truncating torn key record at offset %s", self._log_offset)
+                        os.ftruncate(fd, self._log_offset)
+                    records = ''.join(json.dumps({"pkh": pkh, "config": config}) + '\n'
+                                      for pkh, config in new_keys.items())
+                    os.write(fd, records.encode())
+                    os.fsync(fd)
+                    self.refresh()
+
+                if self._log_records > self.COMPACT_AFTER:
+                    self._compact(fd)
+            finally:
+                os.close(fd)
+
+    def refresh(self):
+        # cheap change detection: stat both files, reload the snapshot only when it was replaced
+        with self.lock:
+            snapshot_id = self._file_id(self.filename)
+            log_id = self._file_id(self.log_filename)
+
+            if snapshot_id != self._snapshot_id or (log_id is not None and log_id[2] < self._log_offset) \
+                    or (log_id is not None and self._log_id is not None and log_id[0] != self._log_id[0]):
+                self._load_snapshot()
+                self._snapshot_id = snapshot_id
+                self._log_offset = 0
+                self._log_records = 0
+
+            if log_id is not None and log_id[2] > self._log_offset:
+                self._read_log()
+            self._log_id = log_id
+
+    def _load_snapshot(self):
+        try:
+            with open(self.filename, 'r') as myfile:
+                self.keys_config = json.load(myfile)
+            logging.info('Parsed keys.json successfully as JSON')
+        except (IOError, ValueError) as e:
+            logging.error("Could not read {}: {}".format(self.filename, e))
+            self.keys_config = {}
+
+    def _read_log(self):
+        with open(self.log_filename, 'rb') as myfile:
+            myfile.seek(self._log_offset)
+            data = myfile.read()
+
+        # an incomplete last record is read again on the next refresh
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line.decode())
+                self.keys_config[record["pkh"]] = record["config"]
+                self._log_records += 1
+            except (ValueError, KeyError):
+                logging.warning("Skipping invalid key record {}".format(line))
+        self._log_offset += end
+
+    def _compact(self, fd):
+        # called with the log locked: write the full snapshot, then empty the log
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as myfile:
+            myfile.write(json.dumps(self.keys_config))
+            myfile.flush()
+            os.fsync(myfile.fileno())
+        os.replace(tmp_filename, self.filename)
+        os.ftruncate(fd, 0)
+        self.refresh()
+        logging.info("Compacted key registry into {}".format(self.filename))
+
+    @staticmethod
+    def _file_id(filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+
+from signer.metrics import metrics
+
+# the device backend, SIGNER_DEVICE=simulator replaces the trezor by signer.simulator
+DEVICE_BACKEND = os.environ.get('SIGNER_DEVICE', 'trezor')
+
+_reconnect_errors = None
+
+
+def reconnect_errors():
+    # errors meaning the device went away (unplugged, reset, usb re-enumerated), worth a reconnect.
+    # trezorlib and usb1 are imported on the first device call, not when the app is loaded.
+    global _reconnect_errors
+    if _reconnect_errors is None:
+        from trezorlib.transport import TransportException
+        errors = (TransportException, IOError)
+        try:
+            import usb1
+            errors += (usb1.USBError,)
+        except ImportError:
+            pass
+        _reconnect_errors = errors
+    return _reconnect_errors
+
+
+class DeviceSession(object):
+    # how many times a call is retried after the transport went away (unplug, reset, ...)
+    RECONNECT_ATTEMPTS = 1
+
+    def __init__(self, path=None, backend=None, serial=None):
+        # transport path or serial (device id) of the device, None picks the first device found
+        self.path = path
+        self.serial = serial
+
+        # 'trezor' or 'simulator', see signer.simulator
+        self.backend = backend if backend is not None else DEVICE_BACKEND
+
+        # every call to the device has to go through this lock, the trezor can only handle one request at a time
+        self.lock = threading.RLock()
+
+        self._transport = None
+        self._client = None
+
+        # staking mode as set by the last start_staking, None when unknown
+        self.staking = None
+
+    @property
+    def connected(self):
+        return self._client is not None
+
+    def client(self):
+        # return the open client, connect lazily on first use
+        with self.lock:
+            if self._client is None:
+                self._connect()
+            return self._client
+
+    def call(self, func, *args, **kwargs):
+        # run func(client, *args, **kwargs) while holding the device,
+        # reconnect transparently when the transport was lost in the meantime
+        with self.lock:
+            attempt = 0
+            while True:
+                try:
+                    return func(self.client(), *args, **kwargs)
+                except reconnect_errors() as e:
+                    logging.warning("Trezor transport lost, reconnecting: %s", e)
+                    # the cached transport might point to an unplugged device, enumerate again
+                    self.reset(forget_transport=True)
+                    if attempt >= self.RECONNECT_ATTEMPTS:
+                        raise
+                    attempt += 1
+
+    def reset(self, forget_transport=False):
+        with self.lock:
+            if self._client is not None:
+                try:
+                    self._client.close()
+                except Exception as e:
+                    logging.debug("Error while closing trezor session: %s", e)
+            self._client = None
+
+            if forget_transport:
+                self._transport = None
+
+    def close(self):
+        self.reset(forget_transport=True)
+
+    def forget(self):
+        # in a forked worker: drop the client and transport inherited from the parent without closing
+        # them, the parent still owns the usb handle. The lock might have been held while forking.
+        self.lock = threading.RLock()
+        self._client = None
+        self._transport = None
+
+    def _connect(self):
+        start = time.perf_counter()
+        try:
+            self._open_client()
+        finally:
+            metrics.observe('device_connect', time.perf_counter() - start)
+
+    def _open_client(self):
+        if self.backend == 'simulator':
+            from signer import simulator
+            logging.info("Using the simulated device")
+            self._client = simulator.SimulatedClient(device_id=self.serial or self.path)
+            return
+
+        from trezorlib.client import TrezorClient
+        from trezorlib.transport import get_transport, TransportException
+        from trezorlib import ui
+
+        if self._transport is None and self.serial is not None:
+            # the serial is only known once a session is open, look at every connected device
+            self._client = self._find_serial()
+            return
+
+        if self._transport is None:
+            # the usb enumeration is expensive, do it once and reuse the transport
+            self._transport = get_transport(self.path)
+            logging.info("Using trezor device {}".format(self._transport.get_path()))
+
+        try:
+            client = TrezorClient(self._transport, ui=ui.ClickUI())
+            # keep the transport session open for the whole lifetime of the client
+            client.open()
+        except TransportException:
+            self._transport = None
+            raise
+
+        self._client = client
+
+    def _find_serial(self):
+        from trezorlib.client import TrezorClient
+        from trezorlib.transport import enumerate_devices, TransportException
+        from trezorlib import ui
+
+        for transport in enumerate_devices():
+            try:
+                client = TrezorClient(transport, ui=ui.ClickUI())
+                client.open()
+            except TransportException:
+                # e.g. held by the session of another device
+                continue
+            if client.features.device_id == self.serial:
+                logging.info("Using trezor device %s at %s", self.serial, transport.get_path())
+                self._transport = transport
+                return client
+            client.close()
+
+        raise TransportException("No trezor device with serial {}".format(self.serial))
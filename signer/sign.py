@@ -1,97 +1,228 @@
 import json
 import logging
-import struct
-from signer import trezor_handler
+from signer import decoders, protos, trezor_handler
+from signer.authorized import AuthenticationError, AuthorizedKeys
+from signer.logs import request_log
+from signer.metrics import Timer, metrics
+from signer.devices import DevicePool
+from signer.policy import Policies
+from signer.public_keys import PublicKeyCache
+from signer.signatures import SignatureCache
+from signer.watermark import HighWatermark
+from signer.worker import DeviceWorker, PRIORITY_TRANSACTION, deadline_for, parse_budget, priority_for
 import falcon
-import os
 
-from trezorlib import messages
-from trezorlib.protobuf import dict_to_proto
+# the responses of the signing endpoints are written from these templates, signatures and public keys are base58
+SIGNATURE_TEMPLATE = b'{"signature": "%s"}'
+PUBLIC_KEY_TEMPLATE = b'{"public_key": "%s"}'
+NO_KEYS_BODY = json.dumps({"kind": "generic", "error": "no keys for the source contract manager"}).encode()
+
+# the raw operation bytes, instead of the hex string in json
+OCTET_STREAM = 'application/octet-stream'
+
+
+def signature_body(signature):
+    return SIGNATURE_TEMPLATE % "{}".format(signature).encode('ascii')
+
+
+def public_key_body(pk):
+    return PUBLIC_KEY_TEMPLATE % "{}".format(pk).encode('ascii')
 
 
 class KeysResource(object):
     BLOCK_WATERMARK = 1
     ENDORSEMENT_WATERMARK = 2
     TRANSACTION_WATERMARK = 3
-    FITNESS_PREFIX_SIZE = 4
-    DELEGATION_TAG = 10
-    REVEAL_TAG = 7
-    PROPOSAL_TAG = 5
-    BALLOT_TAG = 6
-    OPERATION_TAG_INDEX = 33
 
-    # Pad the deserialized data
-    PADDING_2 = 2
+    # optional time budget of a sign request in milliseconds, expired requests are dropped before reaching the device
+    DEADLINE_HEADER = 'X-Signer-Deadline'
 
-    # Index of the first zarith number
-    ZARITH_DELEGATION_INDEX = ZARITH_REVEAL_INDEX = 56
-    ZARITH_REVEAL_WITH_DELEGATION_INDEX = 23
+    # signature of the request by an authorized key, see signer.authorized
+    AUTHENTICATION_PARAM = 'authentication'
 
-    # length without zarith -> we need to calculate and add later
-    REVEAL_LENGTH = 89
+    # besides json, see RequireJSON
+    raw_content_types = (OCTET_STREAM,)
 
-    # needed for the presence_of_nonce_hash
-    BLOCK_PRESENCE_OF_NONCE_WITHOUT_FITNESS_INDEX = 133
+    # upper bound of a request body, the largest supported operation is a few hundred bytes
+    MAX_BODY_SIZE = 64 * 1024
 
-    PROPOSAL_LENGTH = 32
-
-    def __init__(self, keys_config):
+    def __init__(self, keys_config, public_keys=None, worker=None, watermarks=None, signatures=None,
+                 authorized_keys=None):
         # the only mimetype we return is json
         self.content_type = 'application/json'
 
         self.keys_config = keys_config
+        self.public_keys = public_keys if public_keys is not None else PublicKeyCache()
+        self.worker = worker if worker is not None else DeviceWorker()
+        # keys held by other devices are signed by the workers of their devices
+        self.devices = DevicePool(self.worker)
+
+        # double signing protection of blocks and endorsements
+        self.watermarks = watermarks if watermarks is not None else HighWatermark()
+
+        # per key signing policies, see signer.policy
+        self.policies = Policies()
+
+        # retried payloads are answered from here, before parsing and before the watermark check,
+        # a retried block would be rejected by the watermark otherwise
+        self.signatures = signatures if signatures is not None else SignatureCache()
+
+        # without authorized keys every request is signed
+        self.authorized_keys = authorized_keys if authorized_keys is not None else AuthorizedKeys()
 
     def on_get(self, req, resp, pkh):
-        logging.info("Retrieving public key for {}".format(pkh))
+        request_log.info("Retrieving public key for %s", pkh)
         try:
-            if pkh in self.keys_config.keys():
-                pk = trezor_handler.get_public_key(self.keys_config[pkh])
+            if pkh in self.keys_config:
+                pk = self.public_keys.get(pkh)
+                if pk is None:
+                    pk = self.devices.submit(self.keys_config[pkh], self.public_keys.fetch, pkh,
+                                             priority=PRIORITY_TRANSACTION).result()
 
                 resp.content_type = self.content_type
-                resp.body = json.dumps({"public_key": "{}".format(pk)})
+                resp.data = public_key_body(pk)
             else:
-                resp.body = json.dumps({"kind": "generic", "error": "no keys for the source contract manager"})
+                resp.data = NO_KEYS_BODY
                 resp.status = falcon.HTTP_500
         except Exception as e:
-            logging.error("Error in retrieving pk: \n", e)
+            logging.error("Error in retrieving pk: %s", e)
             resp.status = falcon.HTTP_500
             resp.body = json.dumps({"Error": "Exception in retrieving pk"})
 
     def on_post(self, req, resp, pkh):
-        signature = None
+        timer = Timer()
+        kind = 'unknown'
+        # a body announced too large is refused before anything is read
+        if req.content_length is not None and req.content_length > self.MAX_BODY_SIZE:
+            raise falcon.HTTPPayloadTooLarge('Request body too large')
+        try:
+            budget_ms = parse_budget(req.get_header(self.DEADLINE_HEADER))
+        except ValueError as e:
+            raise falcon.HTTPBadRequest('Invalid header value', str(e))
         try:
             resp.content_type = self.content_type
 
-            logging.info("Signing received data for {}".format(pkh))
+            request_log.info("Signing received data for %s", pkh)
 
             # sign, if we have already registered the hdpath for the signer
-            if pkh in self.keys_config.keys():
+            if pkh in self.keys_config:
                 # read and deserialize data
-                data = json.loads(req.stream.read())
-                msg_bytes = bytes.fromhex(data)
-                proto_message = self.parse_message(msg_bytes)
-
-                # determine if the message is a baking operation or a transaction like operation
-                if self.is_endorsement(msg_bytes) or self.is_block(msg_bytes):
-                    signature = trezor_handler.sign_baking(proto_message, self.keys_config[pkh])
-
-                elif self.is_transaction_like(msg_bytes):
-                    logging.info("Operation is transaction like")
-                    signature = trezor_handler.sign_non_baking_op(proto_message, self.keys_config[pkh])
+                msg_bytes = self.read_message(req, timer)
+                kind = self.operation_kind(msg_bytes)
+                self.authorized_keys.authenticate(pkh, msg_bytes, req.get_param(self.AUTHENTICATION_PARAM))
 
-                else:
-                    resp.status = falcon.HTTP_500
-                    resp.body = json.dumps({"Error": "Message not supported"})
+                signature = self.submit(pkh, msg_bytes, budget_ms, timer).result()
 
-                resp.body = json.dumps({"signature": "{}".format(signature)})
+                resp.data = signature_body(signature)
+                timer.stage('serialize')
+                timer.record(kind, pkh)
+                metrics.count(kind, pkh, 'ok')
 
             else:
-                resp.body = json.dumps({"kind": "generic", "error": "no keys for the source contract manager"})
+                resp.data = NO_KEYS_BODY
                 resp.status = falcon.HTTP_500
+                # unknown keys are not labelled, every random pkh would add a series
+                metrics.count(kind, '', 'unknown_key')
+        except AuthenticationError as e:
+            logging.warning("Refused unauthenticated request for %s: %s", pkh, e)
+            resp.status = falcon.HTTP_401
+            resp.body = json.dumps({"Error": str(e)})
+            metrics.count(kind, pkh, 'unauthorized')
         except Exception as e:
-            logging.error("Error in signing: \n", e)
+            logging.error("Error in signing: %s", e)
             resp.status = falcon.HTTP_500
-            resp.body = json.dumps({"Error": e})
+            resp.body = json.dumps({"Error": str(e)})
+            metrics.count(kind, pkh, 'error')
+
+    def read_message(self, req, timer=None):
+        # a chunked body has no content length, it is read only up to the limit
+        body = req.bounded_stream.read(self.MAX_BODY_SIZE + 1)
+        if len(body) > self.MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        msg_bytes = self.decode_body(body, req.content_type, timer)
+        # for the request recorder, see signer.middleware
+        req.context['msg_bytes'] = msg_bytes
+        return msg_bytes
+
+    @staticmethod
+    def decode_body(body, content_type, timer=None):
+        # the operation bytes of a raw body, or of the hex string in a json body
+        if content_type is not None and content_type.startswith(OCTET_STREAM):
+            return body
+
+        data = json.loads(body)
+        if timer is not None:
+            timer.stage('json_decode')
+        msg_bytes = bytes.fromhex(data)
+        if timer is not None:
+            timer.stage('hex_decode')
+        return msg_bytes
+
+    def submit(self, pkh, msg_bytes, budget_ms=None, timer=None):
+        # return a future of the signature, the same payload is only signed once
+        return self.signatures.submit(pkh, msg_bytes, lambda: self._submit(pkh, msg_bytes, budget_ms, timer))
+
+    def _submit(self, pkh, msg_bytes, budget_ms=None, timer=None):
+        # parse the message and queue its signature on the device worker, return a future of the signature
+        sign, proto_message, config = self.prepare(pkh, msg_bytes)
+        if timer is not None:
+            timer.stage('parse')
+            sign = timer.wrap(sign)
+
+        priority = priority_for(msg_bytes)
+        return self.devices.submit(config, sign, proto_message, priority=priority,
+                                   deadline=deadline_for(priority, budget_ms))
+
+    def prepare(self, pkh, msg_bytes):
+        # parse and validate the message without touching the device,
+        # return the device call together with its arguments
+        if pkh not in self.keys_config:
+            raise ValueError("no keys for the source contract manager")
+
+        operation = self.decode_message(msg_bytes)
+        if operation is None:
+            raise ValueError("Message not supported")
+
+        # rejected operations neither raise the watermark nor reach the device
+        config = self.keys_config[pkh]
+        self.policies.check(pkh, config, self.policy_kind(msg_bytes), operation)
+
+        proto_message = self.to_proto(msg_bytes, operation)
+
+        # determine if the message is a baking operation or a transaction like operation
+        if self.is_block(msg_bytes):
+            self.watermarks.check(pkh, operation["chain_id"].hex(), 'block', operation["block_header"]["level"])
+            return trezor_handler.sign_baking, proto_message, config
+
+        if self.is_endorsement(msg_bytes):
+            self.watermarks.check(pkh, operation["chain_id"].hex(), 'endorsement', operation["endorsement"]["level"])
+            return trezor_handler.sign_baking, proto_message, config
+
+        logging.debug("Operation is transaction like")
+        return trezor_handler.sign_non_baking_op, proto_message, config
+
+    def policy_kind(self, msg_bytes):
+        if self.is_block(msg_bytes):
+            return 'block'
+        if self.is_endorsement(msg_bytes):
+            return 'endorsement'
+        return 'transaction'
+
+    def operation_kind(self, msg_bytes):
+        # label of the message in the metrics
+        if not msg_bytes:
+            return 'unknown'
+        if self.is_block(msg_bytes):
+            return 'block'
+        if self.is_endorsement(msg_bytes):
+            return 'endorsement'
+        if self.is_transaction_like(msg_bytes):
+            try:
+                # the last content is the one a reveal is made for
+                return decoders.content_kinds(msg_bytes)[-1]
+            except Exception:
+                return 'unknown'
+        return 'unknown'
 
     def is_endorsement(self, msg_bytes):
         return msg_bytes[0] == self.ENDORSEMENT_WATERMARK
@@ -103,355 +234,106 @@ class KeysResource(object):
         return msg_bytes[0] == self.TRANSACTION_WATERMARK
 
     def parse_message(self, msg_bytes):
-        # Determine the operation type from the message
-        operation_tag = msg_bytes[self.OPERATION_TAG_INDEX]
-        operation = None
-
-        # parse the message according the operation type
-        if self.is_block(msg_bytes):
-            operation = self.parse_block(msg_bytes)
-
-        elif self.is_endorsement(msg_bytes):
-            operation = self.parse_endorsement(msg_bytes)
+        operation = self.decode_message(msg_bytes)
+        if operation is None:
+            return None
 
-        elif self.is_transaction_like(msg_bytes):
-            if operation_tag == self.DELEGATION_TAG:
-                operation = self.parse_delegation(msg_bytes)
+        return self.to_proto(msg_bytes, operation)
 
-            elif operation_tag == self.REVEAL_TAG:
-                operation = self.parse_delegation_with_reveal(msg_bytes)
+    def decode_message(self, msg_bytes):
+        # the fields of the message as bytes (see decoders.read_*), the parse_* methods return them as hex
+        try:
+            # parse the message according the operation type
+            if self.is_block(msg_bytes):
+                return decoders.read_block(msg_bytes)
+
+            if self.is_endorsement(msg_bytes):
+                return decoders.read_endorsement(msg_bytes)
+
+            if self.is_transaction_like(msg_bytes):
+                # every contents entry, e.g. a reveal followed by a transaction
+                return decoders.read_transaction_like(msg_bytes)
+        except decoders.UnsupportedOperation:
+            # well formed, but the device can not sign it, tell the caller why
+            raise
+        except Exception as e:
+            logging.error("Error occurred while parsing message: %s", e)
+            return None
 
-            elif operation_tag == self.PROPOSAL_TAG:
-                operation = self.parse_proposal(msg_bytes)
+        logging.warning("Message not supported!")
+        return None
 
-            elif operation_tag == self.BALLOT_TAG:
-                operation = self.parse_ballot(msg_bytes)
+    def to_proto(self, msg_bytes, operation):
+        # trezorlib is loaded on the first signature, not when the app is imported
+        from trezorlib import messages
 
-            return dict_to_proto(messages.TezosSignTx, operation)
-        else:
-            logging.warning("Message not supported!")
-            return None
+        if self.is_transaction_like(msg_bytes):
+            return protos.build(messages.TezosSignTx, operation)
 
-        return dict_to_proto(messages.TezosSignBakerOp, operation)
+        return protos.build(messages.TezosSignBakerOp, operation)
 
     def parse_endorsement(self, msg_bytes):
         endorsement_msg = None
         try:
-            logging.info(msg_bytes)
-            endorsement_format = 'B4s32sBB4s'
-            fields = struct.unpack(endorsement_format, msg_bytes)
-
-            # unpack the message
-            (magic_byte,
-             chain_id,
-             branch,
-             tag,
-             slot,
-             level) = fields
-
-            logging.info(slot)
-
-            # create a dictionary from the deserialized data
-            # f"{int}:0{padding}x" -> convert the int into string of the required length
-            endorsement_msg = {
-                "chain_id": chain_id.hex(),
-                "endorsement": {
-                    "branch": branch.hex(),
-                    "slot": slot,
-                    "level": int.from_bytes(level, 'big'),
-                }
-            }
+            endorsement_msg = decoders.decode_endorsement(msg_bytes)
         except Exception as e:
-            logging.error(e)
-            logging.error("Error occured while parsing endorsement")
+            logging.error("Error occurred while parsing endorsement: %s", e)
 
         return endorsement_msg
 
     def parse_block(self, msg_bytes):
-        # the field fitness has a variable length, we need determine that first
         block_header_msg = None
         try:
-            bytes_in_fitness = int.from_bytes(msg_bytes[83:87], 'big') - self.FITNESS_PREFIX_SIZE
-
-            # check for the presence of the field seed_nonce_hash in advance so we prevent deserialization error
-            if self._decode_bool(msg_bytes[self.BLOCK_PRESENCE_OF_NONCE_WITHOUT_FITNESS_INDEX + bytes_in_fitness]):
-                logging.info("with nonce hash")
-
-                # The seed nonce hash is always represented by the last 32 bytes
-                seed_nonce_hash = msg_bytes[-32:]
-
-                # Remove the seed nonce hash from the message and continue with deserialization
-                msg_bytes = msg_bytes[:len(msg_bytes) - 32]
-
-            # deserialize data
-            block_format = 'B4s4sB32s8sB32s4s4s{}s32s2s8sB'.format(bytes_in_fitness)
-            fields = struct.unpack(block_format, msg_bytes)
-
-            (magic_byte,
-             chain_id,
-             level,
-             proto,
-             predecessor,
-             timestamp,
-             validation_pass,
-             operations_hash,
-             bytes_in_field_fitness,
-             bytes_in_next_field,
-             fitness,
-             context,
-             priority,
-             proof_of_work_nonce,
-             presence_of_field_seed_nonce_hash,
-            ) = fields
-
-            # create a dictionary from the deserialized data
-            block_header_msg = {
-                "chain_id": chain_id.hex(),
-                "block_header": {
-                    "level": int.from_bytes(level, 'big'),
-                    "proto": proto,
-                    "predecessor": predecessor.hex(),
-                    "timestamp": int.from_bytes(timestamp, 'big'),
-                    "validation_pass": validation_pass,
-                    "operations_hash": operations_hash.hex(),
-                    "bytes_in_field_fitness": int.from_bytes(bytes_in_field_fitness, 'big'),
-                    "bytes_in_next_field": int.from_bytes(bytes_in_next_field, 'big'),
-                    "fitness": fitness.hex(),
-                    "context": context.hex(),
-                    "priority": int.from_bytes(priority, 'big'),
-                    "proof_of_work_nonce": proof_of_work_nonce.hex(),
-                    "presence_of_field_seed_nonce_hash": self._decode_bool(presence_of_field_seed_nonce_hash),
-                }
-            }
-
-            # if the seed_nonce_hash field is present add it to the dictionary
-            if self._decode_bool(presence_of_field_seed_nonce_hash):
-                block_header_msg['block_header']['seed_nonce_hash'] = seed_nonce_hash.hex()
-
+            block_header_msg = decoders.decode_block(msg_bytes)
         except Exception as e:
-            logging.error("Error occurred while parsing block ", e)
+            logging.error("Error occurred while parsing block: %s", e)
 
         return block_header_msg
 
     def parse_delegation(self, msg_bytes):
         delegation_msg = None
-
         try:
-            # first, decode the zarith numbers to get the exact length of the zarith numbers
-            zarith_nums, checked_bytes = self._decode_zarith(msg_bytes, self.ZARITH_DELEGATION_INDEX)
-
-            # deserialize data
-            delegation_format = 'B32sBB21s{}sB21s'.format(checked_bytes)
-            fields = struct.unpack(delegation_format, msg_bytes)
-
-            (magic_byte,
-             branch,
-             operation_tag,
-             source_tag,
-             source_hash,
-             zarith,
-             presence_of_delegate,
-             delegate
-            ) = fields
-
-            # create a dictionary
-            delegation_msg = {
-                "branch": branch.hex(),
-                "delegation": {
-                    "source": {
-                        "tag": source_tag,
-                        "hash": source_hash.hex(),
-                    },
-                    "fee": zarith_nums[0],
-                    "counter": zarith_nums[1],
-                    "gas_limit": zarith_nums[2],
-                    "storage_limit": zarith_nums[3],
-                    "delegate": delegate.hex(),
-                },
-            }
+            delegation_msg = decoders.decode_delegation(msg_bytes)
         except Exception as e:
-            logging.error("Error occurred while parsing delegation")
+            logging.error("Error occurred while parsing delegation: %s", e)
 
         return delegation_msg
 
     def parse_delegation_with_reveal(self, msg_bytes):
         delegation_with_reveal_msg = None
         try:
-            # parse the reveal part first
-            zarith_nums, checked_bytes = self._decode_zarith(msg_bytes, self.ZARITH_REVEAL_INDEX)
-
-            # slice the message into reveal and delegation bytes
-            reveal_bytes = msg_bytes[:self.REVEAL_LENGTH + checked_bytes]
-            delegation_bytes = msg_bytes[self.REVEAL_LENGTH + checked_bytes:]
-
-            # add the calculated bytes length
-            reveal_format = 'B32sBB21s{}s33s'.format(checked_bytes)
-
-            # deserialize reveal part
-            fields = struct.unpack(reveal_format, reveal_bytes)
-
-            (magic_byte,
-             branch,
-             operation_tag,
-             source_tag,
-             source_hash,
-             zarith,
-             public_key
-             ) = fields
-
-            reveal_msg = {
-                "source": {
-                    "tag": source_tag,
-                    "hash": source_hash.hex(),
-                },
-                "fee": zarith_nums[0],
-                "counter": zarith_nums[1],
-                "gas_limit": zarith_nums[2],
-                "storage_limit": zarith_nums[3],
-                "public_key": public_key.hex(),
-            }
-
-            # do the same for the delegation part
-            zarith_nums, checked_bytes = self._decode_zarith(delegation_bytes, self.ZARITH_REVEAL_WITH_DELEGATION_INDEX)
-            delegation_format = 'BB21s{}sB21s'.format(checked_bytes)
-
-            # deserialize delegation part
-            fields = struct.unpack(delegation_format, delegation_bytes)
-
-            (operation_tag,
-             source_tag,
-             source_hash,
-             zarith,
-             presence_of_delegate,
-             delegate
-             ) = fields
-
-            delegation_msg = {
-                "source": {
-                    "tag": source_tag,
-                    "hash": source_hash.hex(),
-                },
-                "fee": zarith_nums[0],
-                "counter": zarith_nums[1],
-                "gas_limit": zarith_nums[2],
-                "storage_limit": zarith_nums[3],
-                "delegate": delegate.hex(),
-            }
-
-            # put everything together
-            delegation_with_reveal_msg = {
-                "branch": branch.hex(),
-                "reveal": reveal_msg,
-                "delegation": delegation_msg
-            }
-
+            delegation_with_reveal_msg = decoders.decode_delegation_with_reveal(msg_bytes)
         except Exception as e:
-            logging.error("Error occurred while parsing delegation with reveal")
+            logging.error("Error occurred while parsing delegation with reveal: %s", e)
 
         return delegation_with_reveal_msg
 
-    # TODO: test needed
     def parse_proposal(self, msg_bytes):
         proposal_msg = None
         try:
-            bytes_in_proposals_field = int.from_bytes(msg_bytes[59:63], 'big')
-            print(bytes_in_proposals_field)
-
-            proposal_format = 'B32sB21s4s4s{}s'.format(bytes_in_proposals_field)
-            fields = struct.unpack(proposal_format, msg_bytes)
-
-            # unpack the message
-            (magic_byte,
-             branch,
-             operation_tag,
-             source,
-             period,
-             bytes_in_next_field,
-             proposals
-             ) = fields
-
-            proposal_list = list(
-                [
-                    proposals[i: i + 32]
-                    for i in range(0, len(proposals), 32)
-                ]
-            )
-            proposal_list2 = [prop.hex() for prop in proposal_list]
-
-            # create a dictionary from the deserialized data
-            proposal_msg = {
-                "branch": branch.hex(),
-                "proposal": {
-                    "source": source.hex(),
-                    "period": int.from_bytes(period, 'big'),
-                    "proposals": proposal_list2,
-                },
-            }
+            proposal_msg = decoders.decode_proposal(msg_bytes)
         except Exception as e:
-            logging.error("Error occured while parsing proposal", e)
+            logging.error("Error occurred while parsing proposal: %s", e)
 
         return proposal_msg
 
-    # TODO: test needed
     def parse_ballot(self, msg_bytes):
         ballot_msg = None
-
         try:
-            ballot_format = 'B32sB21s4s32sB'
-            fields = struct.unpack(ballot_format, msg_bytes)
-
-            (magic_byte,
-             branch,
-             operation_tag,
-             source,
-             period,
-             proposal,
-             ballot
-            ) = fields
-
-        # create dictionary
-            ballot_msg = {
-                "branch": branch.hex(),
-                "ballot": {
-                    "source": source.hex(),
-                    "period": int.from_bytes(period, 'big'),
-                    "proposal": proposal.hex(),
-                    "ballot": ballot
-                },
-            }
-
+            ballot_msg = decoders.decode_ballot(msg_bytes)
         except Exception as e:
-            logging.error("Error occurred while parsing ballot", e)
+            logging.error("Error occurred while parsing ballot: %s", e)
 
         return ballot_msg
 
     def parse_tx(self, msg_bytes):
         tx_message = None
+        try:
+            tx_message = decoders.decode_transaction_like(msg_bytes)
+        except decoders.UnsupportedOperation:
+            # well formed, but the device can not sign it, tell the caller why
+            raise
+        except Exception as e:
+            logging.error("Error occurred while parsing transaction: %s", e)
 
-    @staticmethod
-    def _decode_bool(num):
-        if num == 255:
-            return True
-        else:
-            return False
-
-    @staticmethod
-    def _decode_zarith(raw_bytes, start):
-        num_list = []
-        res_list = []
-        counter = 0
-
-        for i in range(4):
-            next_b = 1
-            while next_b:
-                num = raw_bytes[start + counter] & ~(1 << 7)
-                num_list.append(num)
-                next_b = raw_bytes[start + counter] >> 7
-                counter += 1
-            res = num_list.pop()
-            while num_list:
-                res = res << 7 | num_list.pop()
-
-            res_list.append(res)
-
-        return res_list, counter
+        return tx_message
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SignatureCache(object):
+    # Signatures of recently signed payloads, keyed by pkh and payload hash. Bakers and tezos-client retry
+    # on timeout with the very same payload; ed25519 signatures are deterministic, so the retry gets the
+    # signature of the first request instead of a second device call. A retry arriving while the first
+    # request is still queued or on the device waits for that same call.
+
+    MAX_SIZE = 10000
+    # seconds, retries come within a few seconds, nothing needs to stay longer
+    TTL = 300.0
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        # key -> (expiry, signature), least recently used first
+        self.signatures = OrderedDict()
+        # key -> future of the signature being computed
+        self.pending = {}
+
+    def submit(self, pkh, msg_bytes, sign):
+        # return a future of the signature: cached, in flight, or of the device call sign() returns a future of
+        key = (pkh, hashlib.blake2b(msg_bytes, digest_size=16).digest())
+
+        with self.lock:
+            entry = self.signatures.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.signatures.move_to_end(key)
+                    future = Future()
+                    future.set_result(entry[1])
+                    return future
+                del self.signatures[key]
+
+            pending = self.pending.get(key)
+            if pending is not None:
+                return pending
+            pending = self.pending[key] = Future()
+
+        try:
+            signing = sign()
+        except Exception as e:
+            self._done(key, pending, None, e)
+            raise
+
+        signing.add_done_callback(lambda signing: self._done(key, pending, signing))
+        return pending
+
+    def clear(self):
+        with self.lock:
+            self.signatures.clear()
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _done(self, key, pending, signing, error=None):
+        if error is None:
+            error = signing.exception()
+
+        with self.lock:
+            del self.pending[key]
+            # failures are not cached, the next retry asks the device again
+            if error is None:
+                self.signatures[key] = (time.monotonic() + self.ttl, signing.result())
+                if len(self.signatures) > self.max_size:
+                    self.signatures.popitem(last=False)
+
+        if error is None:
+            pending.set_result(signing.result())
+        else:
+            pending.set_exception(error)
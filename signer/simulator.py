@@ -0,0 +1,106 @@
+import hashlib
+import hmac
+import io
+import logging
+import os
+import random
+import time
+
+from trezorlib import messages, protobuf
+
+from signer.encoding import b58encode_check, EDPK_PREFIX, EDSIG_PREFIX, TZ1_PREFIX
+
+# latency of every simulated device call and its random jitter (milliseconds)
+SIMULATOR_LATENCY_MS = float(os.environ.get('SIMULATOR_LATENCY_MS', '0'))
+SIMULATOR_JITTER_MS = float(os.environ.get('SIMULATOR_JITTER_MS', '0'))
+
+SIMULATOR_SEED = os.environ.get('SIMULATOR_SEED', 'tezedge signer simulator').encode()
+
+# the staking firmware messages, not part of every trezorlib
+CONTROL_BAKING_MESSAGES = ('TezosControlBaking', 'TezosControlStaking')
+
+
+class SimulatedClient(object):
+    # Stands in for a TrezorClient: answers the tezos messages sent by trezorlib's tezos helpers with
+    # keys derived deterministically from the seed and the HD path. The keys and signatures have the
+    # right encoding and size but are not real ed25519 keys, signatures can not be verified.
+
+    def __init__(self, latency_ms=SIMULATOR_LATENCY_MS, jitter_ms=SIMULATOR_JITTER_MS, seed=SIMULATOR_SEED,
+                 device_id=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.seed = seed
+        self.staking = False
+
+        self.features = messages.Features(vendor='trezor.io', model='T', initialized=True,
+                                          pin_protection=True, pin_cached=True, label='simulator',
+                                          device_id=device_id)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def init_device(self):
+        return self.features
+
+    def call(self, msg):
+        self._wait()
+
+        if isinstance(msg, messages.TezosGetAddress):
+            return messages.TezosAddress(address=self.address(msg.address_n))
+
+        if isinstance(msg, messages.TezosGetPublicKey):
+            return messages.TezosPublicKey(public_key=b58encode_check(EDPK_PREFIX, self._public_key(msg.address_n)))
+
+        if isinstance(msg, messages.TezosSignTx):
+            signature = self._sign(msg)
+            return messages.TezosSignedTx(signature=b58encode_check(EDSIG_PREFIX, signature),
+                                          sig_op_contents=signature, operation_hash='')
+
+        signed_baker_op = getattr(messages, 'TezosSignedBakerOp', None)
+        if signed_baker_op is not None and type(msg).__name__ == 'TezosSignBakerOp':
+            return signed_baker_op(signature=b58encode_check(EDSIG_PREFIX, self._sign(msg)))
+
+        if type(msg).__name__ in CONTROL_BAKING_MESSAGES:
+            self.staking = bool(getattr(msg, 'stake', True))
+            return messages.Success(message='Baking mode {}'.format('started' if self.staking else 'stopped'))
+
+        if isinstance(msg, (messages.Initialize, messages.GetFeatures)):
+            return self.features
+
+        if isinstance(msg, messages.Ping):
+            return messages.Success(message=msg.message)
+
+        logging.warning("Simulator does not support {}".format(type(msg).__name__))
+        return messages.Failure(code=messages.FailureType.UnexpectedMessage,
+                                message='Not supported by the simulator')
+
+    def address(self, address_n):
+        pkh = hashlib.blake2b(self._public_key(address_n), digest_size=20).digest()
+        return b58encode_check(TZ1_PREFIX, pkh)
+
+    def _secret(self, address_n):
+        path = b''.join(index.to_bytes(4, 'big') for index in address_n)
+        return hmac.new(self.seed, path, hashlib.sha256).digest()
+
+    def _public_key(self, address_n):
+        return hashlib.sha256(b'pk' + self._secret(address_n)).digest()
+
+    def _sign(self, msg):
+        # deterministic like ed25519: the same message signed by the same key gives the same signature
+        address_n = list(msg.address_n)
+        msg.address_n = []
+        data = io.BytesIO()
+        protobuf.dump_message(data, msg)
+        msg.address_n = address_n
+
+        return hmac.new(self._secret(address_n), data.getvalue(), hashlib.sha512).digest()
+
+    def _wait(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
@@ -0,0 +1,83 @@
+import gc
+import importlib
+import logging
+import os
+import sys
+import time
+
+# set by gunicorn.conf.py: the app is imported once by the master and the workers are forked from it
+PRELOAD = os.environ.get('SIGNER_PRELOAD') == '1'
+
+# imported lazily by the handlers, with a preloaded app they are imported once in the master instead
+HEAVY_MODULES = (
+    'trezorlib.messages',
+    'trezorlib.protobuf',
+    'trezorlib.client',
+    'trezorlib.transport',
+    'trezorlib.tezos',
+    'trezorlib.device',
+    'trezorlib.tools',
+    'trezorlib.ui',
+)
+
+# how many of the slowest imports are reported
+PROFILE_TOP = 10
+
+_after_fork = []
+
+
+def after_fork(func, *args):
+    # run func(*args) in every forked worker, e.g. to reopen file descriptors or restart threads
+    _after_fork.append((func, args))
+
+
+def in_worker(func, *args):
+    # run func(*args) in the worker process: now, or after the fork when the app is preloaded
+    if PRELOAD:
+        after_fork(func, *args)
+    else:
+        func(*args)
+
+
+def run_after_fork():
+    for func, args in _after_fork:
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error("Error in after fork hook %s: %s", getattr(func, '__name__', func), e)
+
+
+def import_profile(modules):
+    # import the modules which are not loaded yet, return (seconds, module) of each, slowest first
+    profile = []
+    for name in modules:
+        if name in sys.modules:
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logging.warning("Could not preload %s: %s", name, e)
+            continue
+        profile.append((time.perf_counter() - start, name))
+    return sorted(profile, reverse=True)
+
+
+def preload(app_seconds=None):
+    # Called by the master once the app is loaded: import the heavy modules so the workers share them,
+    # then move every object allocated so far out of the garbage collector's reach, the collector
+    # touching them would copy the shared pages into every worker.
+    modules_before = len(sys.modules)
+    profile = import_profile(HEAVY_MODULES)
+
+    if app_seconds is not None:
+        logging.info("Loaded the app in %.0f ms", app_seconds * 1000)
+    logging.info("Preloaded %d modules in %.0f ms, %d modules loaded",
+                 len(sys.modules) - modules_before, sum(seconds for seconds, _ in profile) * 1000, len(sys.modules))
+    for seconds, name in profile[:PROFILE_TOP]:
+        logging.info("  %8.1f ms %s", seconds * 1000, name)
+
+    gc.collect()
+    # gc.freeze is only available from python 3.7 on
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
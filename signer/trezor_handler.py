@@ -1,104 +1,162 @@
-from trezorlib.client import TrezorClient
-from trezorlib.transport import get_transport
-from trezorlib.tools import parse_path
-from trezorlib import tezos, ui, device
-from trezorlib.transport import TransportException
+from signer.devices import device_address, key_device, key_path
+from signer.session import DeviceSession
 
 import logging
+import threading
+
+# trezorlib is imported by the handlers on their first use, loading it is a large part of the startup time
+
+# one long-lived session shared by all handlers, the device is opened on the first call
+session = DeviceSession()
+
+# the sessions of the devices named in the key configs, see signer.devices
+sessions = {}
+sessions_lock = threading.Lock()
+
+# in broker mode the device calls are sent to the broker process, see signer.broker
+broker = None
+
+
+def use_broker(client):
+    global broker
+    broker = client
+
+
+def session_for(config):
+    # the session of the device holding the key, the default device for keys registered with a path only
+    return device_session(key_device(config))
+
+
+def device_session(device_id):
+    if device_id is None:
+        return session
+
+    with sessions_lock:
+        device_session = sessions.get(device_id)
+        if device_session is None:
+            device_session = sessions[device_id] = DeviceSession(**device_address(device_id))
+        return device_session
+
+
+def forget_sessions():
+    # in a forked worker, see DeviceSession.forget
+    session.forget()
+    with sessions_lock:
+        for device_session in sessions.values():
+            device_session.forget()
 
 
 def get_public_key(path):
-    logging.info('Getting public key from trezor')
+    if broker is not None:
+        return broker.get_public_key(path)
+    from trezorlib import tezos
+    from trezorlib.tools import parse_path
+    logging.debug('Getting public key from trezor')
     try:
-        client = trezor_connect()
-        address_n = parse_path(path)
-
-        pk = tezos.get_public_key(client, address_n=address_n)
+        address_n = parse_path(key_path(path))
 
-        client.close()
-        return pk
+        return session_for(path).call(tezos.get_public_key, address_n=address_n)
 
     except Exception as e:
-        logging.error("Error while getting public key ", e)
+        logging.error("Error while getting public key: %s", e)
 
 
 def get_address(path):
+    if broker is not None:
+        return broker.get_address(path)
+    from trezorlib import tezos
+    from trezorlib.tools import parse_path
     try:
-        client = trezor_connect()
-        address_n = parse_path(path)
+        address_n = parse_path(key_path(path))
 
-        pkh = tezos.get_address(client, address_n=address_n)
+        return session_for(path).call(tezos.get_address, address_n=address_n)
+    except Exception as e:
+        logging.error("Error while getting tezos address (pkh): %s", e)
 
-        client.close()
 
-        return pkh
-    except Exception as e:
-        logging.error("Error while getting tezos address (pkh) ", e)
+def get_keys(configs):
+    # pkh and public key of every key config, all derived while holding the device once, so keep the list short
+    # (see Register.register_many). The keys are on the same device, the one of the first config.
+    if broker is not None:
+        return broker.get_keys(configs)
+    from trezorlib import tezos
+    from trezorlib.tools import parse_path
+    address_ns = [parse_path(key_path(config)) for config in configs]
+
+    def derive(client):
+        return [(tezos.get_address(client, address_n), tezos.get_public_key(client, address_n))
+                for address_n in address_ns]
+
+    return session_for(configs[0]).call(derive)
 
 
 def trezor_connect():
-    try:
-        return TrezorClient(get_transport(), ui=ui.ClickUI())
-    except TransportException as e:
-        logging.error("Trezor device not found")
+    return session.client()
 
 
 def sign_non_baking_op(msg, address):
+    if broker is not None:
+        return broker.sign_non_baking_op(msg, address)
+    from trezorlib import tezos
+    from trezorlib.tools import parse_path
     signature = None
     try:
-        client = trezor_connect()
-        address_n = parse_path(address)
-        logging.info("Signing . . .")
-        signature = tezos.sign_tx(client, address_n, msg)
-        logging.info("Generated signature: {}".format(signature.signature))
-        client.close()
+        address_n = parse_path(key_path(address))
+        logging.debug("Signing . . .")
+        signature = session_for(address).call(tezos.sign_tx, address_n, msg)
+        logging.debug("Generated signature: %s", signature.signature)
     except Exception as e:
-        logging.error("Error in trezor signing", e)
+        logging.error("Error in trezor signing: %s", e)
 
     return signature.signature
 
 
 def sign_baking(msg, address):
+    if broker is not None:
+        return broker.sign_baking(msg, address)
+    from trezorlib import tezos
+    from trezorlib.tools import parse_path
     signature = None
     try:
-        client = trezor_connect()
-        address_n = parse_path(address)
-        signature = tezos.sign_baker_op(client, address_n, msg, show_display=True)
-        client.close()
+        address_n = parse_path(key_path(address))
+        signature = session_for(address).call(tezos.sign_baker_op, address_n, msg, show_display=True)
     except Exception as e:
-        logging.error("Error in trezor signing", e)
+        logging.error("Error in trezor signing: %s", e)
 
     return signature.signature
 
 
 # will be removed
 def start_staking():
+    if broker is not None:
+        return broker.start_staking()
+    from trezorlib import tezos
     logging.info("Staking about to start")
-    client = trezor_connect()
 
-    tezos.control_baking(client)
-    client.close()
+    session.call(tezos.control_baking)
+    session.staking = True
 
 
 def reset_device():
+    if broker is not None:
+        return broker.reset_device()
+    from trezorlib import device
     logging.info("Setup device and generate new seed.")
-    client = trezor_connect()
     try:
-        device.reset(client)
+        session.call(device.reset)
     except Exception as e:
-        logging.error("Error device is initialized", e)
-
-    client.close()
+        logging.error("Error device is initialized: %s", e)
 
 
 def change_pin():
+    if broker is not None:
+        return broker.change_pin()
+    from trezorlib import device
     logging.info("Setup device and generate new seed.")
-    client = trezor_connect()
+    ret = None
     try:
-        ret = device.change_pin(client)
+        ret = session.call(device.change_pin)
     except Exception as e:
-        logging.error("Can not change pin", e)
+        logging.error("Can not change pin: %s", e)
 
-    client.close()
     return ret
-
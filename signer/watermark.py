@@ -0,0 +1,143 @@
+import fcntl
+import logging
+import os
+import threading
+
+WATERMARKS_FILE = 'signer/watermarks.log'
+
+
+class WatermarkError(Exception):
+    pass
+
+
+class HighWatermark(object):
+    # Highest signed level per (pkh, chain_id, operation kind), kept in memory and backed by an append-only log.
+    # Every accepted level is one "pkh chain_id kind level" line. The log is locked with flock while checking,
+    # so the gunicorn workers sharing it see each other's levels; it is compacted into a snapshot now and then.
+
+    # rewrite the log once it holds this many records
+    COMPACT_AFTER = 10000
+
+    def __init__(self, filename=None, fsync=True):
+        # without a filename the watermarks are only kept in memory
+        self.filename = filename
+        self.fsync = fsync
+        self.lock = threading.Lock()
+
+        self.marks = {}
+        self._fd = None
+        self._offset = 0
+        self._records = 0
+
+        if filename is not None:
+            self._open()
+
+    def get(self, pkh, chain_id, kind):
+        return self.marks.get((pkh, chain_id, kind))
+
+    def check(self, pkh, chain_id, kind, level):
+        # reject levels at or below the high watermark, otherwise raise the watermark to level.
+        # The level is recorded before the device signs, a failed signature can not be retried at the same level.
+        key = (pkh, chain_id, kind)
+        with self.lock:
+            if self._fd is None:
+                self._raise_watermark(key, level)
+                return
+
+            self._lock_file()
+            try:
+                self._catch_up()
+                self._raise_watermark(key, level)
+                self._append(key, level)
+
+                if self._records > self.COMPACT_AFTER:
+                    self._compact()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reopen(self):
+        # a forked worker shares the descriptor, and with it the file lock, with its parent: open its own
+        self.lock = threading.Lock()
+        if self.filename is not None:
+            self._open()
+
+    def _raise_watermark(self, key, level):
+        current = self.marks.get(key)
+        if current is not None and level <= current:
+            raise WatermarkError("Level {} of {} for {} is not above the high watermark {}".format(
+                level, key[2], key[0], current))
+        self.marks[key] = level
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+        self._fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        self.marks = {}
+        self._offset = 0
+        self._records = 0
+        self._catch_up()
+
+    def _lock_file(self):
+        # after a compaction by another process our descriptor points to the replaced file, reopen it
+        while True:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            if os.stat(self.filename).st_ino == os.fstat(self._fd).st_ino:
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._open()
+
+    def _catch_up(self):
+        # read only the records appended since the last check, by this or by another process
+        size = os.fstat(self._fd).st_size
+        if size <= self._offset:
+            return
+
+        data = os.pread(self._fd, size - self._offset, self._offset)
+
+        # a torn record (crash in the middle of a write) has no newline and is ignored
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                pkh, chain_id, kind, level = line.decode().split(' ')
+                key = (pkh, chain_id, kind)
+                level = int(level)
+            except ValueError:
+                logging.warning("Skipping invalid watermark record {}".format(line))
+                continue
+
+            if level > self.marks.get(key, -1):
+                self.marks[key] = level
+            self._records += 1
+
+        self._offset += end
+
+    def _append(self, key, level):
+        # called with the log locked and caught up: anything past the offset is a torn record of a crashed
+        # process, cut it off, the record appended after it would be glued to it and skipped on the next start
+        if os.fstat(self._fd).st_size > self._offset:
+            logging.warning("Truncating torn watermark record at offset %s", self._offset)
+            os.ftruncate(self._fd, self._offset)
+
+        record = self._record(key, level)
+        os.write(self._fd, record)
+        if self.fsync:
+            os.fsync(self._fd)
+        self._offset += len(record)
+        self._records += 1
+
+    def _compact(self):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as myfile:
+            myfile.write(b''.join(self._record(key, level) for key, level in self.marks.items()))
+            myfile.flush()
+            os.fsync(myfile.fileno())
+        os.replace(tmp_filename, self.filename)
+
+        # the lock of the old file is released with its descriptor
+        self._open()
+        logging.info("Compacted watermarks into {} records".format(self._records))
+
+    @staticmethod
+    def _record(key, level):
+        return '{} {} {} {}\n'.format(key[0], key[1], key[2], level).encode()
@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+# priority classes of the device queue, derived from the watermark byte, lower runs first
+PRIORITY_BLOCK = 0
+PRIORITY_ENDORSEMENT = 1
+PRIORITY_TRANSACTION = 2
+PRIORITY_ADMIN = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_BLOCK: 'block',
+    PRIORITY_ENDORSEMENT: 'endorsement',
+    PRIORITY_TRANSACTION: 'transaction',
+    PRIORITY_ADMIN: 'admin',
+}
+
+WATERMARK_PRIORITIES = {
+    1: PRIORITY_BLOCK,
+    2: PRIORITY_ENDORSEMENT,
+    3: PRIORITY_TRANSACTION,
+}
+
+# a baking signature which is not produced within this time has missed its slot anyway (seconds)
+DEFAULT_DEADLINES = {
+    PRIORITY_BLOCK: 30.0,
+    PRIORITY_ENDORSEMENT: 30.0,
+}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def priority_for(msg_bytes):
+    return WATERMARK_PRIORITIES.get(msg_bytes[0], PRIORITY_ADMIN) if msg_bytes else PRIORITY_ADMIN
+
+
+def parse_budget(value):
+    # the time budget in milliseconds sent by the client, None without one. Checked before the request is
+    # parsed, a malformed value must not fail the request after the watermark was raised
+    if value is None or value == '':
+        return None
+    try:
+        budget_ms = float(value)
+    except ValueError:
+        raise ValueError("Invalid deadline {!r}, expected milliseconds".format(value))
+    if not math.isfinite(budget_ms) or budget_ms <= 0:
+        raise ValueError("Invalid deadline {!r}, expected a positive number of milliseconds".format(value))
+    return budget_ms
+
+
+def deadline_for(priority, budget_ms=None):
+    # absolute (monotonic) deadline of a request, budget_ms (see parse_budget) overrides the default
+    if budget_ms is not None:
+        return time.monotonic() + budget_ms / 1000
+    timeout = DEFAULT_DEADLINES.get(priority)
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+class QueueStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def add(self, wait):
+        self.count += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "expired": self.expired,
+            "mean_wait_ms": self.total_wait / self.count * 1000 if self.count else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class DeviceWorker(object):
+    # Owns the device: every device call is queued and executed by one dedicated thread,
+    # callers get a future back and stay free to accept and parse the next request.
+    # Queued calls run by priority class (blocks, endorsements, transactions, the rest),
+    # by deadline within a class, and calls whose deadline passed while waiting are dropped.
+
+    def __init__(self, name='device-worker'):
+        self.name = name
+        self.stats = dict((priority, QueueStats()) for priority in PRIORITY_NAMES)
+
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, func, *args, priority=PRIORITY_ADMIN, deadline=None):
+        future = Future()
+        entry = (priority, deadline if deadline is not None else float('inf'), next(self._sequence),
+                 time.monotonic(), future, func, args)
+
+        with self._condition:
+            self._ensure_started()
+            heapq.heappush(self._queue, entry)
+            self._condition.notify()
+
+        return future
+
+    def queue_stats(self):
+        return dict((PRIORITY_NAMES[priority], stats.to_dict()) for priority, stats in self.stats.items())
+
+    def _ensure_started(self):
+        # the thread is started lazily, so importing the app (and forking gunicorn workers) does not spawn it
+        if self._thread is None:
+            thread = threading.Thread(target=self._run, name=self.name)
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                priority, deadline, _, queued_at, future, func, args = heapq.heappop(self._queue)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            now = time.monotonic()
+            stats = self.stats[priority]
+            stats.add(now - queued_at)
+
+            if now > deadline:
+                stats.expired += 1
+                logging.warning("Dropping expired %s request after %.0f ms in queue",
+                                PRIORITY_NAMES[priority], (now - queued_at) * 1000)
+                future.set_exception(DeadlineExceeded("Deadline exceeded while waiting for the device"))
+                continue
+
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                logging.error("Error in device worker: %s", e)
+                future.set_exception(e)
+
+
+class QueueStatsResource(object):
+
+    def __init__(self, worker):
+        # a DeviceWorker or a DevicePool, anything with queue_stats()
+        self.worker = worker
+
+    def on_get(self, req, resp):
+        resp.content_type = 'application/json'
+        resp.body = json.dumps(self.worker.queue_stats())
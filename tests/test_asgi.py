@@ -0,0 +1,220 @@
+import asyncio
+import json
+import threading
+import time
+
+import falcon
+import pytest
+from falcon import testing
+
+from signer import trezor_handler
+from signer.asgi import AsgiApp
+from signer.batch import BatchResource
+from signer.middleware import RequestRecorder, RequireJSON
+from signer.profiling import RequestProfiler
+from signer.sign import KeysResource
+from signer.worker import (DeadlineExceeded, DeviceWorker, PRIORITY_BLOCK, PRIORITY_ENDORSEMENT,
+                           PRIORITY_TRANSACTION)
+
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+
+def request(app, method, path, body=b'', content_type=b'application/json', headers=()):
+    sent = []
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', content_type)] + list(headers)}
+    return app(scope, receive, send), sent
+
+
+def make_app(monkeypatch, sign):
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    monkeypatch.setattr(trezor_handler, 'sign_non_baking_op', sign)
+
+    keys_resource = KeysResource({"tz1a": "m/44'/1729'/0'"})
+    api = falcon.API()
+    api.add_route('/keys/{pkh}', keys_resource)
+    api.add_route('/keys/{pkh}/batch', BatchResource(keys_resource))
+    return AsgiApp(api, keys_resource)
+
+
+def test_device_calls_are_serialized(monkeypatch):
+    running = []
+
+    def sign(msg, path):
+        running.append(path)
+        assert len(running) == 1
+        time.sleep(0.01)
+        running.pop()
+        return "edsig"
+
+    app = make_app(monkeypatch, sign)
+    requests = [request(app, 'POST', '/keys/tz1a', json.dumps(DELEGATION).encode()) for _ in range(5)]
+
+    async def run():
+        await asyncio.gather(*[coroutine for coroutine, _ in requests])
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+    for _, sent in requests:
+        assert sent[0]['status'] == 200
+        assert json.loads(sent[1]['body']) == {"signature": "edsig"}
+
+
+def test_unknown_key_and_content_type(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+
+    unknown, unknown_sent = request(app, 'POST', '/keys/tz1b', json.dumps(DELEGATION).encode())
+    text, text_sent = request(app, 'POST', '/keys/tz1a', b'text', b'text/plain')
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(unknown, text))
+
+    assert unknown_sent[0]['status'] == 500
+    assert text_sent[0]['status'] == 415
+
+
+def test_raw_body_and_body_size(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+
+    raw, raw_sent = request(app, 'POST', '/keys/tz1a', bytes.fromhex(DELEGATION), b'application/octet-stream')
+    large, large_sent = request(app, 'POST', '/keys/tz1a', bytes(KeysResource.MAX_BODY_SIZE + 1),
+                                b'application/octet-stream')
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(raw, large))
+
+    assert raw_sent[0]['status'] == 200
+    assert raw_sent[1]['body'] == b'{"signature": "edsig"}'
+    assert large_sent[0]['status'] == 413
+
+
+def test_raw_body_on_the_falcon_api(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+    api = falcon.API(middleware=[RequireJSON()])
+    api.add_route('/keys/{pkh}', app.keys_resource)
+    client = testing.TestClient(api)
+
+    raw = client.simulate_post('/keys/tz1a', body=bytes.fromhex(DELEGATION),
+                               headers={'Content-Type': 'application/octet-stream'})
+    assert raw.status == falcon.HTTP_200
+    assert raw.json == json.loads(client.simulate_post('/keys/tz1a', body=json.dumps(DELEGATION),
+                                                       headers={'Content-Type': 'application/json'}).text)
+
+    large = client.simulate_post('/keys/tz1a', body=bytes(KeysResource.MAX_BODY_SIZE + 1),
+                                 headers={'Content-Type': 'application/octet-stream'})
+    assert large.status == falcon.HTTP_413
+    text = client.simulate_post('/keys/tz1a', body='text', headers={'Content-Type': 'text/plain'})
+    assert text.status == falcon.HTTP_415
+
+
+def test_batch_does_not_wait_on_the_device_worker(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+
+    batch, batch_sent = request(app, 'POST', '/keys/tz1a/batch', json.dumps([DELEGATION, "zz"]).encode())
+    asyncio.get_event_loop().run_until_complete(asyncio.wait_for(batch, 5))
+
+    assert batch_sent[0]['status'] == 200
+    assert [list(item.keys())[0] for item in json.loads(batch_sent[1]['body'])] == ["signature", "error"]
+    # the worker is free for the next signature
+    assert app.worker.submit(lambda: "free").result(timeout=1) == "free"
+
+    # a batch may be larger than a single body, not larger than its own limit
+    large, large_sent = request(app, 'POST', '/keys/tz1a/batch', json.dumps(["00" * 40000] * 2).encode())
+    too_large, too_large_sent = request(app, 'POST', '/keys/tz1a/batch', bytes(BatchResource.MAX_BODY_SIZE + 1))
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(large, too_large))
+    assert large_sent[0]['status'] == 200
+    assert too_large_sent[0]['status'] == 413
+
+
+def test_profiler_and_recorder_see_the_sign_requests(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+    app.profiler = RequestProfiler()
+    app.recorder = RequestRecorder(str(tmp_path / 'corpus.jsonl'))
+    app.profiler.arm(2)
+
+    sign, _ = request(app, 'POST', '/keys/tz1a', json.dumps(DELEGATION).encode())
+    batch, _ = request(app, 'POST', '/keys/tz1a/batch', json.dumps([DELEGATION]).encode())
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(sign, batch))
+
+    assert app.profiler.remaining == 0
+    assert app.profiler.result is not None
+    with open(str(tmp_path / 'corpus.jsonl')) as myfile:
+        record = json.loads(myfile.read())
+    assert (record["pkh"], record["payload"], record["status"]) == ("tz1a", DELEGATION, 200)
+
+
+def test_malformed_deadline_is_refused_before_the_watermark(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+    checks = []
+    monkeypatch.setattr(app.keys_resource.watermarks, 'check', lambda *args: checks.append(args))
+
+    bad, bad_sent = request(app, 'POST', '/keys/tz1a', json.dumps(DELEGATION).encode(),
+                            headers=[(b'x-signer-deadline', b'soon')])
+    asyncio.get_event_loop().run_until_complete(bad)
+    assert bad_sent[0]['status'] == 400
+
+    api = falcon.API()
+    api.add_route('/keys/{pkh}', app.keys_resource)
+    for value in ('soon', '-5', 'nan'):
+        result = testing.TestClient(api).simulate_post('/keys/tz1a', body=json.dumps(DELEGATION),
+                                                      headers={'X-Signer-Deadline': value})
+        assert result.status == falcon.HTTP_400
+    assert checks == []
+
+
+BLOCK = "013bb717ee0002c68501aac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5000000005c36115504cd38e4e70d5668a28b65dddb6fa82edf8f631553895735625cf0d183b7b05d6e0000001100000001000000000800000000005a62a2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a9f0a252cb0e501e000003b3fb8058de0aca200"
+
+
+def test_watermark_check_does_not_stop_the_loop(monkeypatch):
+    app = make_app(monkeypatch, lambda msg, path: "edsig")
+    monkeypatch.setattr(trezor_handler, 'sign_baking', lambda msg, path: "edsig")
+    order = []
+    release = threading.Event()
+
+    def check(*args):
+        # e.g. an fsync on a slow disk
+        release.wait(2)
+        order.append('watermark')
+    monkeypatch.setattr(app.keys_resource.watermarks, 'check', check)
+
+    block, block_sent = request(app, 'POST', '/keys/tz1a', json.dumps(BLOCK).encode())
+    delegation, delegation_sent = request(app, 'POST', '/keys/tz1a', json.dumps(DELEGATION).encode())
+
+    async def run():
+        blocked = asyncio.ensure_future(block)
+        await delegation
+        order.append('delegation')
+        release.set()
+        await blocked
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+    assert order == ['delegation', 'watermark']
+    assert block_sent[0]['status'] == 200
+    assert delegation_sent[0]['status'] == 200
+
+
+def test_worker_runs_baking_first_and_drops_expired():
+    worker = DeviceWorker()
+    order = []
+    release = threading.Event()
+
+    # keep the worker busy while the other calls are queued
+    blocker = worker.submit(release.wait)
+    transaction = worker.submit(order.append, 'transaction', priority=PRIORITY_TRANSACTION)
+    endorsement = worker.submit(order.append, 'endorsement', priority=PRIORITY_ENDORSEMENT)
+    expired = worker.submit(order.append, 'expired', priority=PRIORITY_BLOCK, deadline=time.monotonic())
+    block = worker.submit(order.append, 'block', priority=PRIORITY_BLOCK)
+    release.set()
+
+    for future in (blocker, transaction, endorsement, block):
+        future.result(timeout=1)
+    with pytest.raises(DeadlineExceeded):
+        expired.result(timeout=1)
+
+    assert order == ['block', 'endorsement', 'transaction']
+    assert worker.queue_stats()['block']['expired'] == 1
@@ -0,0 +1,69 @@
+import hashlib
+import json
+
+import falcon
+import pytest
+from falcon import testing
+from trezorlib import _ed25519
+
+from signer import trezor_handler
+from signer.authorized import (Authorized, AuthorizedKeys, AuthenticationError, authentication_digest,
+                               public_key_hash)
+from signer.encoding import b58encode_check, EDPK_PREFIX, EDSIG_PREFIX
+from signer.sign import KeysResource
+
+PKH = "tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+SECRET = hashlib.sha256(b'authorized baker').digest()
+PUBLIC_KEY = _ed25519.publickey_unsafe(SECRET)
+
+
+def authentication(pkh, msg_bytes, secret=SECRET):
+    public_key = _ed25519.publickey_unsafe(secret)
+    signature = _ed25519.signature_unsafe(authentication_digest(pkh, msg_bytes), secret, public_key)
+    return b58encode_check(EDSIG_PREFIX, signature)
+
+
+def test_authenticate():
+    keys = AuthorizedKeys([b58encode_check(EDPK_PREFIX, PUBLIC_KEY)])
+    msg_bytes = bytes.fromhex(DELEGATION)
+    signature = authentication(PKH, msg_bytes)
+
+    keys.authenticate(PKH, msg_bytes, signature)
+    assert len(keys.verified) == 1
+    # a retry is answered from the verified requests
+    keys.authenticate(PKH, msg_bytes, signature)
+    assert len(keys.verified) == 1
+
+    with pytest.raises(AuthenticationError):
+        keys.authenticate(PKH, msg_bytes + b'\0', signature)
+    with pytest.raises(AuthenticationError):
+        keys.authenticate(PKH, msg_bytes, authentication(PKH, msg_bytes, hashlib.sha256(b'other').digest()))
+    with pytest.raises(AuthenticationError):
+        keys.authenticate(PKH, msg_bytes, None)
+
+    # without authorized keys nothing is checked
+    AuthorizedKeys().authenticate(PKH, msg_bytes, None)
+
+
+def test_sign_requests_need_authentication(monkeypatch):
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    monkeypatch.setattr(trezor_handler, 'sign_non_baking_op', lambda msg, path: "edsig")
+
+    authorized_keys = AuthorizedKeys([b58encode_check(EDPK_PREFIX, PUBLIC_KEY)])
+    api = falcon.API()
+    api.add_route('/keys/{pkh}', KeysResource({PKH: "m/44'/1729'/0'"}, authorized_keys=authorized_keys))
+    api.add_route('/authorized_keys', Authorized(authorized_keys))
+    client = testing.TestClient(api)
+
+    assert client.simulate_get('/authorized_keys').json == {"authorized_keys": [public_key_hash(PUBLIC_KEY)]}
+
+    body = json.dumps(DELEGATION)
+    refused = client.simulate_post('/keys/' + PKH, body=body)
+    assert refused.status == falcon.HTTP_401
+
+    signature = authentication(PKH, bytes.fromhex(DELEGATION))
+    signed = client.simulate_post('/keys/' + PKH, body=body, params={'authentication': signature})
+    assert signed.status == falcon.HTTP_200
+    assert signed.json == {"signature": "edsig"}
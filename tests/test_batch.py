@@ -0,0 +1,79 @@
+import json
+import threading
+
+import falcon
+from falcon import testing
+
+from signer import trezor_handler
+from signer.batch import BatchResource
+from signer.sign import KeysResource
+from signer.worker import PRIORITY_TRANSACTION
+
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+
+def test_batch_signing_keeps_order(monkeypatch):
+    # sign without a device, the parsed message is passed through as it is
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    monkeypatch.setattr(trezor_handler, 'sign_non_baking_op', lambda msg, path: "sig:{}".format(path))
+
+    keys_resource = KeysResource({"tz1a": "m/44'/1729'/0'", "tz1b": "m/44'/1729'/1'"})
+    api = falcon.API()
+    api.add_route('/keys/{pkh}/batch', BatchResource(keys_resource))
+
+    body = [DELEGATION, "zz", {"pkh": "tz1b", "data": DELEGATION}, {"pkh": "tz1c", "data": DELEGATION}]
+    result = testing.TestClient(api).simulate_post('/keys/tz1a/batch', body=json.dumps(body))
+
+    assert result.status == falcon.HTTP_200
+    assert [list(item.keys())[0] for item in result.json] == ["signature", "error", "signature", "error"]
+    assert result.json[0]["signature"] == "sig:m/44'/1729'/0'"
+    assert result.json[2]["signature"] == "sig:m/44'/1729'/1'"
+
+
+def test_batch_rejects_non_list():
+    api = falcon.API()
+    api.add_route('/keys/{pkh}/batch', BatchResource(KeysResource({})))
+
+    result = testing.TestClient(api).simulate_post('/keys/tz1a/batch', body=json.dumps(DELEGATION))
+
+    assert result.status == falcon.HTTP_400
+
+
+def test_batch_body_size():
+    api = falcon.API()
+    api.add_route('/keys/{pkh}/batch', BatchResource(KeysResource({})))
+    client = testing.TestClient(api)
+
+    result = client.simulate_post('/keys/tz1a/batch', body=bytes(BatchResource.MAX_BODY_SIZE + 1))
+    assert result.status == falcon.HTTP_413
+    # larger than a single body is fine
+    result = client.simulate_post('/keys/tz1a/batch', body=json.dumps(["00" * KeysResource.MAX_BODY_SIZE]))
+    assert result.status == falcon.HTTP_200
+
+
+ENDORSEMENT = "02e3e15e6053f552f0e22a364259848b1e13f124cbae330569f10777e9fa1b1cd8ea57dac0000a00055507"
+
+
+def test_mixed_batch_does_not_hold_back_endorsements(monkeypatch):
+    order = []
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    monkeypatch.setattr(trezor_handler, 'sign_baking', lambda msg, path: order.append('endorsement') or "sig")
+    monkeypatch.setattr(trezor_handler, 'sign_non_baking_op', lambda msg, path: order.append('batch') or "sig")
+
+    keys_resource = KeysResource({"tz1a": "m/44'/1729'/0'"})
+    batch = BatchResource(keys_resource)
+    worker = keys_resource.worker
+
+    release = threading.Event()
+    worker.submit(release.wait)
+    worker.submit(order.append, 'transaction', priority=PRIORITY_TRANSACTION)
+    jobs = batch.submit("tz1a", [DELEGATION, ENDORSEMENT])
+    # the endorsement is a job of its own, with the deadline of an endorsement
+    assert len(jobs) == 2
+    assert sorted(entry[1] for entry in worker._queue)[0] != float('inf')
+    release.set()
+
+    results = [future.result(timeout=1) for _, future in jobs]
+    assert [indexes for indexes, _ in jobs] == [[0], [1]]
+    assert results == [[{"signature": "sig"}], [{"signature": "sig"}]]
+    assert order == ['endorsement', 'transaction', 'batch']
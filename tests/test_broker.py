@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from signer import trezor_handler
+from signer.broker import Broker, BrokerClient, BrokerServer, RemoteWatermark
+from signer.devices import DevicePool
+from signer.session import DeviceSession
+from signer.watermark import HighWatermark, WatermarkError
+from signer.worker import DeviceWorker
+
+PATH = "m/44'/1729'/0'"
+
+
+@pytest.fixture
+def broker(monkeypatch, tmp_path):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+    added = {}
+
+    class Registry(object):
+        def add_many(self, keys_config):
+            added.update(keys_config)
+
+    path = str(tmp_path / 'broker.sock')
+    server = BrokerServer(path, Broker(DevicePool(DeviceWorker()), HighWatermark(), Registry()))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield BrokerClient(path), added
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_device_calls_go_through_the_broker(broker):
+    client, _ = broker
+    address = client.get_address(PATH)
+
+    assert address == trezor_handler.get_address(PATH)
+    assert client.get_public_key(PATH).startswith("edpk")
+    assert "devices" not in client.queue_stats()
+    assert client.get_keys([PATH]) == [(address, client.get_public_key(PATH))]
+
+
+def test_signature_of_a_proto_message(broker):
+    from trezorlib import messages
+    client, _ = broker
+    msg = messages.TezosSignTx(branch=bytes(32), delegation=messages.TezosDelegationOp(
+        source=bytes(21), fee=1420, counter=1, gas_limit=10100, storage_limit=0, delegate=bytes(21)))
+
+    signature = client.sign_non_baking_op(msg, PATH)
+    assert signature.startswith("edsig")
+    assert signature == trezor_handler.sign_non_baking_op(msg, PATH)
+
+
+def test_watermarks_and_registry_are_kept_by_the_broker(broker):
+    client, added = broker
+    watermarks = RemoteWatermark(client)
+
+    watermarks.check("tz1pkh", "7a06a770", 'block', 10)
+    with pytest.raises(WatermarkError):
+        watermarks.check("tz1pkh", "7a06a770", 'block', 10)
+    watermarks.check("tz1pkh", "7a06a770", 'endorsement', 10)
+
+    client.add_keys({"tz1pkh": PATH})
+    assert added == {"tz1pkh": PATH}
+
+
+def test_reconnects_to_a_restarted_broker(broker):
+    client, _ = broker
+    client.get_address(PATH)
+    # the server side of the connection went away
+    client.local.sock.shutdown(2)
+
+    assert client.get_address(PATH).startswith("tz1")
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from signer import session as session_module
+from signer import trezor_handler
+from signer.devices import DevicePool, device_address, key_path
+from signer.metrics import Timer
+from signer.worker import DeviceWorker
+
+
+def test_key_configs():
+    assert key_path("m/44'/1729'/0'") == "m/44'/1729'/0'"
+    assert key_path({"path": "m/44'/1729'/0'", "device": "webusb:001:4"}) == "m/44'/1729'/0'"
+    assert device_address("webusb:001:4") == {"path": "webusb:001:4"}
+    assert device_address("3A1B9C0E5F7D2E4A6B8C0D1E") == {"serial": "3A1B9C0E5F7D2E4A6B8C0D1E"}
+
+
+def test_devices_sign_in_parallel():
+    pool = DevicePool(DeviceWorker())
+    # each call waits for the call on the other device, which only works when both run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def sign(msg, config):
+        barrier.wait()
+        return config["device"]
+
+    first = pool.submit({"path": "m/44'/1729'/0'", "device": "A"}, sign, "msg")
+    second = pool.submit({"path": "m/44'/1729'/1'", "device": "B"}, sign, "msg")
+
+    assert (first.result(), second.result()) == ("A", "B")
+    assert set(pool.queue_stats()["devices"]) == {"A", "B"}
+
+
+def test_fail_over_to_standby(monkeypatch):
+    pool = DevicePool(DeviceWorker())
+    calls = []
+
+    def sign(msg, config):
+        calls.append(config["device"])
+        if config["device"] == "A":
+            raise IOError("device unplugged")
+        return "signed by {}".format(config["device"])
+
+    timer = Timer()
+    future = pool.submit({"path": "m/44'/1729'/0'", "device": "A", "standby": "B"}, timer.wrap(sign), "msg")
+    assert future.result() == "signed by B"
+    assert calls == ["A", "B"]
+    # every stage once, the failed attempt apart
+    assert [name for name, _ in timer.stages] == ['queue_wait', 'device_failed', 'standby_queue_wait',
+                                                  'standby_device_sign']
+
+    without_standby = pool.submit({"path": "m/44'/1729'/0'", "device": "A"}, sign, "msg")
+    with pytest.raises(IOError):
+        without_standby.result()
+
+    # in broker mode the broker fails over
+    monkeypatch.setattr(trezor_handler, 'broker', object())
+    del calls[:]
+    with pytest.raises(IOError):
+        pool.submit({"path": "m/44'/1729'/0'", "device": "A", "standby": "B"}, sign, "msg").result()
+    assert calls == ["A"]
+
+
+def test_keys_are_resolved_on_their_device(monkeypatch):
+    monkeypatch.setattr(session_module, 'DEVICE_BACKEND', 'simulator')
+    monkeypatch.setattr(trezor_handler, 'sessions', {})
+
+    config = {"path": "m/44'/1729'/0'", "device": "webusb:001:4"}
+    address = trezor_handler.get_address(config)
+
+    assert address.startswith("tz1")
+    assert trezor_handler.session_for(config) is trezor_handler.sessions["webusb:001:4"]
+    assert trezor_handler.session_for(config).client().features.device_id == "webusb:001:4"
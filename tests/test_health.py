@@ -0,0 +1,67 @@
+import threading
+
+import falcon
+from falcon import testing
+
+from signer import trezor_handler
+from signer.devices import DevicePool
+from signer.health import DeviceMonitor, HealthResource
+from signer.session import DeviceSession
+from signer.worker import DeviceWorker
+
+
+def make_client(monitor):
+    api = falcon.API()
+    api.add_route('/health', HealthResource(monitor))
+    return testing.TestClient(api)
+
+
+def test_health_serves_the_cached_state(monkeypatch):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+    monitor = DeviceMonitor(DevicePool(DeviceWorker()))
+    client = make_client(monitor)
+
+    assert client.simulate_get('/health').status == falcon.HTTP_503
+
+    monitor.beat()
+    result = client.simulate_get('/health')
+
+    assert result.status == falcon.HTTP_200
+    state = result.json["devices"]["default"]
+    assert state["connected"] is True
+    assert state["unlocked"] is True
+    assert state["staking"] is False
+    assert state["features"]["label"] == "simulator"
+
+
+def test_unreachable_device(monkeypatch):
+    class Unplugged(DeviceSession):
+        def _connect(self):
+            raise IOError("no device")
+
+    monkeypatch.setattr(trezor_handler, 'session', Unplugged())
+    monitor = DeviceMonitor(DevicePool(DeviceWorker()))
+    monitor.beat()
+
+    result = make_client(monitor).simulate_get('/health')
+    assert result.status == falcon.HTTP_503
+    assert result.json["devices"]["default"]["connected"] is False
+    assert result.json["devices"]["default"]["error"] == "no device"
+
+
+def test_busy_device_gets_one_heartbeat(monkeypatch):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+    worker = DeviceWorker()
+    monitor = DeviceMonitor(DevicePool(worker), interval=0.2)
+
+    # e.g. a transaction waiting for the button
+    release = threading.Event()
+    worker.submit(release.wait)
+    monitor.beat()
+    monitor.beat()
+    assert len(worker._queue) == 1
+
+    release.set()
+    monitor.beat()
+    assert monitor.pending == {}
+    assert monitor.state()["default"]["connected"] is True
@@ -0,0 +1,56 @@
+import io
+import json
+import logging
+import queue
+
+from signer.logs import DroppingQueueHandler, JsonFormatter, SamplingFilter, REQUEST_LOGGER, setup_logging
+
+
+def make_record(name, level, msg, *args):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_sampling_only_drops_request_logs():
+    sampling = SamplingFilter(0)
+
+    assert not sampling.filter(make_record(REQUEST_LOGGER, logging.INFO, "Signing received data for %s", "tz1a"))
+    assert sampling.filter(make_record(REQUEST_LOGGER, logging.ERROR, "Error in signing"))
+    assert sampling.filter(make_record('root', logging.INFO, "Reset Device"))
+
+
+def test_json_formatter():
+    line = JsonFormatter().format(make_record(REQUEST_LOGGER, logging.INFO, "Signing received data for %s", "tz1a"))
+
+    entry = json.loads(line)
+    assert entry["message"] == "Signing received data for tz1a"
+    assert entry["level"] == "INFO"
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(make_record('root', logging.INFO, "first"))
+    handler.handle(make_record('root', logging.INFO, "second"))
+
+    assert handler.dropped == 1
+
+
+def test_records_are_queued_unformatted():
+    handler = DroppingQueueHandler(queue.Queue())
+    handler.handle(make_record('root', logging.INFO, "Registering %s", "tz1a"))
+
+    record = handler.queue.get_nowait()
+    assert (record.msg, record.args) == ("Registering %s", ("tz1a",))
+
+
+def test_records_are_written_by_the_listener():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    stream = io.StringIO()
+    try:
+        listener = setup_logging(logging.INFO, 'json', 1, stream)
+        logging.info("Registering %s", "tz1a")
+        listener.stop()
+    finally:
+        root.handlers, root.level = handlers, level
+
+    assert json.loads(stream.getvalue())["message"] == "Registering tz1a"
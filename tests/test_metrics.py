@@ -0,0 +1,68 @@
+import json
+import os
+
+import falcon
+from falcon import testing
+
+from signer import metrics as metrics_module
+from signer import sign, trezor_handler
+from signer.metrics import Metrics, MetricsResource
+from signer.middleware import RequireJSON
+from signer.sign import KeysResource
+
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+
+def test_histogram_rendering(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.observe('parse', 0.00002, 'delegation', 'tz1a')
+    metrics.observe('parse', 2.0, 'delegation', 'tz1a')
+    metrics.count('delegation', 'tz1a', 'ok')
+
+    text = metrics.render()
+
+    labels = 'stage="parse",kind="delegation",pkh="tz1a"'
+    assert 'signer_stage_seconds_bucket{{{},le="5e-05"}} 1'.format(labels) in text
+    assert 'signer_stage_seconds_bucket{{{},le="+Inf"}} 2'.format(labels) in text
+    assert 'signer_stage_seconds_count{{{}}} 2'.format(labels) in text
+    assert 'signer_requests_total{kind="delegation",pkh="tz1a",status="ok"} 1' in text
+
+
+def test_sign_request_records_stages(tmp_path, monkeypatch):
+    metrics = Metrics(str(tmp_path))
+    monkeypatch.setattr(metrics_module, 'metrics', metrics)
+    monkeypatch.setattr(sign, 'metrics', metrics)
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    monkeypatch.setattr(trezor_handler, 'sign_non_baking_op', lambda msg, path: "sig")
+
+    api = falcon.API(middleware=[RequireJSON(exempt_paths=('/metrics',))])
+    api.add_route('/keys/{pkh}', KeysResource({"tz1a": "m/44'/1729'/0'"}))
+    api.add_route('/metrics', MetricsResource())
+    client = testing.TestClient(api)
+
+    result = client.simulate_post('/keys/tz1a', body=json.dumps(DELEGATION),
+                                  headers={'Content-Type': 'application/json'})
+    assert result.status == falcon.HTTP_200
+
+    text = client.simulate_get('/metrics', headers={'Accept': 'text/plain'}).text
+    for stage in ('json_decode', 'hex_decode', 'parse', 'queue_wait', 'device_sign', 'serialize', 'total'):
+        assert 'signer_stage_seconds_count{{stage="{}",kind="delegation",pkh="tz1a"}} 1'.format(stage) in text
+    assert 'signer_requests_total{kind="delegation",pkh="tz1a",status="ok"} 1' in text
+
+
+def test_counters_of_a_dead_worker_are_kept(tmp_path, monkeypatch):
+    worker = Metrics(str(tmp_path))
+    worker.count('delegation', 'tz1a', 'ok')
+    worker.observe('parse', 0.001, 'delegation', 'tz1a')
+    worker.flush()
+    # the file of another worker, which exits
+    (tmp_path / 'metrics-4242.json').write_text(open(str(tmp_path / 'metrics-{}.json'.format(os.getpid()))).read())
+    monkeypatch.setattr(Metrics, '_alive', staticmethod(lambda pid: pid != 4242))
+
+    total = 'signer_requests_total{kind="delegation",pkh="tz1a",status="ok"} 2'
+    count = 'signer_stage_seconds_count{stage="parse",kind="delegation",pkh="tz1a"} 2'
+    for _ in range(2):
+        text = worker.render()
+        assert total in text
+        assert count in text
+    assert not (tmp_path / 'metrics-4242.json').exists()
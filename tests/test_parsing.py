@@ -1,4 +1,5 @@
 import pytest
+from signer import decoders
 from signer.sign import KeysResource
 
 
@@ -108,3 +109,103 @@ def test_parse_delegation_with_reveal():
 
     parsed = rs.parse_delegation_with_reveal(bytes.fromhex("03a4f206a45ff89c2f660d84b91b4c2b2cbd2c02b8bffba41dd364693cefbfd0fc0700005f450441f41ee11eee78a31d1e1e55627c783bd6eb098c07904e00000612ffd3ad44a335c620f6e2f6ce7ffdea0ee1ea835a661b9f6f3c2376836b0a0a00005f450441f41ee11eee78a31d1e1e55627c783bd68a098d07f44e00ff005f450441f41ee11eee78a31d1e1e55627c783bd6"))
     assert parsed == delegation
+
+
+def test_parse_block_header_with_seed_nonce_hash():
+    rs = KeysResource({})
+
+    parsed_block_header = rs.parse_block(bytes.fromhex("013bb717ee0002c68501aac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5000000005c36115504cd38e4e70d5668a28b65dddb6fa82edf8f631553895735625cf0d183b7b05d6e0000001100000001000000000800000000005a62a2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a9f0a252cb0e501e000003b3fb8058de0aca2ff1db0b1d7e1f4a8c3b2b7e0bd4e2e1c0c2f5b5c6a39d1d8c9e6b1cb4a5a3f6a7b"))
+
+    assert parsed_block_header["block_header"]["presence_of_field_seed_nonce_hash"] is True
+    assert parsed_block_header["block_header"]["seed_nonce_hash"] == "1db0b1d7e1f4a8c3b2b7e0bd4e2e1c0c2f5b5c6a39d1d8c9e6b1cb4a5a3f6a7b"
+    assert parsed_block_header["block_header"]["level"] == 0x0002c685
+
+
+def test_parse_proposal():
+    proposal = {
+        "branch": "9b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd0",
+        "proposal": {
+            "source": "001e65c88ae6317cd62a638c8abd1e71c83c847500",
+            "period": 10,
+            "proposals": [
+                "3b3fb8058de0aca2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a",
+                "aac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5",
+            ],
+        },
+    }
+
+    rs = KeysResource({})
+
+    parsed = rs.parse_proposal(bytes.fromhex("039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd005001e65c88ae6317cd62a638c8abd1e71c83c8475000000000a000000403b3fb8058de0aca2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4aaac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5"))
+    assert parsed == proposal
+
+
+def test_parse_ballot():
+    ballot = {
+        "branch": "9b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd0",
+        "ballot": {
+            "source": "001e65c88ae6317cd62a638c8abd1e71c83c847500",
+            "period": 10,
+            "proposal": "3b3fb8058de0aca2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a",
+            "ballot": 1,
+        },
+    }
+
+    rs = KeysResource({})
+
+    parsed = rs.parse_ballot(bytes.fromhex("039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd006001e65c88ae6317cd62a638c8abd1e71c83c8475000000000a3b3fb8058de0aca2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a01"))
+    assert parsed == ballot
+
+
+BRANCH = "9b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd0"
+SOURCE = "00005f450441f41ee11eee78a31d1e1e55627c783bd6"
+REVEAL = "07" + SOURCE + "eb098c07904e00" + "000612ffd3ad44a335c620f6e2f6ce7ffdea0ee1ea835a661b9f6f3c2376836b0a"
+# fee 1162, counter 909, gas 10100, storage 257, amount 1000000, to tz1, parameters 0x0000000203 (unit)
+TRANSACTION = "08" + SOURCE + "8a098d07f44e8102" + "c0843d" + "00005f450441f41ee11eee78a31d1e1e55627c783bd6" + "ff" + "000000020200"
+
+
+def test_parse_transaction_with_reveal():
+    rs = KeysResource({})
+
+    parsed = rs.parse_tx(bytes.fromhex("03" + BRANCH + REVEAL + TRANSACTION))
+
+    assert parsed["branch"] == BRANCH
+    assert parsed["reveal"]["counter"] == 908
+    assert parsed["transaction"] == {
+        "source": {"tag": 0, "hash": SOURCE[2:]},
+        "fee": 1162,
+        "counter": 909,
+        "gas_limit": 10100,
+        "storage_limit": 257,
+        "amount": 1000000,
+        "destination": {"tag": 0, "hash": "005f450441f41ee11eee78a31d1e1e55627c783bd6"},
+        "parameters": "000000020200",
+    }
+    assert rs.operation_kind(bytes.fromhex("03" + BRANCH + REVEAL + TRANSACTION)) == "transaction"
+
+
+def test_parse_origination():
+    # manager, balance 5000000, spendable, not delegatable, no delegate, script with code and storage
+    origination = ("09" + SOURCE + "8a098d07f44e8102" + "001e65c88ae6317cd62a638c8abd1e71c83c847500" + "c096b102" +
+                   "ff00" + "00" + "ff" + "0000000102" + "0000000100")
+
+    parsed = KeysResource({}).parse_tx(bytes.fromhex("03" + BRANCH + origination))
+
+    assert parsed["origination"]["balance"] == 5000000
+    assert parsed["origination"]["spendable"] is True
+    assert parsed["origination"]["delegatable"] is False
+    assert "delegate" not in parsed["origination"]
+    assert parsed["origination"]["script"] == "00000001020000000100"
+
+
+def test_batched_transactions_are_rejected():
+    rs = KeysResource({"tz1a": "m/44'/1729'/0'"})
+    payouts = bytes.fromhex("03" + BRANCH + TRANSACTION + TRANSACTION)
+
+    assert decoders.content_kinds(payouts) == ["transaction", "transaction"]
+    with pytest.raises(decoders.UnsupportedOperation):
+        rs.prepare("tz1a", payouts)
+
+
+def test_truncated_transaction():
+    assert KeysResource({}).parse_tx(bytes.fromhex("03" + BRANCH + TRANSACTION[:-4])) is None
@@ -0,0 +1,57 @@
+import pytest
+
+from signer.policy import Policy, PolicyError
+from signer.sign import KeysResource
+
+ENDORSEMENT = "02e3e15e6053f552f0e22a364259848b1e13f124cbae330569f10777e9fa1b1cd8ea57dac0000a00055507"
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+# the delegate of DELEGATION
+DELEGATE = "0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+
+def decode(msg):
+    msg_bytes = bytes.fromhex(msg)
+    rs = KeysResource({})
+    return rs.policy_kind(msg_bytes), rs.decode_message(msg_bytes)
+
+
+def test_chain_ids():
+    kind, endorsement = decode(ENDORSEMENT)
+
+    Policy({"chain_ids": ["e3e15e60"]}).check(kind, endorsement)
+    with pytest.raises(PolicyError):
+        Policy({"chain_ids": ["NetXdQprcVkpaWU"]}).check(kind, endorsement)
+
+
+def test_kinds_fee_and_gas():
+    kind, delegation = decode(DELEGATION)
+
+    Policy({"kinds": ["delegation"], "max_fee": 0, "max_gas": 200}).check(kind, delegation)
+    with pytest.raises(PolicyError):
+        Policy({"kinds": ["block", "endorsement"]}).check(kind, delegation)
+    with pytest.raises(PolicyError):
+        Policy({"max_gas": 199}).check(kind, delegation)
+
+
+def test_delegates():
+    kind, delegation = decode(DELEGATION)
+
+    Policy({"delegates": [DELEGATE]}).check(kind, delegation)
+    with pytest.raises(PolicyError):
+        Policy({"delegates": ["tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"]}).check(kind, delegation)
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        Policy({"max_amount": 1})
+    with pytest.raises(ValueError):
+        Policy({"kinds": ["transfer"]})
+
+
+def test_rejected_before_the_watermark():
+    config = {"path": "m/44'/1729'/0'", "policy": {"chain_ids": ["NetXdQprcVkpaWU"]}}
+    keys_resource = KeysResource({"tz1a": config})
+
+    with pytest.raises(PolicyError):
+        keys_resource.prepare("tz1a", bytes.fromhex(ENDORSEMENT))
+    assert keys_resource.watermarks.get("tz1a", "e3e15e60", "endorsement") is None
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import falcon
+from falcon import testing
+
+from signer.profiling import MemorySnapshot, Profile, RequestProfile, RequestProfiler, StackSampler
+
+TOKEN = 'secret'
+ADMIN = {'X-Admin-Token': TOKEN}
+
+
+class Keys(object):
+    def on_get(self, req, resp, pkh):
+        resp.body = '{}'
+
+
+def make_client(profiler=None, token=TOKEN):
+    profiler = profiler or RequestProfiler()
+    api = falcon.API(middleware=[profiler])
+    api.add_route('/keys/{pkh}', Keys())
+    api.add_route('/admin/profile', Profile(token))
+    api.add_route('/admin/profile/requests', RequestProfile(profiler, token))
+    api.add_route('/admin/memory', MemorySnapshot(token))
+    return testing.TestClient(api)
+
+
+def test_admin_token():
+    assert make_client().simulate_get('/admin/memory').status == falcon.HTTP_403
+    assert make_client(token=None).simulate_get('/admin/memory', headers=ADMIN).status == falcon.HTTP_404
+
+
+def test_sampler_folds_stacks():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, name='waiting')
+    thread.start()
+
+    sampler = StackSampler()
+    sampler.sample()
+    stop.set()
+    thread.join()
+
+    stacks = [stack for stack in sampler.counts if stack.startswith('waiting;')]
+    assert len(stacks) == 1
+    assert stacks[0].endswith('wait (threading.py:{})'.format(threading.Condition.wait.__code__.co_firstlineno))
+
+
+def test_profile_of_the_next_requests():
+    client = make_client()
+    assert client.simulate_get('/admin/profile/requests', headers=ADMIN).status == falcon.HTTP_404
+
+    assert client.simulate_post('/admin/profile/requests', params={'count': 2}, headers=ADMIN).status == \
+        falcon.HTTP_202
+    assert client.simulate_post('/admin/profile/requests', headers=ADMIN).status == falcon.HTTP_409
+
+    client.simulate_get('/keys/tz1a')
+    assert client.simulate_get('/admin/profile/requests', headers=ADMIN).json == {"remaining": 1}
+    client.simulate_get('/keys/tz1a')
+
+    result = client.simulate_get('/admin/profile/requests', headers=ADMIN)
+    assert result.status == falcon.HTTP_200
+    assert result.headers['content-type'].startswith('text/plain')
+
+
+def test_timed_profile_does_not_block():
+    client = make_client()
+    assert client.simulate_get('/admin/profile', headers=ADMIN).status == falcon.HTTP_404
+
+    result = client.simulate_post('/admin/profile', params={'seconds': -1}, headers=ADMIN)
+    assert result.status == falcon.HTTP_202
+    assert result.json == {"seconds": 1}
+    assert client.simulate_post('/admin/profile', headers=ADMIN).status == falcon.HTTP_409
+    assert client.simulate_get('/admin/profile', headers=ADMIN).status == falcon.HTTP_202
+
+    time.sleep(1.2)
+    result = client.simulate_get('/admin/profile', headers=ADMIN)
+    assert result.status == falcon.HTTP_200
+    assert result.headers['content-type'].startswith('text/plain')
+
+
+def test_memory_snapshot_diff():
+    client = make_client()
+    try:
+        assert client.simulate_get('/admin/memory', headers=ADMIN).json == {"tracing": True, "top": []}
+        grown = [bytearray(1024) for _ in range(100)]
+
+        result = client.simulate_get('/admin/memory', headers=ADMIN).json
+        assert result["top"][0]["size_diff"] >= 100 * 1024
+        assert any('test_profiling.py' in line for line in result["top"][0]["traceback"])
+        del grown
+    finally:
+        assert client.simulate_get('/admin/memory', params={'stop': 'true'}, headers=ADMIN).json == \
+            {"tracing": False}
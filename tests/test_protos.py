@@ -0,0 +1,27 @@
+from trezorlib import messages
+from trezorlib.protobuf import dict_to_proto
+
+from signer import decoders, protos
+
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+PROPOSAL = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd005001e65c88ae6317cd62a638c8abd1e71c83c8475000000000a000000403b3fb8058de0aca2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4aaac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5"
+
+
+def test_same_message_as_dict_to_proto():
+    msg_bytes = bytes.fromhex(DELEGATION)
+    operation = decoders.decode_transaction_like(msg_bytes)
+    # the contract id of the source, this trezorlib only has its hash
+    operation["delegation"]["source"] = operation["delegation"]["source"]["hash"]
+
+    built = protos.build(messages.TezosSignTx, decoders.read_transaction_like(msg_bytes))
+
+    assert built == dict_to_proto(messages.TezosSignTx, operation)
+    assert built.delegation.delegate == bytes.fromhex("0049a35041e4be130977d51419208ca1d487cfb2e7")
+
+
+def test_repeated_fields():
+    built = protos.build(messages.TezosSignTx, decoders.read_transaction_like(bytes.fromhex(PROPOSAL)))
+
+    assert built.proposal.period == 10
+    assert [proposal.hex() for proposal in built.proposal.proposals] == \
+        decoders.decode_proposal(bytes.fromhex(PROPOSAL))["proposal"]["proposals"]
@@ -0,0 +1,54 @@
+from signer import trezor_handler
+from signer.public_keys import PublicKeyCache
+
+PK = "edpkuMbLqcxJFZvLBmWsoQvqtsoUyTekmYG4xqV7dxWtf8oAdb5qUv"
+
+
+def test_public_key_cache_hits_device_once(tmp_path, monkeypatch):
+    calls = []
+
+    def get_public_key(path):
+        calls.append(path)
+        return PK
+
+    monkeypatch.setattr(trezor_handler, 'get_public_key', get_public_key)
+    cache = PublicKeyCache(str(tmp_path / 'public_keys.json'))
+
+    pkh = "tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"
+    assert cache.fetch(pkh, "m/44'/1729'/3'") == PK
+    assert cache.fetch(pkh, "m/44'/1729'/3'") == PK
+    assert calls == ["m/44'/1729'/3'"]
+
+    # the cache survives a restart
+    assert PublicKeyCache(cache.filename).get(pkh) == PK
+
+
+def test_public_key_cache_clear(tmp_path):
+    cache = PublicKeyCache(str(tmp_path / 'public_keys.json'))
+    cache.put("tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1", "edpk")
+    cache.clear()
+
+    assert PublicKeyCache(cache.filename).get("tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1") is None
+
+
+def test_cache_without_a_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = PublicKeyCache()
+    cache.put("tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1", PK)
+
+    assert cache.get("tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1") == PK
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_keys_cached_by_another_worker(tmp_path):
+    filename = str(tmp_path / 'public_keys.json')
+    worker_1 = PublicKeyCache(filename)
+    worker_2 = PublicKeyCache(filename)
+
+    worker_1.put("tz1a", PK)
+    assert worker_2.get("tz1a") == PK
+
+    # neither drops the keys of the other
+    worker_2.put("tz1b", PK)
+    worker_1.put_many({"tz1c": PK})
+    assert PublicKeyCache(filename).public_keys == {"tz1a": PK, "tz1b": PK, "tz1c": PK}
@@ -0,0 +1,75 @@
+import json
+
+import falcon
+import pytest
+from falcon import testing
+
+from signer import configuration, trezor_handler
+from signer.configuration import Register, expand_template
+from signer.public_keys import PublicKeyCache
+from signer.registry import KeyRegistry
+from signer.session import DeviceSession
+
+
+def test_expand_template():
+    assert expand_template("m/44'/1729'/{0..2}'") == ["m/44'/1729'/0'", "m/44'/1729'/1'", "m/44'/1729'/2'"]
+    with pytest.raises(ValueError):
+        expand_template("m/44'/1729'/0'")
+    with pytest.raises(ValueError):
+        expand_template("m/44'/{0..1}'/{0..1}'")
+    with pytest.raises(ValueError):
+        expand_template("m/44'/1729'/{0..100000}'")
+
+
+def test_bulk_registration(tmp_path, monkeypatch):
+    session = DeviceSession(backend='simulator')
+    monkeypatch.setattr(trezor_handler, 'session', session)
+    monkeypatch.setattr(configuration, 'KEYS_PER_JOB', 2)
+    calls = []
+    call = session.call
+    monkeypatch.setattr(session, 'call', lambda func, *args, **kwargs: calls.append(func) or call(func, *args, **kwargs))
+
+    registry = KeyRegistry(str(tmp_path / 'known_keys.json'))
+    public_keys = PublicKeyCache(str(tmp_path / 'public_keys.json'))
+    api = falcon.API()
+    api.add_route('/register', Register(registry, public_keys))
+    client = testing.TestClient(api)
+
+    result = client.simulate_post('/register', body=json.dumps(
+        {"template": "m/44'/1729'/{0..4}'", "policy": {"kinds": ["endorsement"]}}))
+
+    assert result.status == falcon.HTTP_200
+    keys = result.json["keys"]
+    assert len(keys) == 5
+    # derived in jobs of two keys, signatures can run between them
+    assert len(calls) == 3
+
+    first = list(keys)[0]
+    assert first == trezor_handler.get_address("m/44'/1729'/0'")
+    assert registry[first] == {"path": "m/44'/1729'/0'", "policy": {"kinds": ["endorsement"]}}
+    assert public_keys.get(first) == keys[first]
+    with open(registry.log_filename) as myfile:
+        assert len(myfile.readlines()) == 5
+
+
+def test_registration_keeps_the_policy(tmp_path, monkeypatch):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+    registry = KeyRegistry(str(tmp_path / 'known_keys.json'))
+    api = falcon.API()
+    api.add_route('/register', Register(registry, PublicKeyCache(), token='secret'))
+    client = testing.TestClient(api)
+
+    config = {"path": "m/44'/1729'/0'", "policy": {"kinds": ["endorsement"]}}
+    pkh = client.simulate_post('/register', body=json.dumps(config)).json["pkh"]
+    assert client.simulate_post('/register', body=json.dumps(config)).status == falcon.HTTP_200
+
+    # without the policy
+    assert client.simulate_post('/register', body=json.dumps("m/44'/1729'/0'")).status == falcon.HTTP_409
+    assert client.simulate_post('/register', body=json.dumps(
+        {"template": "m/44'/1729'/{0..1}'"})).status == falcon.HTTP_409
+    assert client.simulate_put('/register', body=json.dumps("m/44'/1729'/0'")).status == falcon.HTTP_403
+    assert registry[pkh] == config
+
+    result = client.simulate_put('/register', body=json.dumps("m/44'/1729'/0'"), headers={'X-Admin-Token': 'secret'})
+    assert result.status == falcon.HTTP_200
+    assert registry[pkh] == "m/44'/1729'/0'"
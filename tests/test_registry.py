@@ -0,0 +1,59 @@
+import json
+
+from signer.registry import KeyRegistry
+
+
+def make_registry(tmp_path):
+    filename = tmp_path / 'known_keys.json'
+    filename.write_text(json.dumps({"tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1": "m/44'/1729'/3'"}))
+    return str(filename)
+
+
+def test_registry_loads_snapshot(tmp_path):
+    registry = KeyRegistry(make_registry(tmp_path))
+
+    assert "tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1" in registry
+    assert registry["tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"] == "m/44'/1729'/3'"
+    assert "tz1b" not in registry
+
+
+def test_registry_sees_keys_added_by_other_workers(tmp_path):
+    filename = make_registry(tmp_path)
+    worker_1 = KeyRegistry(filename)
+    worker_2 = KeyRegistry(filename)
+
+    worker_1.add("tz1b", "m/44'/1729'/4'")
+    worker_1.add_many({"tz1c": "m/44'/1729'/5'", "tz1d": "m/44'/1729'/6'"})
+
+    assert worker_2["tz1b"] == "m/44'/1729'/4'"
+    assert dict(worker_2) == dict(worker_1)
+    assert len(KeyRegistry(filename)) == 4
+
+
+def test_registry_after_a_torn_record(tmp_path):
+    filename = make_registry(tmp_path)
+    KeyRegistry(filename).add("tz1b", "m/44'/1729'/4'")
+    with open(filename + '.log', 'a') as myfile:
+        myfile.write('{"pkh": "tz1c", "con')
+
+    KeyRegistry(filename).add("tz1d", "m/44'/1729'/6'")
+
+    registry = KeyRegistry(filename)
+    assert registry["tz1d"] == "m/44'/1729'/6'"
+    assert "tz1c" not in registry
+    assert len(registry) == 3
+
+
+def test_registry_compaction(tmp_path, monkeypatch):
+    filename = make_registry(tmp_path)
+    monkeypatch.setattr(KeyRegistry, 'COMPACT_AFTER', 3)
+    worker_1 = KeyRegistry(filename)
+    worker_2 = KeyRegistry(filename)
+    assert "tz1a0" not in worker_2
+
+    for i in range(10):
+        worker_1.add("tz1a{}".format(i), "m/44'/1729'/{}'".format(i))
+
+    assert len(json.loads(open(filename).read())) > 4
+    assert dict(worker_2) == dict(worker_1)
+    assert len(worker_2) == 11
@@ -0,0 +1,39 @@
+import json
+
+import falcon
+from falcon import testing
+
+from benchmarks.replay import Replay, load_records
+from signer import trezor_handler
+from signer.middleware import RequestRecorder
+from signer.session import DeviceSession
+from signer.sign import KeysResource
+
+DELEGATION = "039b8b8bc45d611a3ada20ad0f4b6f0bfd72ab395cc52213a57b14d1fb75b37fd00a0000001e65c88ae6317cd62a638c8abd1e71c83c847500ffd206c80100ff0049a35041e4be130977d51419208ca1d487cfb2e7"
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+    corpus = str(tmp_path / 'corpus.jsonl')
+
+    api = falcon.API(middleware=[RequestRecorder(corpus)])
+    api.add_route('/keys/{pkh}', KeysResource({"tz1a": "m/44'/1729'/0'"}))
+    client = testing.TestClient(api)
+
+    client.simulate_post('/keys/tz1a', body=json.dumps(DELEGATION), params={'authentication': 'edsig'})
+    client.simulate_post('/keys/tz1a', body=bytes.fromhex(DELEGATION),
+                         headers={'Content-Type': 'application/octet-stream'})
+    # neither unknown keys nor undecodable payloads are recorded
+    client.simulate_post('/keys/tz1b', body=json.dumps(DELEGATION))
+    client.simulate_post('/keys/tz1a', body='"zz"')
+
+    records = load_records(corpus)
+    assert [(record["endpoint"], record["pkh"], record["payload"], record["status"]) for record in records] == \
+        [('/keys/{pkh}', 'tz1a', DELEGATION, 200)] * 2
+    assert 'edsig' not in open(corpus).read()
+
+    replay = Replay(records, speed=0)
+    summary = replay.summary(replay.run())
+    assert summary["delegation"]["count"] == 2
+    assert summary["all"]["mismatches"] == 0
+    assert set(summary["all"]["latency_ms"]) == {"p50", "p99", "p99.9"}
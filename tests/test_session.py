@@ -0,0 +1,47 @@
+import pytest
+from trezorlib.transport import TransportException
+from signer.session import DeviceSession
+
+
+class DummySession(DeviceSession):
+    def __init__(self):
+        super(DummySession, self).__init__()
+        self.connects = 0
+
+    def _connect(self):
+        self.connects += 1
+        self._transport = object()
+        self._client = object()
+
+
+def test_session_reuses_client():
+    session = DummySession()
+
+    assert session.call(lambda client: client) is session.call(lambda client: client)
+    assert session.connects == 1
+
+
+def test_session_reconnects_after_transport_error():
+    session = DummySession()
+    calls = []
+
+    def flaky(client):
+        calls.append(client)
+        if len(calls) == 1:
+            raise TransportException("device unplugged")
+        return "signature"
+
+    assert session.call(flaky) == "signature"
+    assert session.connects == 2
+    assert calls[0] is not calls[1]
+
+
+def test_session_gives_up_after_reconnect():
+    session = DummySession()
+
+    def broken(client):
+        raise TransportException("device unplugged")
+
+    with pytest.raises(TransportException):
+        session.call(broken)
+    assert not session.connected
@@ -0,0 +1,77 @@
+from concurrent.futures import Future
+
+import pytest
+
+from signer import trezor_handler
+from signer.sign import KeysResource
+from signer.signatures import SignatureCache
+from signer.watermark import WatermarkError
+
+ENDORSEMENT = "02e3e15e6053f552f0e22a364259848b1e13f124cbae330569f10777e9fa1b1cd8ea57dac0000a00055507"
+
+
+def test_concurrent_requests_share_one_device_call():
+    cache = SignatureCache()
+    signing = Future()
+    calls = []
+
+    def sign():
+        calls.append(1)
+        return signing
+
+    first = cache.submit("tz1a", b"payload", sign)
+    second = cache.submit("tz1a", b"payload", sign)
+    other_key = cache.submit("tz1b", b"payload", lambda: Future())
+
+    signing.set_result("edsig")
+
+    assert first.result() == second.result() == "edsig"
+    assert not other_key.done()
+    assert calls == [1]
+    assert cache.submit("tz1a", b"payload", sign).result() == "edsig"
+    assert calls == [1]
+
+
+def test_failures_are_not_cached():
+    cache = SignatureCache()
+    failed = Future()
+    failed.set_exception(IOError("device unplugged"))
+
+    with pytest.raises(IOError):
+        cache.submit("tz1a", b"payload", lambda: failed).result()
+
+    signed = Future()
+    signed.set_result("edsig")
+    assert cache.submit("tz1a", b"payload", lambda: signed).result() == "edsig"
+
+
+def test_expired_and_evicted_signatures():
+    cache = SignatureCache(max_size=1, ttl=0)
+    signed = Future()
+    signed.set_result("edsig")
+
+    cache.submit("tz1a", b"first", lambda: signed).result()
+    cache.submit("tz1a", b"second", lambda: signed).result()
+
+    assert len(cache) == 1
+    # expired, the device is asked again
+    calls = []
+    cache.submit("tz1a", b"second", lambda: calls.append(1) or signed).result()
+    assert calls == [1]
+
+
+def test_retried_endorsement_passes_the_watermark(monkeypatch):
+    monkeypatch.setattr(KeysResource, 'to_proto', lambda self, msg_bytes, operation: operation)
+    calls = []
+    monkeypatch.setattr(trezor_handler, 'sign_baking', lambda msg, path: calls.append(1) or "edsig")
+
+    keys_resource = KeysResource({"tz1a": "m/44'/1729'/0'"})
+    msg_bytes = bytes.fromhex(ENDORSEMENT)
+
+    assert keys_resource.submit("tz1a", msg_bytes).result() == "edsig"
+    assert keys_resource.submit("tz1a", msg_bytes).result() == "edsig"
+    assert calls == [1]
+
+    keys_resource.signatures.clear()
+    with pytest.raises(WatermarkError):
+        keys_resource.submit("tz1a", msg_bytes)
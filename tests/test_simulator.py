@@ -0,0 +1,18 @@
+from trezorlib import messages
+
+from signer import trezor_handler
+from signer.session import DeviceSession
+
+
+def test_simulator_is_deterministic(monkeypatch):
+    monkeypatch.setattr(trezor_handler, 'session', DeviceSession(backend='simulator'))
+
+    pkh = trezor_handler.get_address("m/44'/1729'/0'")
+    assert pkh.startswith("tz1")
+    assert pkh == trezor_handler.get_address("m/44'/1729'/0'")
+    assert pkh != trezor_handler.get_address("m/44'/1729'/1'")
+    assert trezor_handler.get_public_key("m/44'/1729'/0'").startswith("edpk")
+
+    signature = trezor_handler.sign_non_baking_op(messages.TezosSignTx(branch=bytes(32)), "m/44'/1729'/0'")
+    assert signature.startswith("edsig")
+    assert signature == trezor_handler.sign_non_baking_op(messages.TezosSignTx(branch=bytes(32)), "m/44'/1729'/0'")
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+from signer import startup
+from signer.watermark import HighWatermark
+
+
+def test_signer_does_not_import_trezorlib():
+    code = "import sys, signer.sign, signer.configuration, signer.staking; print('trezorlib' in sys.modules)"
+    output = subprocess.check_output([sys.executable, '-c', code])
+
+    assert output.strip() == b'False'
+
+
+def test_in_worker_waits_for_the_fork(monkeypatch):
+    monkeypatch.setattr(startup, '_after_fork', [])
+    calls = []
+
+    monkeypatch.setattr(startup, 'PRELOAD', True)
+    startup.in_worker(calls.append, 'preloaded')
+    assert calls == []
+
+    startup.run_after_fork()
+    assert calls == ['preloaded']
+
+    monkeypatch.setattr(startup, 'PRELOAD', False)
+    startup.in_worker(calls.append, 'imported in the worker')
+    assert calls == ['preloaded', 'imported in the worker']
+
+
+def test_watermarks_reopen_keeps_levels(tmp_path):
+    watermarks = HighWatermark(str(tmp_path / 'watermarks.log'), fsync=False)
+    watermarks.check('tz1a', 'chain', 'block', 10)
+
+    watermarks.reopen()
+
+    assert watermarks.get('tz1a', 'chain', 'block') == 10
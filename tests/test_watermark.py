@@ -0,0 +1,78 @@
+import pytest
+
+from signer.sign import KeysResource
+from signer.watermark import HighWatermark, WatermarkError
+
+CHAIN_ID = "3bb717ee"
+PKH = "tz1aaVRV1c32b3sDvMQe6SdqmwirSn2okWB1"
+
+
+def test_watermark_rejects_same_and_lower_levels():
+    watermarks = HighWatermark()
+    watermarks.check(PKH, CHAIN_ID, 'block', 100)
+
+    with pytest.raises(WatermarkError):
+        watermarks.check(PKH, CHAIN_ID, 'block', 100)
+    with pytest.raises(WatermarkError):
+        watermarks.check(PKH, CHAIN_ID, 'block', 99)
+
+    # every key, chain and operation kind has its own watermark
+    watermarks.check(PKH, CHAIN_ID, 'endorsement', 100)
+    watermarks.check(PKH, "7a06a770", 'block', 100)
+    watermarks.check(PKH, CHAIN_ID, 'block', 101)
+    assert watermarks.get(PKH, CHAIN_ID, 'block') == 101
+
+
+def test_watermark_log_is_shared_and_survives_restart(tmp_path):
+    filename = str(tmp_path / 'watermarks.log')
+    first = HighWatermark(filename, fsync=False)
+    second = HighWatermark(filename, fsync=False)
+
+    first.check(PKH, CHAIN_ID, 'block', 100)
+    with pytest.raises(WatermarkError):
+        second.check(PKH, CHAIN_ID, 'block', 100)
+
+    # a torn record at the end of the log is ignored
+    with open(filename, 'a') as myfile:
+        myfile.write("{} {} block 5000".format(PKH, CHAIN_ID))
+
+    assert HighWatermark(filename).get(PKH, CHAIN_ID, 'block') == 100
+
+
+def test_watermark_after_a_torn_record(tmp_path):
+    filename = str(tmp_path / 'watermarks.log')
+    HighWatermark(filename, fsync=False).check(PKH, CHAIN_ID, 'block', 100)
+    with open(filename, 'a') as myfile:
+        myfile.write("{} {} blo".format(PKH, CHAIN_ID))
+
+    HighWatermark(filename, fsync=False).check(PKH, CHAIN_ID, 'block', 101)
+
+    assert HighWatermark(filename).get(PKH, CHAIN_ID, 'block') == 101
+    with open(filename) as myfile:
+        assert len(myfile.readlines()) == 2
+
+
+def test_watermark_compaction(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'watermarks.log')
+    monkeypatch.setattr(HighWatermark, 'COMPACT_AFTER', 10)
+    watermarks = HighWatermark(filename, fsync=False)
+    other = HighWatermark(filename, fsync=False)
+
+    for level in range(1, 30):
+        watermarks.check(PKH, CHAIN_ID, 'endorsement', level)
+
+    with open(filename) as myfile:
+        assert len(myfile.readlines()) <= 10
+    with pytest.raises(WatermarkError):
+        other.check(PKH, CHAIN_ID, 'endorsement', 29)
+    other.check(PKH, CHAIN_ID, 'endorsement', 30)
+
+
+def test_sign_request_below_watermark_is_rejected():
+    block = bytes.fromhex("013bb717ee0002c68501aac40470fa66b3ca657f46dba10df233837e14c31e1193505e056ea2116cf5b5000000005c36115504cd38e4e70d5668a28b65dddb6fa82edf8f631553895735625cf0d183b7b05d6e0000001100000001000000000800000000005a62a2877920f3904dd8619b2fb66ebb323cc3b70a7f03e4baaf4a9f0a252cb0e501e000003b3fb8058de0aca200")
+    rs = KeysResource({PKH: "m/44'/1729'/3'"})
+    rs.to_proto = lambda msg_bytes, operation: operation
+    rs.watermarks.check(PKH, CHAIN_ID, 'block', 0x0002c685)
+
+    with pytest.raises(WatermarkError):
+        rs.prepare(PKH, block)